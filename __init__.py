@@ -1,132 +1,88 @@
-from typing import Callable, Optional, Tuple, List
+from typing import Any, Callable, Iterator, Optional, Tuple, List
 from aqt import QEvent, QObject, mw, gui_hooks, QMenu
-from aqt.qt import QAction, qconnect, QKeySequence
-from aqt.editor import Editor, EditorMode
+from aqt.qt import QAction, QFileDialog, qconnect, QKeySequence
+from aqt.browser import Browser
 from aqt.reviewer import Reviewer
-from aqt.utils import tooltip as tooltip_aqt
+from aqt.utils import tooltip as tooltip_aqt, showWarning
 from anki.cards import Card
 from anki.notes import Note
 from anki.template import TemplateRenderOutput
+from anki.consts import MODEL_CLOZE
 from random import choice
 import requests
 import json
-import re
 import time
+import itertools
+import collections
 
 # Multitasking
-import queue
+import asyncio
+import concurrent.futures
 import threading
 
-# Caching
-import sqlite3
-
 # Local imports
 from .config import Config
-from .dialog import WelcomeDialog, SettingsDialog
+from .engine import AsyncEngine
+from .cache import DynamicCache, content_key
+from .lru import LRUCache
+from .clients import PlatformSessions
+from .ratelimit import estimate_tokens
+from .credentials import Credential, CredentialPool, MAX_FAILOVERS_PER_TASK, api_keys, parse_api_keys
+from .retry import RewordingError
+from . import retry
+from . import providers
+from . import markup
+from .metrics import Metrics
+from .dialog import WelcomeDialog, SettingsDialog, BulkProgressDialog
 
 # TO DO:
 # * PRETTIFY FUNCTION NAMES
 # * ORGANIZE CODE INTO SEPARATE FILES (SQL, ETC.) 
 # * MAKE INTUITIVE ERROR MESSAGES FOR RATE LIMITS
-# * STORE AND AUTOSWITCH API KEYS BASED ON RATE LIMITS
 # * CLEAN UI ON MACOS
 
 # Create global variables.
-config_dict = mw.addonManager.getConfig(__name__)
 config = Config(mw.addonManager, __name__, debug = False)
 
-# CACHING
+# METRICS
+# Always recorded; see the Stats tab of the settings dialog.
+stats = Metrics()
 
-def connect_dynamic_db():
-    conn = sqlite3.connect(config.settings.CACHE)
-    return conn, conn.cursor()
-
-def setup_dynamic_db():
-    conn, cursor = connect_dynamic_db()
-    cursor.execute("""
-    CREATE TABLE IF NOT EXISTS id_to_strings (
-        id INTEGER PRIMARY KEY,
-        items TEXT,
-        last_renders TEXT
-    )
-    """)
-    conn.close()
-
-# Debug function declarations
-def clear_dynamic_db():
-    conn, cursor = connect_dynamic_db()
-    cursor.execute("DROP TABLE IF EXISTS id_to_strings")
-    conn.close()
-    setup_dynamic_db()
-
-# Function to look up cached strings by ID
-def get_strings_by_id(id_val: int) -> List[str]:
-    conn, cursor = connect_dynamic_db()
-    cursor.execute("SELECT items FROM id_to_strings WHERE id = ?", (id_val,))
-    result = cursor.fetchone()
-    if config.debug: print(f'SQL strings for {id_val}:', result)
-    conn.commit()
-    conn.close()
-    try:
-        if result and result[0]:
-            return json.loads(result[0])  # Deserialize JSON string to list
-    except Exception as e:
-        if config.debug: print(f'Malformatted strings data for note id {id_val} with {type(e)}:', e)
-
-# Function to look up cached strings by ID
-def get_last_renders_by_id(id_val: int) -> Optional[dict[int, int]]:
-    conn, cursor = connect_dynamic_db()
-    cursor.execute("SELECT last_renders FROM id_to_strings WHERE id = ?", (id_val,))
-    result = cursor.fetchone()
-    if config.debug: print(f'SQL last render for {id_val}:', result)
-    conn.commit()
-    conn.close()
-    try:
-        return {int(x): int(y) for x, y in json.loads(result[0]).items()} if result else None
-    except Exception as e:
-        if config.debug: print(f'Malformatted last renders data for note id {id_val} with {type(e)}:', e)
-        
-# Function to look up all cached info by ID
-def get_all_by_id(id_val: int) -> List[str]:
-    conn, cursor = connect_dynamic_db()
-    cursor.execute("SELECT items, last_renders FROM id_to_strings WHERE id = ?", (id_val,))
-    result = cursor.fetchone()
-    if config.debug: print(f'SQL all for {id_val}:', result)
-    conn.commit()
-    conn.close()
-
-    try:
-        if result and result[0]:
-            texts, last_renders = result
-            return json.loads(texts), {int(x): int(y) for x, y in json.loads(last_renders).items()}  # Deserialize JSON string to list
-    except Exception as e:
-        if config.debug: print(f'Malformatted data for note id {id_val} with {type(e)}:', e)
-
-# Function to set cached strings by ID
-def set_all_by_id(id_val: int, strings: List[str], last_renders: Optional[dict[int, int]]):
-    conn, cursor = connect_dynamic_db()
-    cursor.execute(f"INSERT OR REPLACE INTO id_to_strings (id, items, last_renders) VALUES (?, ?, ?)", (id_val, json.dumps(strings), json.dumps(last_renders)))
-    conn.commit()
-    conn.close()
-
-# Function to set cached strings by ID
-def set_strings_by_id(id_val: int, strings: List[str]):
-    # See if id exists
-    last_render = get_last_renders_by_id(id_val)
-    set_all_by_id(id_val, strings, last_render if last_render is not None else {i: 0 for i, _ in enumerate(strings)})
-
-# Function to set last render by ID
-def set_last_renders_by_id(id_val: int, last_renders: dict[int, int]):
-    # See if id exists
-    strings = get_strings_by_id(id_val)
-    set_all_by_id(id_val, strings if strings is not None else [""] * len(last_renders), last_renders)
-
-# Additional helper function for clearing an entry
-def clear_all_by_id(id_val: int):
-    conn, cursor = connect_dynamic_db()
-    cursor.execute("DELETE FROM id_to_strings WHERE id = ?", (id_val,))
-    conn.commit()
-    conn.close()
+# CACHING
+# Long-lived connections to dynamic.db live in the cache module.
+db = DynamicCache(config.settings.CACHE, debug=config.debug, metrics=stats)
+cache_lock = threading.RLock()
+# Rendered questions, keyed by (note id, content key, text index, ord, note mod time, note type mod time).
+render_cache = LRUCache(config.settings.render_cache_size)
+
+# HTTP SESSIONS
+# One keep-alive session per platform, reused across the whole review session.
+sessions = PlatformSessions(pool_size=config.settings.num_workers, debug=config.debug)
+
+# (connect, read) timeouts for every request to a platform.
+def http_timeout() -> Tuple[float, float]:
+    return (config.settings.connect_timeout_seconds, config.settings.read_timeout_seconds)
+
+# Record the latency and outcome of a request to a platform: the HTTP status, or the kind of failure if there was no response.
+def record_http(platform: str, model: str, start: float, outcome: Any):
+    stats.observe(f'http.{platform}.{model}', time.perf_counter() - start)
+    stats.incr(f'http.{platform}.{model}.{outcome}')
+
+# RATE LIMITING
+# Every API key has its own rate limits; requests go to the healthiest key that has room.
+credentials = CredentialPool(debug=config.debug)
+
+# Estimated tokens for one rewording request: the context and the text going in, and about as much text coming out.
+def estimate_request_tokens(note: Note, platform_settings: dict) -> int:
+    return estimate_tokens(platform_settings.get("context")) + 2 * estimate_tokens(note.fields[0])
+
+# Rewordings are cached by the text they reword and the model and context they were made with,
+# so edited notes get fresh rewordings and notes with the same text share theirs. Keys are those of the
+# active platform unless another is given, e.g. the fallback platform of the credential a text came from.
+def note_content_key(note: Note, platform_index: Optional[int] = None) -> str:
+    platform_index = config.settings.platform_index if platform_index is None else platform_index
+    platform_settings = config.settings.platform_configs[platform_index]
+    return content_key(note.fields[0], platform_settings.get("model"), platform_settings.get("context"))
 
 def _tooltip(*args, **kwargs):
     if config.debug: print(*args, **kwargs)
@@ -135,76 +91,407 @@ def _tooltip(*args, **kwargs):
 def tooltip(*args, **kwargs):
     mw.taskman.run_on_main(lambda: _tooltip(*args, **kwargs))
 
+# A queued rewording of a card's note, along with how many times it has been attempted.
+class RewordingTask:
+
+    def __init__(self, card: Card, priority: int):
+        self.card = card
+        self.priority = priority
+        self.attempts = 0
+        self.failovers = 0 # Rate limits passed on to another key, which do not count as attempts.
+        self.running = False # Picked up by the dispatcher.
+        self.delayed = False # Waiting for a timer to put it back on the queue.
+
 # Manage a queue for tasks.
+# Everything runs as tasks on one asyncio event loop in a background thread (see engine.py): a dispatcher
+# pulls tasks off a priority queue and runs up to `num_workers` of them at a time. Tasks that cannot run yet
+# (because of rate limits or retry backoff) are put back on the queue by a timer once they are eligible.
+# Requests themselves are blocking, so they are run on the engine's executor while the loop waits on them.
+# Rewordings are handed to the main thread to be cached, and a task only finishes once they are.
+#
+# There is at most one pending task per note: queuing a note that is already queued, waiting or
+# running coalesces into the existing task (raising its priority if needed). At most `max_queue_depth`
+# tasks are pending at a time. When the queue is full, a task for a card under review replaces the
+# most recently queued prefetch task that is not running yet; any other new task is dropped.
+#
+# Every pending task is also kept as a job in the dynamic database, with its state, attempts and the
+# time it may next run. Jobs outlive `stop()` and restarts of Anki, and are resumed on the next start.
 class RewordingWorkerQueue:
 
+    PRIORITY_REVIEW = 0
+    PRIORITY_PREFETCH = 1
+    JOB_MAX_AGE_SECONDS = 3 * 24 * 3600 # Jobs older than this are pruned instead of resumed.
+
     # This object must be started and should start when reviewer inits (see hook)
     def __init__(self):
-        self.queue = None
-        self.worker_thread = None
+        self.engine = AsyncEngine(name='dynamic-cards', debug=config.debug)
+        self.queue: Optional[asyncio.PriorityQueue] = None # Only touched from the loop.
+        self.wakeup: Optional[asyncio.Event] = None # Set whenever something is put on the queue, or a batch has waited long enough.
+        self.jobs = set() # The dispatcher and running tasks; the loop itself only keeps weak references to them.
+        self.counter = None
+        self.pending: dict[int, RewordingTask] = {}
+        self.finished_jobs: List[int] = [] # Notes whose jobs are done, to be deleted in one go off the main thread.
+        self.lock = threading.Lock()
         self.running = False
+        self.dropped = 0
         if config.debug: tooltip('Queue initialized.')
 
-    # Start the worker queue if not already started.
-    # Starting a stopped Queue will create a new Queue object; no leftover tasks will be performed first,
-    # making for instant rewording capability.
-    def start(self):
+    # Start the worker queue if not already started. Returns whether the queue was (re)started.
+    # Starting a stopped queue starts a fresh event loop and resumes the jobs left over from before.
+    def start(self) -> bool:
         if not self.running:
-            self.queue = queue.Queue()
+            with self.lock:
+                self.counter = itertools.count() # Keeps tasks of equal priority in FIFO order.
+                self.pending = {}
+            # One spare thread, so that a first-view rewording never waits behind queued requests.
+            self.engine.start(max_blocking=max(1, config.settings.num_workers) + 1)
+            self.engine.run(self._setup()).result()
             self.running = True
-            self.worker_thread = threading.Thread(target=self.worker, daemon=True)
-            self.worker_thread.start()
-            if config.debug: tooltip('Queue started.')
-
-    # Continuously pop tasks off the queue
-    # Do so one-by-one to avoid throttling!
-    def worker(self):
-        while self.running:
-            try:
-                # Block for a maximum of 0.5 seconds.
-                func, args = self.queue.get(timeout=0.5)
-                if func is None: # Dummy item from stop()
+            if config.debug: tooltip(f'Queue started with up to {max(1, config.settings.num_workers)} concurrent requests.')
+            return True
+        return False
+
+    async def _setup(self):
+        self.queue = asyncio.PriorityQueue()
+        self.wakeup = asyncio.Event()
+        self._delete_finished_jobs() # Left over from before the last stop, so that they are not resumed.
+        self._track(asyncio.ensure_future(self._dispatch(asyncio.Semaphore(max(1, config.settings.num_workers)))))
+        self._track(asyncio.ensure_future(self._resume()))
+
+    # Queue the jobs left in the database that are still worth doing (see `_load_resumable`). Jobs that
+    # were waiting to be retried wait out the rest of their delay. Runs on the loop, so that the first
+    # card of a review session does not wait for it.
+    async def _resume(self):
+        resumable = await self.engine.run_blocking(self._load_resumable)
+        now = time.time()
+        resumed = 0
+        for card, priority, attempts, eligible_at in resumable:
+            task = RewordingTask(card, priority)
+            task.attempts = attempts
+            with self.lock:
+                if card.nid in self.pending:
                     continue
-                func(args)
-                self.queue.task_done()
-            except queue.Empty:
-                # Queue was empty, loop again to check self.running.
+                self.pending[card.nid] = task
+                delay = (eligible_at or 0) - now
+                if delay > 0:
+                    task.delayed = True
+                    self.engine.loop.call_later(delay, self._release, self._task_helper, task)
+                else:
+                    self._enqueue(priority, self._task_helper, task)
+            resumed += 1
+        stats.incr('jobs.resumed', resumed)
+        if config.debug and resumed: print(f'Resumed {resumed} wording jobs.')
+
+    # The jobs left in the database (see `DynamicCache.load_jobs`) as (card, priority, attempts, eligible_at),
+    # deleting those no longer worth doing: cards that were deleted, notes that are excluded or have enough
+    # rewordings, and jobs out of retries. Blocking; runs on the engine's executor.
+    def _load_resumable(self) -> List[Tuple[Card, int, int, float]]:
+        stale = []
+        resumable = []
+        platform_settings = config.settings.platform_configs[config.settings.platform_index]
+        for note_id, card_id, priority, attempts, eligible_at in db.load_jobs(self.JOB_MAX_AGE_SECONDS, config.settings.max_queue_depth):
+            try:
+                card = mw.col.get_card(card_id)
+            except Exception: # Deleted cards raise different errors across Anki versions.
+                stale.append(note_id)
+                continue
+            if (card.nid != note_id or attempts > platform_settings.get("num_retries", 3)
+                    or card.note_type()['name'] in config.settings.exclude_note_types):
+                stale.append(note_id)
+                continue
+            texts = db.get_strings_by_key(note_content_key(card.note()))
+            if texts is not None and len(texts) >= platform_settings.get("max_renders", 3):
+                stale.append(note_id)
+                continue
+            resumable.append((card, priority, attempts, eligible_at))
+        if stale:
+            db.delete_jobs(stale)
+        stats.incr('jobs.pruned', len(stale))
+        if config.debug and stale: print(f'Pruned {len(stale)} wording jobs.')
+        return resumable
+
+    def _track(self, job: asyncio.Future) -> asyncio.Future:
+        self.jobs.add(job)
+        job.add_done_callback(self.jobs.discard)
+        return job
+
+    # Number of notes with a pending (queued, waiting or running) rewording.
+    def depth(self) -> int:
+        return len(self.pending)
+
+    def is_full(self) -> bool:
+        return len(self.pending) >= config.settings.max_queue_depth
+
+    def has_pending(self, note_id: int) -> bool:
+        return note_id in self.pending
+
+    # Rewordings of a note that are on their way, to be counted towards `max_renders`.
+    def pending_renders(self, note_id: int) -> int:
+        return 1 if note_id in self.pending else 0
+
+    # Mark a task taken off the queue as running. Returns False for stale entries: tasks that
+    # already finished, were dropped, or were picked up through another entry (after a priority raise),
+    # including tasks that have since been put aside to wait out a delay; their timer queues them again.
+    def _claim(self, task: RewordingTask) -> bool:
+        with self.lock:
+            if self.pending.get(task.card.nid) is not task or task.running or task.delayed:
+                return False
+            task.running = True
+        db.set_job_state(task.card.nid, 'running')
+        return True
+
+    # The task is done, successfully or not; its note may be queued again. Its job is done too,
+    # unless the note was queued again since (after a stop). Jobs are deleted on the loop (or in the
+    # background once stopped), together with those of any other tasks that finished in the meantime.
+    def _finish(self, task: RewordingTask):
+        flush = False
+        with self.lock:
+            current = self.pending.get(task.card.nid)
+            if current is task:
+                del self.pending[task.card.nid]
+            if current is task or current is None:
+                self.finished_jobs.append(task.card.nid)
+                flush = len(self.finished_jobs) == 1
+        if flush:
+            if self.running:
+                self.engine.call_soon(self._delete_finished_jobs)
+            else:
+                mw.taskman.run_in_background(self._delete_finished_jobs)
+
+    def _delete_finished_jobs(self):
+        with self.lock:
+            note_ids, self.finished_jobs = self.finished_jobs, []
+        if note_ids:
+            db.delete_jobs(note_ids)
+
+    # Finish the task on the main thread, after any rewording it handed over there has been cached.
+    def _finish_on_main(self, task: RewordingTask):
+        mw.taskman.run_on_main(lambda: self._finish(task))
+
+    # Cache a new rewording of `note` on the main thread, under the key of the platform that made it.
+    def _deliver(self, card: Card, note: Note, new_text: str, credential: Credential):
+        key = note_content_key(note, credential.platform_index)
+        model = config.settings.platform_configs[credential.platform_index].get("model")
+        original = note.fields[0]
+        card_id = card.id
+        mw.taskman.run_on_main(lambda: deliver_rewording(card_id, new_text, key, model, original))
+
+    # Record the job of a new task (or one whose priority was raised) and put it on the queue. Runs on the loop.
+    def _add(self, priority: int, task: RewordingTask):
+        db.put_job(task.card.nid, task.card.id, priority, task.attempts)
+        self._enqueue(priority, self._task_helper, task)
+
+    # Put a task on the queue. Must run on the loop; see `_enqueue_threadsafe` for other threads.
+    def _enqueue(self, priority: int, func: Callable, task: RewordingTask):
+        self.queue.put_nowait((priority, next(self.counter), func, task))
+        self.wakeup.set()
+
+    def _enqueue_threadsafe(self, priority: int, func: Callable, task: RewordingTask):
+        self.engine.call_soon(self._enqueue, priority, func, task)
+
+    # Continuously pop tasks off the queue, running at most `num_workers` at a time.
+    async def _dispatch(self, limit: asyncio.Semaphore):
+        while True:
+            await limit.acquire()
+            _, _, func, task = await self.queue.get()
+            if not self._claim(task):
+                limit.release()
                 continue
+            tasks = [task]
+            if func == self._task_helper and config.settings.batch_size > 1:
+                tasks = await self._collect_batch(task)
+            job = self._track(asyncio.ensure_future(self._run(func, tasks)))
+            job.add_done_callback(lambda _: limit.release())
+
+    # A task returns None when done, or the number of seconds after which it should be run again.
+    async def _run(self, func: Callable, tasks: List[RewordingTask]):
+        if len(tasks) > 1:
+            await self._batch_task_helper(tasks)
+            return
+        task = tasks[0]
+        retry_in = await func(task)
+        if retry_in is not None:
+            self.schedule(retry_in, func, task)
+        else:
+            self._finish_on_main(task)
+
+    # Run a task on the queue after `delay` seconds. Must run on the loop.
+    def schedule(self, delay: float, func: Callable, task: RewordingTask):
+        with self.lock:
+            task.running = False
+            task.delayed = True
+        db.set_job_state(task.card.nid, 'waiting', attempts=task.attempts, eligible_at=time.time() + delay)
+        self.engine.loop.call_later(delay, self._release, func, task)
+
+    def _release(self, func: Callable, task: RewordingTask):
+        with self.lock:
+            task.delayed = False
+        self._enqueue(task.priority, func, task)
+
+    # Count a failed attempt at a task, and return the delay before retrying it,
+    # or None if the failure cannot be fixed by retrying or the task is out of retries.
+    def _handle_failure(self, task: RewordingTask, error: RewordingError) -> Optional[float]:
+        platform_index = config.settings.platform_index
+        platform_settings = config.settings.platform_configs[platform_index]
+        if (error.kind == retry.RATE_LIMIT and task.failovers < MAX_FAILOVERS_PER_TASK
+                and credentials.available(config.settings) > 0):
+            # Only the key that was used is out of quota (it is cooling down now); another one can take the task.
+            task.failovers += 1
+            stats.incr('failovers')
+            if config.debug: print(f'Rate limited on note {task.card.nid}; failing over to another key.')
+            return 0.0
+        task.attempts += 1
+        if not error.retryable or task.attempts > platform_settings.get("num_retries", 3):
+            stats.incr(f'failures.{error.kind}')
+            if config.debug: print(f'Could not properly reword note {task.card.nid} using platform {platform_index} '
+                                   f'after {task.attempts} attempts (reason: {error.kind}, {str(error)}).')
+            tooltip(f'Error rewording note {task.card.nid}: {str(error)}. Please try again.')
+            return None
+        delay = retry.get_retry_delay(error, task.attempts, platform_settings.get("retry_delay_seconds", 1.0))
+        stats.incr(f'retries.{error.kind}')
+        if config.debug: print(f'Retrying note {task.card.nid} in {delay:.2f}s (attempt {task.attempts}, reason: {error.kind}, {str(error)}).')
+        return delay
+
+    # Gather more rewording tasks to send along with `task`, waiting at most `batch_wait_seconds`
+    # for them to arrive. Anything that is not a batchable rewording task is put back.
+    async def _collect_batch(self, task: RewordingTask) -> List[RewordingTask]:
+        tasks = [task]
+        loop = self.engine.loop
+        deadline = loop.time() + config.settings.batch_wait_seconds
+        while len(tasks) < config.settings.batch_size:
+            if self.queue.empty():
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                # Not asyncio.wait_for, which loses a cancellation that arrives as the wakeup comes in
+                # (on Python 3.11 and earlier), leaving the dispatcher to outlive the loop's shutdown.
+                self.wakeup.clear()
+                timeout = loop.call_later(remaining, self.wakeup.set)
+                try:
+                    await self.wakeup.wait()
+                finally:
+                    timeout.cancel()
+                continue
+            item = self.queue.get_nowait()
+            if item[2] != self._task_helper:
+                self.queue.put_nowait(item)
+                break
+            if self._claim(item[3]):
+                tasks.append(item[3])
+        return tasks
+
+    # Batched task helper method. Notes whose part of the batch failed are queued again
+    # on their own; the whole batch is deferred if the rate limit is reached.
+    async def _batch_task_helper(self, tasks: List[RewordingTask]):
+        retries = {} # Task -> (delay, task function to run it again with)
+        try:
+            notes = [task.card.note() for task in tasks]
+            credential, wait = credentials.acquire(config.settings, lambda platform_settings:
+                                                   sum(estimate_request_tokens(note, platform_settings) for note in notes))
+            if credential is None:
+                stats.incr('rate_limit.deferrals')
+                if config.debug: print(f'Rate limit reached; deferring batch of {len(notes)} notes by {wait:.2f}s.')
+                retries = {task: (wait, self._task_helper) for task in tasks}
+                return
+            try:
+                new_texts = await self.engine.run_blocking(create_new_dynamic_wordings, notes, credential)
+            except RewordingError as e:
+                for task in tasks:
+                    retry_in = self._handle_failure(task, e)
+                    if retry_in is not None:
+                        retries[task] = (retry_in, self._task_helper)
+                return
+            for task, note in zip(tasks, notes):
+                if note.id in new_texts:
+                    self._deliver(task.card, note, new_texts[note.id], credential)
+                else:
+                    retries[task] = (0, self._single_task_helper)
+            if config.debug: tooltip(f'Completed batched wording task for {len(new_texts)} of {len(notes)} notes.')
+        except Exception as e:
+            tooltip(str(e))
+        finally:
+            # Batches cancelled by `stop()` keep their jobs, to be resumed on the next start.
+            for task in tasks if self.running else []:
+                if task in retries:
+                    self.schedule(retries[task][0], retries[task][1], task)
+                else:
+                    self._finish_on_main(task)
+
+    # Same as the task helper, but never batched.
+    async def _single_task_helper(self, task: RewordingTask) -> Optional[float]:
+        return await self._task_helper(task)
 
     # Task helper method
-    def _task_helper(self, card: Card):
+    async def _task_helper(self, task: RewordingTask) -> Optional[float]:
+        card = task.card
         try:
-            new_text = create_new_dynamic_wording(note=card.note())
+            note = card.note()
+            credential, wait = credentials.acquire(config.settings, lambda platform_settings:
+                                                   estimate_request_tokens(note, platform_settings))
+            if credential is None:
+                stats.incr('rate_limit.deferrals')
+                if config.debug: print(f'Rate limit reached; deferring new wording task for card {card.id} by {wait:.2f}s.')
+                return wait
+            new_text = await self.engine.run_blocking(create_new_dynamic_wording, note=note, credential=credential)
             if new_text is not None:
-                update_cached_note_for_card(card=card, new_text=new_text)
+                self._deliver(card, note, new_text, credential)
                 if config.debug: tooltip(f'Completed new wording task for card {card.id}.')
             elif config.debug:
                 print(f'Could not complete new wording task for card {card.id}.')
+        except RewordingError as e:
+            return self._handle_failure(task, e)
         except Exception as e:
             tooltip(str(e))
 
-    # Add new tasks to the queue
-    def add_render_task(self, card: Card):
-        self.queue.put((self._task_helper, card))
-        if config.debug: tooltip(f'Queued card {card.id} for new wording task.')
+    # Pick the task to drop so that a new task of `priority` fits in a full queue:
+    # the most recently queued task of lower priority that is not running yet.
+    def _drop_candidate(self, priority: int) -> Optional[RewordingTask]:
+        for task in reversed(list(self.pending.values())):
+            if task.priority > priority and not task.running:
+                return task
+        return None
 
-    # Stop the queue.
+    # Add new tasks to the queue; safe to call from any thread. Returns whether the note is now pending.
+    # Cards being reviewed right now always go ahead of prefetched cards.
+    def add_render_task(self, card: Card, prefetch: bool = False) -> bool:
+        if not self.running:
+            return False
+        priority = self.PRIORITY_PREFETCH if prefetch else self.PRIORITY_REVIEW
+        with self.lock:
+            task = self.pending.get(card.nid)
+            if task is not None:
+                if priority < task.priority:
+                    task.priority = priority
+                    if not task.running and not task.delayed:
+                        self.engine.call_soon(self._add, priority, task)
+                if config.debug: print(f'Note {card.nid} already has a pending wording task; coalesced card {card.id} into it.')
+                return True
+            if len(self.pending) >= config.settings.max_queue_depth:
+                victim = self._drop_candidate(priority)
+                self.dropped += 1
+                if victim is None:
+                    if config.debug: print(f'Queue is full; dropped new wording task for card {card.id}.')
+                    return False
+                del self.pending[victim.card.nid]
+                self.engine.call_soon(db.delete_jobs, [victim.card.nid])
+                if config.debug: print(f'Queue is full; dropped wording task for note {victim.card.nid} to make room for card {card.id}.')
+            task = self.pending[card.nid] = RewordingTask(card, priority)
+            self.engine.call_soon(self._add, priority, task)
+        if config.debug: tooltip(f'Queued card {card.id} for new wording task{" (prefetch)" if prefetch else ""}.')
+        return True
+
+    # Stop the queue, cancelling queued, waiting and in-flight tasks. Requests already sent finish
+    # in the background, but their rewordings are dropped. Their jobs stay in the database until the next start.
     def stop(self):
         if not self.running:
             return
         self.running = False
-        
-        # Put a dummy item in the queue to unblock the worker if it's waiting
-        # on an empty queue. This allows it to check `self.running` and exit.
-        # If restarted, the current queue will be discarded; thus, this extra
-        # dummy task is not a problem.
-        try:
-            if self.queue:
-                self.queue.put_nowait((None, None))
-        except (queue.Full, AttributeError):
-            # Queue might be full or already gone, which is fine.
-            pass
-        
+        self.engine.stop()
+        self.queue = self.wakeup = None
+        self.jobs = set()
+        db.release_connections() # The loop thread's, now that it has exited.
+        if self.finished_jobs:
+            mw.taskman.run_in_background(self._delete_finished_jobs)
         if config.debug: tooltip(f'Queue stopped.')
 
     # Reset the queue and have it start running again.
@@ -213,26 +500,211 @@ class RewordingWorkerQueue:
         self.start()
         if config.debug: tooltip(f'Queue reset.')
 
+# Generate rewordings for many notes at once (see the Browser's Notes menu), e.g. to prepare a deck overnight.
+# Runs on an event loop of its own, independent of review sessions, but shares the credentials (and so the
+# rate limits) with the review queue. Notes are sent `batch_size` at a time, with up to `num_workers` requests
+# at once, until each has `max_renders` texts; notes that already do are skipped. Rewordings are written to
+# the dynamic database `COMMIT_EVERY` at a time. BulkProgressDialog polls the counters below.
+class BulkGeneration:
+
+    PREPARE_CHUNK = 200 # Notes looked up at a time before letting the requests already running carry on.
+    COMMIT_EVERY = 50   # Rewordings written to the dynamic database per transaction.
+
+    def __init__(self):
+        self.engine = AsyncEngine(name='dynamic-cards-bulk', debug=config.debug)
+        self.future: Optional[concurrent.futures.Future] = None
+        self.results = [] # (note id, key, original, text, model) not written yet. Only touched from the loop.
+        self._reset()
+
+    def _reset(self):
+        self.total = 0     # Rewordings to make.
+        self.done = 0
+        self.failed = 0    # Rewordings given up on after `num_retries` failed attempts.
+        self.skipped = 0   # Notes that are excluded, have enough rewordings, were deleted, or share their text with another.
+        self.preparing = False
+        self.cancelled = False
+        self.error: Optional[str] = None # Why the generation stopped early, if it did.
+        self.started = self.finished = None
+
+    @property
+    def running(self) -> bool:
+        return self.future is not None and not self.future.done()
+
+    def elapsed(self) -> float:
+        if self.started is None:
+            return 0.0
+        return (self.finished or time.monotonic()) - self.started
+
+    # Start generating for the given notes. Returns False if a bulk generation is already running.
+    def start(self, note_ids: List[int]) -> bool:
+        if self.running:
+            return False
+        self._stop_engine() # The idle loop of the previous run, if it is still around.
+        self._reset()
+        self.preparing = True
+        self.started = time.monotonic()
+        self.engine.start(max_blocking=max(1, config.settings.num_workers))
+        future = self.future = self.engine.run(self._generate(list(note_ids)))
+        # The loop is stopped once done, unless another run has started since.
+        future.add_done_callback(lambda _: mw.taskman.run_on_main(lambda: self._stop_engine() if self.future is future else None))
+        return True
+
+    # Stop generating. Rewordings received so far are kept; requests already sent are dropped.
+    def cancel(self):
+        if self.running:
+            self.cancelled = True
+        self._stop_engine()
+
+    # Stop the loop, and close the connections to the dynamic database its threads had open.
+    def _stop_engine(self):
+        self.engine.stop()
+        db.release_connections()
+
+    async def _generate(self, note_ids: List[int]):
+        platform_settings = config.settings.platform_configs[config.settings.platform_index]
+        work = collections.deque() # [note, key, rewordings still needed, failed attempts]
+        jobs = set()
+        try:
+            await self._prepare(note_ids, work, platform_settings.get("max_renders", 3))
+            self.preparing = False
+            limit = asyncio.Semaphore(max(1, config.settings.num_workers))
+            while (work or jobs) and self.error is None:
+                if not work:
+                    # Running jobs may put notes back.
+                    await asyncio.wait(jobs, return_when=asyncio.FIRST_COMPLETED)
+                    continue
+                await limit.acquire()
+                batch = [work.popleft() for _ in range(min(max(1, config.settings.batch_size), len(work)))]
+                job = asyncio.ensure_future(self._reword(batch, work, platform_settings))
+                jobs.add(job)
+                job.add_done_callback(jobs.discard)
+                job.add_done_callback(lambda _: limit.release())
+        finally:
+            for job in list(jobs):
+                job.cancel()
+            self._commit()
+            self.preparing = False
+            self.finished = time.monotonic()
+            if config.debug: print(f'Bulk generation made {self.done} of {self.total} rewordings in {self.elapsed():.1f}s '
+                                   f'({self.failed} failed, {self.skipped} notes skipped).')
+
+    # Work out how many rewordings each note still needs, a chunk of notes at a time.
+    async def _prepare(self, note_ids: List[int], work: collections.deque, max_renders: int):
+        seen_keys = set()
+        for start in range(0, len(note_ids), self.PREPARE_CHUNK):
+            notes = []
+            for note_id in note_ids[start:start + self.PREPARE_CHUNK]:
+                try:
+                    notes.append(mw.col.get_note(note_id))
+                except Exception: # Deleted since it was selected; the error differs across Anki versions.
+                    self.skipped += 1
+            keys = {note.id: note_content_key(note) for note in notes}
+            counts = db.count_texts(list(set(keys.values())))
+            for note in notes:
+                key = keys[note.id]
+                needed = max_renders - counts.get(key, 1)
+                if needed <= 0 or key in seen_keys or note.note_type()['name'] in config.settings.exclude_note_types:
+                    self.skipped += 1
+                    continue
+                seen_keys.add(key)
+                work.append([note, key, needed, 0])
+                self.total += needed
+            await asyncio.sleep(0)
+
+    # Make one rewording for each note of a batch, putting back the notes that need more, or another try.
+    async def _reword(self, batch: List[list], work: collections.deque, platform_settings: dict):
+        notes = [item[0] for item in batch]
+        estimate = lambda settings: sum(estimate_request_tokens(note, settings) for note in notes)
+        credential, wait = credentials.acquire(config.settings, estimate)
+        while credential is None:
+            stats.incr('rate_limit.deferrals')
+            await asyncio.sleep(wait)
+            credential, wait = credentials.acquire(config.settings, estimate)
+        model = config.settings.platform_configs[credential.platform_index].get("model")
+        fallback = credential.platform_index != config.settings.platform_index
+        new_texts = {}
+        try:
+            if len(notes) > 1:
+                new_texts = await self.engine.run_blocking(reword_notes_batch, notes, credential)
+            else:
+                new_texts = {notes[0].id: await self.engine.run_blocking(reword_note, notes[0], credential)}
+        except RewordingError as e:
+            if e.kind == retry.RATE_LIMIT:
+                # The key is cooling down now; the batch goes to another key, or waits for this one.
+                work.extend(batch)
+                return
+            if not e.retryable and credentials.available(config.settings) == 0:
+                self.error = str(e)
+                return
+            await asyncio.sleep(retry.get_retry_delay(e, 1 + max(item[3] for item in batch),
+                                                      platform_settings.get("retry_delay_seconds", 1.0)))
+        for item in batch:
+            note, key = item[0], item[1]
+            new_text = new_texts.get(note.id)
+            if new_text:
+                # Kept under the key of the platform that made it, which only the active one's counts go by.
+                if fallback:
+                    key = note_content_key(note, credential.platform_index)
+                self.results.append((note.id, key, note.fields[0], new_text, model))
+                self.done += 1
+                item[2] -= 1
+                if item[2] > 0:
+                    work.append(item)
+                continue
+            item[3] += 1
+            if item[3] > platform_settings.get("num_retries", 3):
+                self.failed += item[2]
+            else:
+                work.append(item)
+        if len(self.results) >= self.COMMIT_EVERY:
+            self._commit()
+
+    # Write the rewordings received so far in one transaction. Notes kept in memory are dropped from it,
+    # so that they pick up their new rewordings on their next review.
+    def _commit(self):
+        if not self.results:
+            return
+        results, self.results = self.results, []
+        db.append_variants([(key, original, text, model) for _, key, original, text, model in results])
+        for note_id, key, _, _, _ in results:
+            db.touch(key, note_id)
+        stats.incr('bulk.rewordings', len(results))
+        note_ids = {result[0] for result in results}
+        def forget():
+            with cache_lock:
+                for note_id in note_ids:
+                    config.data.remove(note_id)
+        mw.taskman.run_on_main(forget)
+
 # Note entry format for use in the cache.
 class CachedNoteEntry:
 
-    def _find_card_at_ord(self, ord: int):
-        cards = self.note.cards()
-        for card in cards:
-            if card.ord == ord: return card
-        raise ValueError(f'Card with ord {ord} does not exist in cached entry for note {self.note.id}.')
+    # The template used by the card at `ord`; cloze note types render every card from their only template.
+    # Same lookup as Card.template(), without loading the note's cards.
+    @staticmethod
+    def _template_at_ord(note_type: dict, ord: int) -> dict:
+        return note_type['tmpls'][0 if note_type['type'] == MODEL_CLOZE else ord]
 
+    # Renders are memoized; editing the note or its note type changes the key, so stale renders are never used.
+    @stats.timed('get_render')
     def get_render(self, idx: int, ord: int = 0) -> TemplateRenderOutput:
-        note = Note(col=self.note.col, id=self.note.id)
-        note.fields[0] = self.texts[idx]
-        return note.ephemeral_card(
-            ord=ord,
-            custom_note_type=note.note_type(),
-            custom_template=self._find_card_at_ord(ord).template()
-        ).render_output()
-
-    def __init__(self, note: Note, texts: List[str]) -> None:
+        note_type = self.note.note_type()
+        key = (self.note.id, self.key, idx, ord, self.note.mod, note_type['mod'])
+        render = render_cache.get(key)
+        if render is None:
+            note = Note(col=self.note.col, id=self.note.id)
+            note.fields[0] = self.texts[idx]
+            render = note.ephemeral_card(
+                ord=ord,
+                custom_note_type=note_type,
+                custom_template=self._template_at_ord(note_type, ord)
+            ).render_output()
+            render_cache.put(key, render)
+        return render
+
+    def __init__(self, note: Note, key: str, texts: List[str]) -> None:
         self.note = note
+        self.key = key # Content key the texts are cached under.
         self.texts = texts
         self.last_renders = {}
         self.reps = {}
@@ -249,7 +721,7 @@ class KeyPressCacheClearFilter(QObject):
             pressed_key = QKeySequence(key_combination).toString()
             if pressed_key == config.settings.shortcut_clear_current_card:
                 curr_card = mw.reviewer.card
-                if curr_card is not None and curr_card.note().id in config.data.keys():
+                if curr_card is not None and curr_card.note().id in config.data:
                     clear_parent_note_of_card_from_cache(curr_card)
                 else:
                     tooltip('No note to clear from dynamic cache.')
@@ -280,236 +752,430 @@ class KeyPressCacheClearFilter(QObject):
         return super().eventFilter(obj, event)
 
 def poll_cached_note_for_card(card: Card) -> CachedNoteEntry:
-    note = card.note()
-    if note.id in config.data.keys():
-        if config.debug: print(f'Cached note entry exists for note {note.id}.')
-        cne = config.data[note.id]
-        if card.ord not in config.data[note.id].reps.keys():
-            if config.debug: print(f'Added rep information for ord {card.ord} to cached note {note.id}.')
-            cne.reps[card.ord] = card.reps
-        if card.ord not in config.data[note.id].last_renders.keys():
-            if config.debug: print(f'Added last render information for ord {card.ord} to cached note {note.id}.')
-            cne.last_renders[card.ord] = 0
-    else:
-        cached_note = get_all_by_id(note.id)
-        if cached_note:
-            if config.debug:
-                print(f'Cached note entry for note {note.id} exists in the dynamic database, retrieving it.')
-            texts, last_renders = cached_note
-            cne = CachedNoteEntry(note=note, texts=texts)
-            cne.last_renders = last_renders
-            if card.ord not in cne.last_renders.keys():
+    # Workers and the reviewer both create and update entries.
+    with cache_lock:
+        note = card.note()
+        key = note_content_key(note)
+        cne = config.data.get(note.id)
+        if cne is not None and cne.key != key:
+            # The note was edited, or the model or context changed; its rewordings live under another key.
+            if config.debug: print(f'Content of note {note.id} changed; reloading its cached note entry.')
+            cne = None
+        if cne is not None:
+            if config.debug: print(f'Cached note entry exists for note {note.id}.')
+            cne.note = note # Picks up edits to the other fields.
+            if card.ord not in cne.reps.keys():
                 if config.debug: print(f'Added rep information for ord {card.ord} to cached note {note.id}.')
+                cne.reps[card.ord] = card.reps
+            if card.ord not in cne.last_renders.keys():
+                if config.debug: print(f'Added last render information for ord {card.ord} to cached note {note.id}.')
                 cne.last_renders[card.ord] = 0
-            cne.reps[card.ord] = card.reps
-            config.data[note.id] = cne
         else:
-            if config.debug:
-                print(f'Cached note entry for note id {note.id} does not exist; creating a new one.')
-            cne = CachedNoteEntry(note=note, texts=[note.fields[0]])
-            cne.last_renders[card.ord] = 0
-            cne.reps[card.ord] = card.reps
-            config.data[note.id] = cne
-            set_all_by_id(id_val=note.id, strings=[note.fields[0]], last_renders=cne.last_renders) # Create a new entry in the database with the current text.
-    if config.debug: print(f'Retrieved cached note entry {cne}.')
-    return cne
+            cached_note = db.get_all(note.id, key)
+            stats.incr('dynamic_db.hits' if cached_note else 'dynamic_db.misses')
+            if cached_note:
+                if config.debug:
+                    print(f'Cached note entry for note {note.id} exists in the dynamic database, retrieving it.')
+                texts, last_renders, reps = cached_note
+                texts[0] = note.fields[0] # Notes sharing a key may differ in whitespace.
+                cne = CachedNoteEntry(note=note, key=key, texts=texts)
+                cne.last_renders = last_renders
+                if card.ord not in cne.last_renders.keys():
+                    if config.debug: print(f'Added rep information for ord {card.ord} to cached note {note.id}.')
+                    cne.last_renders[card.ord] = 0
+                # Stored reps are only trusted if they can still belong to this card (e.g. not after a reset).
+                cne.reps[card.ord] = reps[card.ord] if reps.get(card.ord, card.reps + 2) <= card.reps + 1 else card.reps
+                config.data.put(note.id, cne)
+            else:
+                if config.debug:
+                    print(f'Cached note entry for note id {note.id} does not exist; creating a new one.')
+                cne = CachedNoteEntry(note=note, key=key, texts=[note.fields[0]])
+                cne.last_renders[card.ord] = 0
+                cne.reps[card.ord] = card.reps
+                config.data.put(note.id, cne)
+                db.create_entry(note_id=note.id, key=key, original=note.fields[0], last_renders=cne.last_renders) # Create a new entry in the database with the current text.
+        db.touch(key, note.id)
+        if config.debug: print(f'Retrieved cached note entry {cne}.')
+        return cne
 
 def update_cached_note_for_card(card: Card,
                                 reps: Optional[int] = None,
                                 last_used_render: Optional[int] = None,
-                                new_text: Optional[str] = None) -> CachedNoteEntry:
-    
-    # Set card intrinsic props.
-    cne = poll_cached_note_for_card(card)
+                                new_text: Optional[str] = None,
+                                key: Optional[str] = None,
+                                model: Optional[str] = None,
+                                original: Optional[str] = None) -> CachedNoteEntry:
+    with cache_lock:
+        # Set card intrinsic props.
+        cne = poll_cached_note_for_card(card)
 
-    if reps is not None:
-        # cce id should match card id already.
-        cne.reps[card.ord] = reps
-        if config.debug: print(f'Updated reps for note {cne.note.id}, ord {card.ord}:', str(cne))
-    if new_text is not None:
-        cne.texts += [new_text]
-        set_all_by_id(id_val=cne.note.id,
-                      strings=cne.texts,
-                      last_renders=cne.last_renders)
-        if config.debug: print(f'Added render for note {cne.note.id}, ord {card.ord}:', str(cne))
-    if last_used_render is not None:
-        assert last_used_render >= 0 and last_used_render < len(cne.texts)
-        cne.last_renders[card.ord] = last_used_render
-        set_last_renders_by_id(id_val=cne.note.id, last_renders=cne.last_renders)
-        if config.debug: print(f'Updated last used render for note {cne.note.id}, ord {card.ord}:', str(cne))
-
-    config.data[cne.note.id] = cne
-    return cne
-
-def create_new_dynamic_wording(note: Note, ord: Optional[int] = None):
+        if reps is not None:
+            # cce id should match card id already.
+            cne.reps[card.ord] = reps
+            if config.debug: print(f'Updated reps for note {cne.note.id}, ord {card.ord}:', str(cne))
+        if new_text is not None:
+            # `key` is the content the new text was generated from (`original`), with the model and context of
+            # the platform that made it. If the note changed in the meantime, or a fallback platform made the
+            # text, it is still kept under that key, but not shown for the note as it is now.
+            key = key or cne.key
+            model = model or config.settings.platform_configs[config.settings.platform_index].get("model")
+            if key == cne.key:
+                db.append_variant(key=key, text=new_text, model=model)
+                cne.texts += [new_text]
+            else:
+                db.append_variants([(key, original or cne.note.fields[0], new_text, model)])
+            if config.debug: print(f'Added render for note {cne.note.id}, ord {card.ord}:', str(cne))
+        if last_used_render is not None:
+            assert last_used_render >= 0 and last_used_render < len(cne.texts)
+            cne.last_renders[card.ord] = last_used_render
+            if config.debug: print(f'Updated last used render for note {cne.note.id}, ord {card.ord}:', str(cne))
+        if reps is not None or last_used_render is not None:
+            db.set_ord_state(id_val=cne.note.id, ord=card.ord,
+                             last_render=cne.last_renders[card.ord], reps=cne.reps.get(card.ord))
+
+        config.data.put(cne.note.id, cne)
+        return cne
+
+# Cache a rewording that arrived in the background, generated from `original` under `key`. Must run on the
+# main thread. The card is loaded again, along with its note: the note may have been edited while the rewording
+# was on its way, in which case the rewording is kept under its key but not shown for the note's new text.
+def deliver_rewording(card_id: int, new_text: str, key: str, model: Optional[str], original: str):
+    try:
+        card = mw.col.get_card(card_id)
+    except Exception: # Deleted cards raise different errors across Anki versions.
+        return
+    update_cached_note_for_card(card=card, new_text=new_text, key=key, model=model, original=original)
+
+def create_new_dynamic_wording(note: Note, credential: Credential, stream: bool = False):
     # print('Making a new cached render for card ' + str(card.id))
-    platform_index = config.settings.platform_index
-    platform_settings = config.settings.platform_configs[platform_index]
+
+    # This is the choke point for the rewording process. If the queue is not running (because the user has killed it),
+    # then we should not attempt to reword the note.
+    global q 
+    if q is not None and isinstance(q, RewordingWorkerQueue) and not q.running:
+        if config.debug: print(f'Queue has been closed; aborting rewording for note {note.id}.')
+        return None
+
+    platform_settings = config.settings.platform_configs[credential.platform_index]
     model = platform_settings.get("model")
     if config.debug: print(f'Creating new dynamic wording for note {note.id} using model \'{model}\'')
     
-    new_text = reword_note(note, ord=ord)
+    new_text = reword_note(note, credential, stream=stream)
     if config.debug:
         if new_text is not None: print(f'Successfully created new dynamic wording for note {note.id} using model \'{model}\'')
         else: print(f'Unsuccessfully attempted new dynamic wording for note {note.id} using model \'{model}\'')
     return new_text
 
+def create_new_dynamic_wordings(notes: List[Note], credential: Credential) -> dict[int, str]:
+    global q
+    if q is not None and isinstance(q, RewordingWorkerQueue) and not q.running:
+        if config.debug: print(f'Queue has been closed; aborting batched rewording for {len(notes)} notes.')
+        return {}
+
+    platform_settings = config.settings.platform_configs[credential.platform_index]
+    model = platform_settings.get("model")
+    if config.debug: print(f'Creating new dynamic wordings for {len(notes)} notes using model \'{model}\'')
+
+    new_texts = reword_notes_batch(notes, credential)
+    if config.debug:
+        print(f'Created new dynamic wordings for {len(new_texts)} of {len(notes)} notes using model \'{model}\'')
+    return new_texts
+
+# FIRST VIEWS
+# Notes with a first-view rewording on its way, which counts towards their maximum like a queued one.
+first_view_pending = set()
+first_view_lock = threading.Lock()
+
+# Reword a card's note while the reviewer waits, for at most `first_view_deadline_ms`; a rewording that
+# arrives in time is in `cne.texts` on return, and one that arrives too late is handed to the main thread
+# to be cached for the next review. Returns whether the rewording was started at all, which it is not if
+# the rate limit is reached. Failed attempts are not retried; the note is queued as usual the next time
+# the card is shown. Runs on the queue's event loop, so the queue must be running.
+def reword_within_deadline(card: Card, cne: CachedNoteEntry) -> bool:
+    note, key = cne.note, cne.key
+    with first_view_lock:
+        if note.id in first_view_pending:
+            return False
+        credential, _ = credentials.acquire(config.settings, lambda platform_settings: estimate_request_tokens(note, platform_settings))
+        if credential is None:
+            return False
+        first_view_pending.add(note.id)
+    model = config.settings.platform_configs[credential.platform_index].get("model")
+    # A text from a fallback platform is kept under its own key, and so not shown in place of this one.
+    key = note_content_key(note, credential.platform_index)
+
+    async def generate() -> Optional[str]:
+        try:
+            return await q.engine.run_blocking(create_new_dynamic_wording, note=note, credential=credential, stream=True)
+        except RewordingError as e:
+            stats.incr(f'first_view.failures.{e.kind}')
+            if config.debug: print(f'First-view rewording of note {note.id} failed (reason: {e.kind}, {str(e)}).')
+        except Exception as e:
+            tooltip(str(e))
+        finally:
+            with first_view_lock:
+                first_view_pending.discard(note.id)
+
+    def deliver_late(future: concurrent.futures.Future):
+        if not future.cancelled() and future.result() is not None:
+            mw.taskman.run_on_main(lambda: deliver_rewording(card.id, future.result(), key, model, note.fields[0]))
+
+    future = q.engine.run(generate())
+    try:
+        new_text = future.result(timeout=config.settings.first_view_deadline_ms / 1000)
+    except concurrent.futures.TimeoutError:
+        future.add_done_callback(deliver_late)
+        new_text = None
+    except concurrent.futures.CancelledError:
+        new_text = None
+    if new_text is not None:
+        update_cached_note_for_card(card=card, new_text=new_text, key=key, model=model)
+    stats.incr('first_view.in_time' if new_text is not None else 'first_view.fallback')
+    if config.debug: print(f'First-view rewording of note {note.id} {"arrived in time" if new_text is not None else "did not arrive in time"}.')
+    return True
+
+# Find the ids of the next cards the scheduler will show, in order.
+def get_due_card_ids(limit: int) -> List[int]:
+    try:
+        queued = mw.col.sched.get_queued_cards(fetch_limit=limit)
+        return [queued_card.card.id for queued_card in queued.cards]
+    except AttributeError:
+        # Older schedulers have no queue to ask; approximate it with the due order of the current deck.
+        return list(mw.col.find_cards('deck:current is:due', order=True))[:limit]
+
+# Queue rewordings ahead of time for the cards due this session, so that even first reviews show
+# a new wording. Only notes without any rewording yet are queued, once per note, in due order.
+def prefetch_due_cards():
+    lookahead = config.settings.prefetch_lookahead
+    if config.pause or lookahead <= 0:
+        return
+    platform_settings = config.settings.platform_configs[config.settings.platform_index]
+    if platform_settings.get("max_renders", 3) < 2:
+        return
+    seen_note_ids = set()
+    for card_id in get_due_card_ids(lookahead):
+        if q.is_full():
+            if config.debug: print('Queue is full; stopping prefetch.')
+            break
+        card = mw.col.get_card(card_id)
+        if card.nid in seen_note_ids or q.has_pending(card.nid):
+            continue
+        seen_note_ids.add(card.nid)
+        if card.note_type()['name'] in config.settings.exclude_note_types:
+            continue
+        key = note_content_key(card.note())
+        cne = config.data.peek(card.nid)
+        texts = cne.texts if cne is not None and cne.key == key else db.get_strings_by_key(key)
+        if texts is None or len(texts) < 2:
+            q.add_render_task(card=card, prefetch=True)
+    if config.debug: print(f'Prefetch checked {len(seen_note_ids)} due notes (lookahead {lookahead}).')
+
+# Start the queue at the beginning of a review session, prefetching the session's cards on its first question.
+# This is a card_will_show filter, so the text passes through untouched. Other views of a card (the Browser's
+# preview, the card layout editor) are no review session, and are left alone. Timed on its own, as the first
+# card of a session waits for it on top of its own preparation.
+session_prefetched = False
+@stats.timed('card_will_show.session_start')
+def start_review_session(text: str, card: Card, kind: str) -> str:
+    global session_prefetched
+    if kind != 'reviewQuestion':
+        return text
+    q.start()
+    if not session_prefetched and mw.state == 'review':
+        session_prefetched = True
+        prefetch_due_cards()
+    return text
+
+def end_review_session(*args):
+    global session_prefetched
+    session_prefetched = False
+    q.stop()
+
 # Clear cache, either entirely or for a specific note (possibly associated with a card).
 def clear_parent_note_of_card_from_cache(card: Card, indicate_error: bool = False):
     if card is not None:
         clear_note_from_cache(note=card.note(), indicate_error=indicate_error)
         
 def clear_note_from_cache(note: Note, indicate_error: bool = False):
-    if note is not None and note.id in config.data.keys():
-        del config.data[note.id]
-        clear_all_by_id(note.id)
+    if note is not None and note.id in config.data:
+        cne = config.data.peek(note.id)
+        config.data.remove(note.id)
+        db.clear_entry(note_id=note.id, key=cne.key)
+        render_cache.remove_if(lambda key: key[0] == note.id)
         if indicate_error:
             tooltip(f'Due to an error (likely problem with dynamic cache), cleared dynamic cache for cards associated with note {note.id}.')
         else:
             tooltip(f'Cleared dynamic cache for cards associated with note {note.id}.')
 
 def clear_cache():
-    config.data = {}
-    clear_dynamic_db()
+    config.data.clear()
+    db.clear()
+    render_cache.clear()
     tooltip('Cleared dynamic cache.')
 
-# No need to redraw the card since that will be done anyway when the editor closes
-# Only clear cache when editing new cards (only ADD_CARDS, EDIT_CURRENT, and BROWSER modes exist,
-# see Editor class)
-def clear_cache_on_editor_load_note(e: Editor):
-    if e.editorMode == EditorMode.EDIT_CURRENT:
-        clear_note_from_cache(e.note)
-        if mw.reviewer and mw.reviewer.card is not None:
-            mw.taskman.run_on_main(mw.reviewer._redraw_current_card)
-
-# Find all cloze matches of a given ord in a cloze card.
-# Case insensitive.
-def get_cloze_matches(curr_qtext, ord) -> list[str]:
-    pattern = r'{{c' + str(ord + 1) + r'.+?}}'
-    return re.findall(pattern, curr_qtext, flags=re.RegexFlag.IGNORECASE)
-
-# Ensure all cloze deletions are in curr_qtext.
-# Case insensitive.
-def validate_cloze(curr_qtext: str, cloze_deletions: list[Optional[str]]) -> bool:
-    for cloze_deletion in cloze_deletions:
-        if cloze_deletion.lower() not in curr_qtext.lower():
-            return False
-    return True
-
-def reword_note(note: Note, ord: Optional[int] = None, num_retries: Optional[int] = None, reason: Optional[str] = None) -> str:
+# Keep the dynamic database within `cache_size_limit_mb` and rid of deleted notes (see DynamicCache.maintain).
+# Runs in the background when a review session ends, at most every MAINTENANCE_INTERVAL_SECONDS.
+MAINTENANCE_INTERVAL_SECONDS = 6 * 3600
+last_maintenance = None
+
+def maintain_cache(*args):
+    global last_maintenance
+    if bulk.running or (last_maintenance is not None and time.monotonic() - last_maintenance < MAINTENANCE_INTERVAL_SECONDS):
+        return
+    last_maintenance = time.monotonic()
+    def existing(note_ids: List[int]) -> set:
+        return set(mw.col.db.list(f'SELECT id FROM notes WHERE id IN ({",".join(str(int(note_id)) for note_id in note_ids)})'))
+    def done(future: concurrent.futures.Future):
+        try:
+            forgotten = future.result()
+        except Exception as e:
+            if config.debug: print('Dynamic cache maintenance failed:', e)
+            return
+        for name, count in forgotten.items():
+            stats.incr(f'maintenance.{name}', count)
+        # Entries in memory may refer to texts that are gone.
+        if any(forgotten.values()):
+            with cache_lock:
+                config.data.clear()
+                render_cache.clear()
+    mw.taskman.run_in_background(lambda: db.maintain(int(config.settings.cache_size_limit_mb * 2 ** 20), existing), done)
+
+# Make a single attempt at rewording a note. Failures raise a RewordingError saying what went wrong;
+# retrying is up to the caller (see RewordingWorkerQueue._handle_failure and BulkGeneration._reword).
+def reword_note(note: Note, credential: Credential, stream: bool = False) -> Optional[str]:
     
-    platform_index = config.settings.platform_index
-    platform_settings = config.settings.platform_configs[platform_index]
-    if num_retries is None:
-        num_retries = platform_settings.get("num_retries", 3)
+    platform_index = credential.platform_index
 
     # Extract relevant properties from the card.
     curr_qtext = reworded_qtext = note.fields[0]
-    curr_note_type = note.note_type()['name']
-    
-    # If we've run out of tries, then give up.
-    if num_retries < 0:
-        if config.debug: print(f'Could not properly reword note {note.id} using platform {config.settings.platform_index} (reason: {reason}). Please try again.')
-        tooltip(f'Error rewording note {note.id}: {str(reason)}. Please try again.') 
-        return None
 
-    # This is the choke point for the rewording process. If the queue is not running (because the user has killed it),
-    # then we should not attempt to reword the note.
-    global q 
-    if q is not None and isinstance(q, RewordingWorkerQueue) and not q.running:
-        if config.debug: print(f'Queue has been closed; aborting rewording for note {note.id}.')
-        return None
+    # The model only gets to see the prose; the markup is masked and put back afterwards.
+    masked = markup.mask(curr_qtext)
+    context = config.settings.platform_configs[platform_index].get("context")
+    if masked.originals:
+        context += '\n\n' + markup.MASK_INSTRUCTIONS
 
+    if config.debug: print(f'Attempting to reword note {note.id} using platform {platform_index}.')
     try:
-        if config.debug: print(f'Attempting to reword note {note.id} using platform {config.settings.platform_index} (reason: {reason}).')
-        if config.settings.platform_index == 0:
-            reworded_qtext = reword_text_mistral(curr_qtext)
-        elif platform_index == 1:
-            reworded_qtext = reword_text_gemini(curr_qtext)
-        else:
-            raise RuntimeError(f'Unknown platform index {platform_index} for rewording note {note.id}.')
-    except RuntimeError as e:
-        time.sleep(platform_settings.get("retry_delay_seconds", 1.0)) # avoid rate limit ceiling
-        if config.debug: print(f'Failed to reword note {note.id} using platform {config.settings.platform_index} (reason: {str(e)}).')
-        return reword_note(note=note, ord=ord, num_retries=num_retries - 1, reason=str(e))
-
-    # If the note is cloze-adjacent, then validate it. If valid, return the note.
-    # If not cloze-adjacent, skip this validation process and just return the note.
-    # BUG: This ONLY goes by name. There must be a better way to validate it.
-    if 'cloze' in curr_note_type.lower() and ord is not None and not validate_cloze(reworded_qtext, get_cloze_matches(curr_qtext, ord)):
-        time.sleep(platform_settings.get("retry_delay_seconds", 1.0)) # avoid rate limit ceiling
-        return reword_note(note=note, ord=ord, num_retries=num_retries - 1, reason='Cloze validation failed')
+        reworded_qtext = masked.restore(reword_text(credential, masked.text, context=context, stream=stream))
+    except ValueError as e:
+        stats.incr('masking.failures')
+        raise RewordingError(f'Formatting was not kept: {e}', retry.INVALID_OUTPUT)
+
+    # One rewording serves every card of the note, so it must keep the cloze deletions of all of them.
+    if not markup.clozes_kept(curr_qtext, reworded_qtext):
+        stats.incr('cloze.failures')
+        raise RewordingError('Cloze validation failed', retry.INVALID_OUTPUT)
     return reworded_qtext
         
-def reword_text_mistral(curr_qtext: str) -> str: 
-    
-    platform_settings = config.settings.platform_configs[0]
-    api_key = platform_settings.get("api_key")
-    model = platform_settings.get("model")
-    context = platform_settings.get("context")
+# Appended to the context for batched requests, which carry several notes as one JSON object.
+BATCH_INSTRUCTIONS = ('You will be given a JSON object that maps ids to texts. Rewrite every text as instructed above, '
+                      'and reply with only a JSON object that maps each of the same ids to its rewritten text.')
+
+# Pull the JSON object out of a model reply, tolerating markdown code fences around it.
+def parse_batch_response(response: str) -> dict:
+    response = response.strip()
+    if response.startswith('```'):
+        response = response.split('\n', 1)[1] if '\n' in response else ''
+        response = response.rsplit('```', 1)[0]
+    parsed = json.loads(response)
+    if not isinstance(parsed, dict):
+        raise ValueError('Batched response is not a JSON object.')
+    return parsed
+
+# Reword several notes in one request. Returns the rewordings that passed validation, by note id;
+# notes that are missing from the result should be reworded on their own.
+def reword_notes_batch(notes: List[Note], credential: Credential) -> dict[int, str]:
+
+    platform_index = credential.platform_index
+    platform_settings = config.settings.platform_configs[platform_index]
 
-    # Try to reword the card using Mistral.
+    masked = {note.id: markup.mask(note.fields[0]) for note in notes}
+    context = platform_settings.get("context") + '\n\n' + BATCH_INSTRUCTIONS
+    if any(masked_text.originals for masked_text in masked.values()):
+        context += ' ' + markup.MASK_INSTRUCTIONS
+    batch_text = json.dumps({str(note.id): masked[note.id].text for note in notes}, ensure_ascii=False)
     try:
-        chat_response = requests.post(url="https://api.mistral.ai/v1/chat/completions",
-                                      headers={'Content-Type': 'application/json',
-                                              'Accept': 'application/json',
-                                              'Authorization': 'Bearer ' + api_key},
-                                      data=json.dumps({'model': model,
-                                                       'messages': [
-                                                           {'role': 'system', 'content': context},
-                                                           {'role': 'user', 'content': curr_qtext}
-                                                       ]}))
-        if not (chat_response.status_code >= 200 and chat_response.status_code < 300):
-            raise requests.exceptions.RequestException(chat_response.json().get('message', f'Unspecified error ({chat_response.status_code})'))
-        return chat_response.json()['choices'][0]['message']['content']
-    except Exception as e:
-        # Throw an error.
-        # # print('Error with Mistral. Is your API key working?')
-        raise RuntimeError(str(e))
-        # raise RuntimeError(f'Error loading \'{model}\' for dynamic Anki cards: ' + str(e))
-                          # 'You might need to check your settings to ensure correct model name, API keys, and usage limits. '
-                          # 'If this continues, disable this add-on to stop these messages.')
-
-def reword_text_gemini(curr_qtext: str) -> str: 
-
-    platform_settings = config.settings.platform_configs[1]
-    api_key = platform_settings.get("api_key")
+        if config.debug: print(f'Attempting to reword {len(notes)} notes in one request using platform {platform_index}.')
+        response = reword_text(credential, batch_text, context=context, json_output=True)
+        reworded = parse_batch_response(response)
+    except (RewordingError, ValueError) as e:
+        # Platform errors concern every note in the batch; only bad output is worth trying note by note.
+        if isinstance(e, RewordingError) and e.kind != retry.INVALID_OUTPUT:
+            raise
+        if config.debug: print(f'Failed to reword batch of {len(notes)} notes (reason: {str(e)}).')
+        return {}
+
+    new_texts = {}
+    for note in notes:
+        new_text = reworded.get(str(note.id))
+        if not isinstance(new_text, str) or not new_text.strip():
+            if config.debug: print(f'Batched rewording for note {note.id} is missing or empty.')
+            continue
+        try:
+            new_text = masked[note.id].restore(new_text)
+        except ValueError as e:
+            stats.incr('masking.failures')
+            if config.debug: print(f'Batched rewording for note {note.id} did not keep its formatting ({e}).')
+            continue
+        if not markup.clozes_kept(note.fields[0], new_text):
+            stats.incr('cloze.failures')
+            if config.debug: print(f'Batched rewording for note {note.id} failed cloze validation.')
+            continue
+        new_texts[note.id] = new_text
+    return new_texts
+
+# Payloads of a server-sent event stream, as sent by both platforms when streaming.
+def iter_sse_data(response: requests.Response) -> Iterator[dict]:
+    for line in response.iter_lines(decode_unicode=True):
+        if line and line.startswith('data:'):
+            data = line[len('data:'):].strip()
+            if data == '[DONE]':
+                return
+            yield json.loads(data)
+
+# Send one rewording request to a platform, using the given credential, and report to the pool how it went.
+# With `stream`, the reply is read as it is generated rather than in one piece at the end.
+def reword_text(credential: Credential, curr_qtext: str, context: Optional[str] = None, json_output: bool = False, stream: bool = False) -> str:
+
+    platform_index = credential.platform_index
+    provider = providers.get(platform_index)
+    if provider is None:
+        raise RewordingError(f'Unknown platform index {platform_index}.', retry.CLIENT)
+    platform_settings = credential.settings(config.settings.platform_configs[platform_index])
     model = platform_settings.get("model")
-    context = platform_settings.get("context")
+    context = context if context is not None else platform_settings.get("context")
 
-    # Try to reword the card using Gemini.
+    session = sessions.get(platform_index, provider.session_key(platform_settings), headers=provider.headers(platform_settings))
+    start = time.perf_counter()
     try:
-        chat_response = requests.post(
-            url=f"https://generativelanguage.googleapis.com/v1beta/models/{model}:generateContent",
-            headers={
-                'Content-Type': 'application/json',
-                'X-goog-api-key': api_key
-            },
-            data=json.dumps({
-                'contents': [{
-                    'parts': [{'text': curr_qtext}]
-                }],
-                'system_instruction': {
-                    'parts': [{'text': context}]
-                },
-                'generationConfig': {
-                    'thinkingConfig': {
-                        'thinkingBudget': 0 # prefer fast models, this will error with CoT/reasoning models
-                    }
-                }})
-        )
-        if not (chat_response.status_code >= 200 and chat_response.status_code < 300):
-            raise requests.exceptions.RequestException(chat_response.json().get('message', f'Unspecified error ({chat_response.status_code})'))
-        return chat_response.json()['candidates'][0]['content']['parts'][0]['text']
-    except Exception as e:
-        # Throw an error.
-        # # print('Error with Gemini. Is your API key working?')
-        raise RuntimeError(str(e))
-        #raise RuntimeError(f'Error loading \'{model}\' for dynamic Anki cards: ' + str(e))
-                          # 'You might need to check your settings to ensure correct model name, API keys, and usage limits. '
-                          # 'If this continues, disable this add-on to stop these messages.')
+        chat_response = session.post(url=provider.url(platform_settings, stream=stream),
+                                     timeout=http_timeout(),
+                                     stream=stream,
+                                     data=json.dumps(provider.build_request(curr_qtext, context, model,
+                                                                            json_output=json_output, stream=stream)))
+    except requests.exceptions.RequestException as e:
+        error = retry.classify_exception(e)
+        record_http(provider.slug, model, start, error.kind)
+        credentials.report_failure(credential, error)
+        raise error
+    record_http(provider.slug, model, start, chat_response.status_code)
+    if not chat_response.ok:
+        error = provider.classify_response(chat_response)
+        credentials.report_failure(credential, error)
+        raise error
+    credentials.report_success(credential, *retry.get_remaining_quota(chat_response))
+    try:
+        if stream:
+            return ''.join(provider.parse_chunk(chunk) for chunk in iter_sse_data(chat_response))
+        return provider.parse_response(chat_response.json())
+    except (ValueError, KeyError, IndexError, TypeError) as e:
+        raise RewordingError(f'Malformed response from {provider.name}: {e!r}', retry.INVALID_OUTPUT)
+    except requests.exceptions.RequestException as e:
+        raise retry.classify_exception(e)
 
 # Based on the template used in the note, generate a rewording and rerender the front cloze.
+@stats.timed(lambda text, card, kind: f'card_will_show.{kind}')
 def inject_rewording_on_question(text: str, card: Card, kind: str) -> str:
 
     global q # Make it explicit.
@@ -535,10 +1201,16 @@ def inject_rewording_on_question(text: str, card: Card, kind: str) -> str:
                 platform_index = config.settings.platform_index
                 platform_settings = config.settings.platform_configs[platform_index]
                 # Otherwise, make a new request in the background and set the new render to use.
-                if (not config.pause and len(cne.texts) < platform_settings.get("max_renders", 3) and 
+                # Rewordings already on their way count towards the maximum.
+                if (not config.pause and len(cne.texts) + q.pending_renders(cne.note.id) + (cne.note.id in first_view_pending)
+                        < platform_settings.get("max_renders", 3) and 
                     card.note().note_type()['name'] not in config.settings.exclude_note_types):
                     if config.debug: print(f'Creating new render for note {cne.note.id}, current cache: ', str(cne))
-                    q.add_render_task(card=card)
+                    # On a first view, optionally wait a little for a rewording instead of showing the original;
+                    # otherwise the rewording is left to the queue.
+                    if not (config.settings.first_view_deadline_ms > 0 and len(cne.texts) == 1 and q.running and
+                            not q.has_pending(cne.note.id) and reword_within_deadline(card, cne)):
+                        q.add_render_task(card=card)
                     
                 # Try to select a render that is different from the previous one (or just select the only one available)
                 if config.debug:
@@ -632,20 +1304,60 @@ def inject_pause_generation_option(r: Reviewer, m: QMenu) -> None:
 def insert_separator(r: Reviewer, m: QMenu) -> None:
     m.addSeparator()
 
-# Start the dynamic database.
-setup_dynamic_db()
+# Generate rewordings for the notes selected in the Browser in the background, and show how it is going.
+def generate_for_selected_notes(browser: Browser):
+    global bulk_dialog
+    if bulk.running:
+        tooltip('Already generating rewordings; cancel that first to start over with other notes.')
+    else:
+        note_ids = browser.selected_notes()
+        if not note_ids:
+            tooltip('No notes selected.')
+            return
+        bulk.start(note_ids)
+    if bulk_dialog is None:
+        bulk_dialog = BulkProgressDialog(bulk, mw)
+    bulk_dialog.show()
+
+def inject_bulk_generation_option(browser: Browser) -> None:
+    action = QAction('Generate dynamic rewordings for selected notes', browser)
+    qconnect(action.triggered, lambda: generate_for_selected_notes(browser))
+    browser.form.menu_Notes.addSeparator()
+    browser.form.menu_Notes.addAction(action)
+
+# Bulk generation from the Browser; when the profile closes, it stops before the dynamic database does.
+bulk = BulkGeneration()
+bulk_dialog: Optional[BulkProgressDialog] = None
+gui_hooks.profile_will_close.append(bulk.cancel)
+gui_hooks.browser_menus_did_init.append(inject_bulk_generation_option)
+
+# The dynamic database creates its tables on first use; its connections are released when the profile closes.
+db.setup(model=config.settings.platform_configs[config.settings.platform_index].get("model"),
+         context=config.settings.platform_configs[config.settings.platform_index].get("context"))
+gui_hooks.profile_will_close.append(db.close)
+gui_hooks.profile_will_close.append(sessions.close)
 
 # Start the asynchronous queue and have it start/stop appropriately.
 # Using the card showing as a proxy for the start of a review session.
 q = RewordingWorkerQueue()
-gui_hooks.card_will_show.append(lambda *args: q.start())
-gui_hooks.reviewer_will_end.append(lambda *args: q.stop())
+
+# Values read whenever the stats are shown.
+stats.gauge('queue.depth', q.depth)
+stats.gauge('queue.dropped', lambda: q.dropped)
+stats.gauge('credentials.available', lambda: credentials.available(config.settings))
+stats.gauge('memory_cache.size', lambda: len(config.data))
+stats.gauge('memory_cache.hit_rate', config.data.hit_rate)
+stats.gauge('render_cache.size', lambda: len(render_cache))
+stats.gauge('render_cache.hit_rate', render_cache.hit_rate)
+stats.gauge('dynamic_db.hit_rate', lambda: stats.counters.get('dynamic_db.hits', 0) /
+            max(1, stats.counters.get('dynamic_db.hits', 0) + stats.counters.get('dynamic_db.misses', 0)))
+gui_hooks.card_will_show.append(start_review_session)
+gui_hooks.reviewer_will_end.append(end_review_session)
+gui_hooks.reviewer_will_end.append(maintain_cache)
 
 # Add hook using the new method
 # Also clear the reviewer once the review session is over
-# Also clear cards from the cache when they are to be edited
 gui_hooks.card_will_show.append(inject_rewording_on_question)
-gui_hooks.editor_did_load_note.append(clear_cache_on_editor_load_note)
 gui_hooks.reviewer_will_show_context_menu.append(insert_separator)
 gui_hooks.reviewer_will_show_context_menu.append(inject_pause_generation_option)
 gui_hooks.reviewer_will_show_context_menu.append(inject_include_exclude_option)
@@ -657,64 +1369,155 @@ if config.settings.clear_cache_on_reviewer_end:
 # Attach the remove revision tool.
 mw.installEventFilter(KeyPressCacheClearFilter(mw))
 
-# Make the welcome announcement if warranted.
-if config.settings.show_modal:
-    dlg = WelcomeDialog(config.settings.show_modal, mw)
+# Make the welcome announcement if warranted, once Anki's window is up, without holding up startup.
+# The hook only fires once, and removing it while Anki runs the hook would skip the next one.
+welcome_dialog = None
+def show_welcome():
+    global welcome_dialog
+    welcome_dialog = WelcomeDialog(config.settings.show_modal, mw)
     def set_show_modal():
-        config.settings.show_modal = dlg.form.checkBox.isChecked()
-    qconnect(dlg.finished, set_show_modal)
-    dlg.exec()
+        config.settings.show_modal = welcome_dialog.form.checkBox.isChecked()
+    qconnect(welcome_dialog.finished, set_show_modal)
+    welcome_dialog.show()
+if config.settings.show_modal:
+    gui_hooks.main_window_did_init.append(show_welcome)
 
 # Have the dialog and the settings menu in separate classes.
-sdlg = SettingsDialog(config.settings)
+# The dialog is only built the first time it is opened.
+sdlg: Optional[SettingsDialog] = None
 def update_config_settings():
-    config.settings.shortcut_clear_current_card = sdlg.form.keySequenceEdit.keySequence().toString()
-    config.settings.shortcut_clear_all_cards = sdlg.form.keySequenceEdit_2.keySequence().toString()
-    config.settings.shortcut_include_exclude = sdlg.form.keySequenceEdit_3.keySequence().toString()
-    config.settings.shortcut_pause = sdlg.form.keySequenceEdit_4.keySequence().toString()
-    config.settings.clear_cache_on_reviewer_end = sdlg.form.checkBox.isChecked()
-    config.settings.exclude_note_types = [sdlg.form.listWidget.item(i).text() for i in range(sdlg.form.listWidget.count())]
-    config.settings.platform_index = sdlg.form.platformSelect.currentIndex()
-
-    # Save platform-specific settings for the currently active platform
-    current_index = config.settings.platform_index
-    current_platform_settings = config.settings.platform_configs[current_index]
-
-    current_platform_settings["api_key"] = sdlg.form.APIKeyLineEdit.text()
-    current_platform_settings["model"] = sdlg.form.modelComboBox.currentText()
-    current_platform_settings["context"] = sdlg.form.textEdit.toPlainText()
-
-    # Handle numeric inputs with validation
-    try:
-        val = int(sdlg.form.maxRendersLineEdit.text())
-        assert val > 0
-        current_platform_settings["max_renders"] = val
-    except ValueError or AssertionError:
-        tooltip(f'Invalid new value \'{sdlg.form.maxRendersLineEdit.text()}\' for max renders; reverting to old value.')
-    try:
-        val = int(sdlg.form.retryCountLineEdit.text())
-        assert val > 0
-        current_platform_settings["num_retries"] = val
-    except ValueError or AssertionError:
-        tooltip(f'Invalid new value \'{sdlg.form.retryCountLineEdit.text()}\' for retry count; reverting to old value.')
-    try:
-        val = float(sdlg.form.retryDelayLineEdit.text())
-        assert val >= 0
-        current_platform_settings["retry_delay_seconds"] = val
-    except ValueError or AssertionError:
-        tooltip(f'Invalid new value \'{sdlg.form.retryDelayLineEdit.text()}\' for retry delay; reverting to old value.')
-    
+    # One write for the whole dialog, once everything is in place.
+    with config.settings.transaction():
+        config.settings.shortcut_clear_current_card = sdlg.form.keySequenceEdit.keySequence().toString()
+        config.settings.shortcut_clear_all_cards = sdlg.form.keySequenceEdit_2.keySequence().toString()
+        config.settings.shortcut_include_exclude = sdlg.form.keySequenceEdit_3.keySequence().toString()
+        config.settings.shortcut_pause = sdlg.form.keySequenceEdit_4.keySequence().toString()
+        config.settings.clear_cache_on_reviewer_end = sdlg.form.checkBox.isChecked()
+        config.settings.exclude_note_types = [sdlg.form.listWidget.item(i).text() for i in range(sdlg.form.listWidget.count())]
+        config.settings.platform_index = sdlg.form.platformSelect.currentIndex()
+
+        # Save platform-specific settings for the currently active platform
+        current_index = config.settings.platform_index
+        current_platform_settings = config.settings.platform_configs[current_index]
+
+        keys = parse_api_keys(sdlg.form.APIKeyLineEdit.text())
+        current_platform_settings["api_key"] = keys[0] if keys else ""
+        current_platform_settings["extra_api_keys"] = keys[1:]
+        current_platform_settings["use_as_fallback"] = sdlg.form.fallbackCheckBox.isChecked()
+        current_platform_settings["model"] = sdlg.form.modelComboBox.currentText()
+        current_platform_settings["context"] = sdlg.form.textEdit.toPlainText()
+        if providers.get(current_index).configurable_url:
+            current_platform_settings["base_url"] = sdlg.form.baseUrlLineEdit.text().strip()
+
+        # Handle numeric inputs with validation
+        try:
+            val = int(sdlg.form.maxRendersLineEdit.text())
+            assert val > 0
+            current_platform_settings["max_renders"] = val
+        except (ValueError, AssertionError):
+            tooltip(f'Invalid new value \'{sdlg.form.maxRendersLineEdit.text()}\' for max renders; reverting to old value.')
+        try:
+            val = int(sdlg.form.retryCountLineEdit.text())
+            assert val > 0
+            current_platform_settings["num_retries"] = val
+        except (ValueError, AssertionError):
+            tooltip(f'Invalid new value \'{sdlg.form.retryCountLineEdit.text()}\' for retry count; reverting to old value.')
+        try:
+            val = float(sdlg.form.retryDelayLineEdit.text())
+            assert val >= 0
+            current_platform_settings["retry_delay_seconds"] = val
+        except (ValueError, AssertionError):
+            tooltip(f'Invalid new value \'{sdlg.form.retryDelayLineEdit.text()}\' for retry delay; reverting to old value.')
+        try:
+            val = float(sdlg.form.requestsPerMinuteLineEdit.text())
+            assert val >= 0
+            current_platform_settings["requests_per_minute"] = val
+        except (ValueError, AssertionError):
+            tooltip(f'Invalid new value \'{sdlg.form.requestsPerMinuteLineEdit.text()}\' for requests per minute; reverting to old value.')
+        try:
+            val = float(sdlg.form.tokensPerMinuteLineEdit.text())
+            assert val >= 0
+            current_platform_settings["tokens_per_minute"] = val
+        except (ValueError, AssertionError):
+            tooltip(f'Invalid new value \'{sdlg.form.tokensPerMinuteLineEdit.text()}\' for tokens per minute; reverting to old value.')
+        try:
+            val = int(sdlg.form.prefetchLookaheadLineEdit.text())
+            assert val >= 0
+            config.settings.prefetch_lookahead = val
+        except (ValueError, AssertionError):
+            tooltip(f'Invalid new value \'{sdlg.form.prefetchLookaheadLineEdit.text()}\' for prefetch lookahead; reverting to old value.')
+        try:
+            val = int(sdlg.form.numWorkersLineEdit.text())
+            assert val > 0
+            if val != config.settings.num_workers:
+                config.settings.num_workers = val
+                sessions.resize(val) # One pooled connection per worker.
+                if q.running: q.reset() # Pick up the new worker count.
+        except (ValueError, AssertionError):
+            tooltip(f'Invalid new value \'{sdlg.form.numWorkersLineEdit.text()}\' for concurrent requests; reverting to old value.')
+        try:
+            val = float(sdlg.form.cacheSizeLimitLineEdit.text())
+            assert val >= 0
+            config.settings.cache_size_limit_mb = val
+        except (ValueError, AssertionError):
+            tooltip(f'Invalid new value \'{sdlg.form.cacheSizeLimitLineEdit.text()}\' for cache size limit; reverting to old value.')
+        try:
+            val = int(sdlg.form.firstViewDeadlineLineEdit.text())
+            assert val >= 0
+            config.settings.first_view_deadline_ms = val
+        except (ValueError, AssertionError):
+            tooltip(f'Invalid new value \'{sdlg.form.firstViewDeadlineLineEdit.text()}\' for first view wait; reverting to old value.')
+
     # Handle reviewer ending callback
     # As per internal gui_hooks code, no exception thrown if object to remove not found
     gui_hooks.reviewer_will_end.remove(clear_cache)
     if config.settings.clear_cache_on_reviewer_end:
         gui_hooks.reviewer_will_end.append(clear_cache)
-    
-    # Trigger a write to disk by re-assigning the list
-    config.settings.platform_configs = config.settings.platform_configs
 
-sdlg.setModal(True)
-sdlg.accepted.connect(update_config_settings)
+    # Only the active platform keeps its connections open.
+    provider = providers.get(current_index)
+    sessions.close(keep_index=current_index,
+                   keep_keys={provider.session_key({**current_platform_settings, "api_key": key}) for key in api_keys(current_platform_settings)})
+
+# Export and import the rewordings in the dynamic database, in the background as there may be many.
+def export_rewordings():
+    path, _ = QFileDialog.getSaveFileName(sdlg, 'Export rewordings', 'dynamic-cards-rewordings.jsonl.gz',
+                                          'Gzipped JSON lines (*.jsonl.gz)')
+    if not path:
+        return
+    def done(future: concurrent.futures.Future):
+        try:
+            tooltip(f'Exported the rewordings of {future.result()} notes.')
+        except Exception as e:
+            showWarning(f'Could not export rewordings: {e}', parent=sdlg)
+    mw.taskman.run_in_background(lambda: db.export_variants(path), done)
+
+def import_rewordings():
+    path, _ = QFileDialog.getOpenFileName(sdlg, 'Import rewordings', '', 'Gzipped JSON lines (*.jsonl.gz);;All files (*)')
+    if not path:
+        return
+    def done(future: concurrent.futures.Future):
+        try:
+            keys_added, texts_added = future.result()
+        except Exception as e:
+            showWarning(f'Could not import rewordings: {e}', parent=sdlg)
+            return
+        # Notes in memory pick up the imported rewordings on their next review.
+        with cache_lock:
+            config.data.clear()
+        tooltip(f'Imported {texts_added} rewordings ({keys_added} notes had none before).')
+    mw.taskman.run_in_background(lambda: db.import_variants(path), done)
+
+def open_settings():
+    global sdlg
+    if sdlg is None:
+        sdlg = SettingsDialog(config.settings, stats)
+        sdlg.setModal(True)
+        sdlg.accepted.connect(update_config_settings)
+        qconnect(sdlg.form.exportCacheButton.clicked, export_rewordings)
+        qconnect(sdlg.form.importCacheButton.clicked, import_rewordings)
+    sdlg.open()
+
 config_option = QAction("Dynamic Cards", mw)
-config_option.triggered.connect(sdlg.open)
+config_option.triggered.connect(open_settings)
 mw.form.menuTools.addAction(config_option)
\ No newline at end of file
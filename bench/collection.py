@@ -0,0 +1,185 @@
+# A synthetic collection, with just enough of anki's Card/Note/Collection
+# surface for the add-on to review it. Notes are kept as plain tuples and only
+# turned into objects when asked for, the way Anki loads them from its database.
+
+from typing import List, Optional
+import random
+import re
+
+MODEL_STD = 0
+MODEL_CLOZE = 1
+
+WORDS = ('cell membrane protein enzyme substrate receptor ligand pathway kinase phosphate energy gradient '
+         'transport channel signal nucleus gene transcription translation ribosome amino acid sequence fold '
+         'structure binding site inhibitor activation response tissue organ system pressure volume flow '
+         'heart lung kidney liver neuron synapse action potential calcium sodium potassium chloride water').split()
+
+CLOZE = re.compile(r'{{c(\d+)::(.*?)(?:::(.*?))?}}', flags=re.IGNORECASE)
+
+# Note types, shaped like the dicts anki hands out.
+BASIC = {'id': 1, 'name': 'Basic', 'type': MODEL_STD, 'mod': 1,
+         'tmpls': [{'name': 'Card 1', 'qfmt': '{{Front}}', 'afmt': '{{FrontSide}}<hr id=answer>{{Back}}'}]}
+CLOZE_TYPE = {'id': 2, 'name': 'Cloze', 'type': MODEL_CLOZE, 'mod': 1,
+              'tmpls': [{'name': 'Cloze', 'qfmt': '{{cloze:Text}}', 'afmt': '{{cloze:Text}}<br>{{Back Extra}}'}]}
+NOTE_TYPES = {BASIC['id']: BASIC, CLOZE_TYPE['id']: CLOZE_TYPE}
+
+class TemplateRenderOutput:
+
+    def __init__(self, question_text: str, answer_text: str):
+        self.question_text = question_text
+        self.answer_text = answer_text
+
+# Render a cloze field for card `ord`: its own deletions are hidden on the question side.
+def render_cloze(text: str, ord: int, answer: bool) -> str:
+    def replace(match):
+        if int(match.group(1)) != ord + 1:
+            return match.group(2)
+        if answer:
+            return f'<span class=cloze>{match.group(2)}</span>'
+        return f'<span class=cloze>[{match.group(3) or "..."}]</span>'
+    return CLOZE.sub(replace, text)
+
+def render(note: 'Note', ord: int, note_type: dict, template: dict) -> TemplateRenderOutput:
+    if note_type['type'] == MODEL_CLOZE:
+        question = render_cloze(note.fields[0], ord, answer=False)
+        answer = render_cloze(note.fields[0], ord, answer=True) + '<br>' + note.fields[1]
+    else:
+        question = template['qfmt'].replace('{{Front}}', note.fields[0])
+        answer = template['afmt'].replace('{{FrontSide}}', question).replace('{{Back}}', note.fields[1])
+    return TemplateRenderOutput(question, answer)
+
+class Note:
+
+    def __init__(self, col: 'Collection', id: Optional[int] = None):
+        self.col = col
+        self.id = id or 0
+        if id:
+            self.mid, fields, self.mod = col.notes[id]
+            self.fields = list(fields)
+        else:
+            self.mid, self.fields, self.mod = BASIC['id'], ['', ''], 0
+
+    def note_type(self) -> dict:
+        return NOTE_TYPES[self.mid]
+
+    def ephemeral_card(self, ord: int = 0, custom_note_type: Optional[dict] = None,
+                       custom_template: Optional[dict] = None) -> 'Card':
+        card = Card(self.col)
+        card.nid, card.ord, card._note = self.id, ord, self
+        card._render_output = render(self, ord, custom_note_type or self.note_type(),
+                                     custom_template or self.note_type()['tmpls'][0])
+        return card
+
+class Card:
+
+    def __init__(self, col: 'Collection', id: Optional[int] = None):
+        self.col = col
+        self.id = id or 0
+        self.nid, self.ord = divmod(id, Collection.CARDS_PER_NOTE) if id else (0, 0)
+        self.reps = col.reps.get(id, 0) if id else 0
+        self._note = None
+        self._render_output = None
+
+    def note(self, reload: bool = False) -> Note:
+        if self._note is None or reload:
+            self._note = Note(self.col, self.nid)
+        return self._note
+
+    def note_type(self) -> dict:
+        return self.note().note_type()
+
+    def template(self) -> dict:
+        note_type = self.note_type()
+        return note_type['tmpls'][0]
+
+    def render_output(self) -> TemplateRenderOutput:
+        if self._render_output is None:
+            self._render_output = render(self.note(), self.ord, self.note_type(), self.template())
+        return self._render_output
+
+    def set_render_output(self, output: TemplateRenderOutput):
+        self._render_output = output
+
+    def question(self) -> str:
+        return self.render_output().question_text
+
+    def answer(self) -> str:
+        return self.render_output().answer_text
+
+class QueuedCard:
+
+    def __init__(self, card: Card):
+        self.card = card
+
+class QueuedCards:
+
+    def __init__(self, cards: List[QueuedCard]):
+        self.cards = cards
+
+# Hands out the due cards in order, starting from the card under review.
+class Scheduler:
+
+    def __init__(self, col: 'Collection'):
+        self.col = col
+        self.position = 0
+
+    def get_queued_cards(self, fetch_limit: int = 1) -> QueuedCards:
+        due = self.col.due[self.position:self.position + fetch_limit]
+        return QueuedCards([QueuedCard(self.col.get_card(card_id)) for card_id in due])
+
+class Collection:
+
+    CARDS_PER_NOTE = 100 # Card ids are note id * CARDS_PER_NOTE + ord.
+
+    # `cloze_fraction` of the notes are cloze notes with one to three deletions; `duplicate_fraction`
+    # of the notes repeat the text of an earlier note.
+    def __init__(self, num_notes: int, cloze_fraction: float = 0.3, duplicate_fraction: float = 0.05, seed: int = 0):
+        rng = random.Random(seed)
+        self.notes = {} # Note id -> (note type id, fields, mod)
+        self.reps = {} # Card id -> reps
+        self.due: List[int] = []
+        texts = []
+        for index in range(num_notes):
+            nid = index + 1
+            if texts and rng.random() < duplicate_fraction:
+                mid, front = rng.choice(texts)
+            elif rng.random() < cloze_fraction:
+                mid, front = CLOZE_TYPE['id'], self._cloze_text(rng)
+            else:
+                mid, front = BASIC['id'], self._sentence(rng)
+            texts.append((mid, front))
+            self.notes[nid] = (mid, (front, self._sentence(rng)), rng.randrange(1, 2 ** 31))
+            ords = len(set(CLOZE.findall(front))) if mid == CLOZE_TYPE['id'] else 1
+            self.due.extend(nid * self.CARDS_PER_NOTE + ord for ord in range(ords))
+        rng.shuffle(self.due)
+        self.sched = Scheduler(self)
+        self.db = self
+
+    @staticmethod
+    def _sentence(rng: random.Random) -> str:
+        return ' '.join(rng.choice(WORDS) for _ in range(rng.randint(8, 40))).capitalize() + '.'
+
+    @classmethod
+    def _cloze_text(cls, rng: random.Random) -> str:
+        words = cls._sentence(rng).split()
+        for ord, position in enumerate(sorted(rng.sample(range(len(words)), rng.randint(1, min(3, len(words)))))):
+            words[position] = f'{{{{c{ord + 1}::{words[position]}}}}}'
+        return ' '.join(words)
+
+    # Only the queries the add-on makes: ids of notes that still exist.
+    def list(self, sql: str) -> List[int]:
+        ids = re.search(r'IN \(([^)]*)\)', sql).group(1)
+        return [int(id) for id in ids.split(',') if id.strip() and int(id) in self.notes]
+
+    def get_card(self, id: int) -> Card:
+        return Card(self, id)
+
+    def get_note(self, id: int) -> Note:
+        return Note(self, id)
+
+    def find_cards(self, query: str, order: bool = False) -> List[int]:
+        return self.due[self.sched.position:]
+
+    # Record a review of the card, as answering it in the reviewer would.
+    def answer(self, card: Card):
+        self.reps[card.id] = self.reps.get(card.id, 0) + 1
@@ -0,0 +1,227 @@
+# A local stand-in for the Mistral and Gemini chat endpoints.
+# Replies in each platform's response format after a configurable latency, and
+# fails on purpose some of the time (429s, malformed replies) so the retry and
+# rate limit paths get exercised too. Streamed requests are answered with
+# server-sent events, the first one arriving after part of the latency.
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+import argparse
+import threading
+import random
+import json
+import time
+import re
+
+MISTRAL_PATH = '/v1/chat/completions'
+GEMINI_PATH = re.compile(r'^/v1beta/models/(?P<model>[^/:]+):(?P<method>generateContent|streamGenerateContent)(?:\?alt=sse)?$')
+STREAM_CHUNKS = 4
+TIME_TO_FIRST_CHUNK = 0.3 # Fraction of the latency before the first streamed chunk.
+CLOZE = re.compile(r'{{c\d+::(.*?)(?:::.*?)?}}', flags=re.IGNORECASE)
+PLACEHOLDER = re.compile(r'\[\[\d+\]\]')
+
+# Stand-in for a model rewording a text. Cloze deletions are kept intact, as the context asks.
+def reword(text: str, rng: random.Random) -> str:
+    return rng.choice(('In other words, ', 'Put differently, ', 'That is, ', 'Restated: ')) + text
+
+# Stand-in for a model ignoring its instructions: the cloze markup (or the placeholders standing in for it) is dropped.
+def break_clozes(text: str) -> str:
+    return PLACEHOLDER.sub('', CLOZE.sub(r'\1', text)) + ' (with some liberties taken)'
+
+class StubStats:
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.ok = 0
+        self.rate_limited = 0
+        self.malformed = 0
+        self.bad_requests = 0
+        self.texts = 0 # Texts reworded, counting every entry of batched requests.
+
+    def add(self, **counts):
+        with self.lock:
+            for name, count in counts.items():
+                setattr(self, name, getattr(self, name) + count)
+
+    def as_dict(self) -> dict:
+        with self.lock:
+            return {name: value for name, value in vars(self).items() if name != 'lock'}
+
+class StubLLMServer:
+
+    # `latency` and `jitter` are in seconds; `rate_limit_rate` and `malformed_rate` are the
+    # chances of a request being answered with a 429 or with a malformed reply.
+    def __init__(self, latency: float = 0.2, jitter: float = 0.05, rate_limit_rate: float = 0.0,
+                 malformed_rate: float = 0.0, retry_after: float = 1.0, seed: Optional[int] = None,
+                 host: str = '127.0.0.1', port: int = 0):
+        self.latency = latency
+        self.jitter = jitter
+        self.rate_limit_rate = rate_limit_rate
+        self.malformed_rate = malformed_rate
+        self.retry_after = retry_after
+        self.rng = random.Random(seed)
+        self.rng_lock = threading.Lock()
+        self.stats = StubStats()
+        self.httpd = ThreadingHTTPServer((host, port), self._handler_class())
+        self.httpd.daemon_threads = True
+        self.thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f'http://{host}:{port}'
+
+    @property
+    def mistral_url(self) -> str:
+        return self.url + MISTRAL_PATH
+
+    @property
+    def gemini_url(self) -> str:
+        return self.url + '/v1beta/models/{model}:generateContent'
+
+    @property
+    def gemini_stream_url(self) -> str:
+        return self.url + '/v1beta/models/{model}:streamGenerateContent?alt=sse'
+
+    def start(self) -> 'StubLLMServer':
+        self.thread = threading.Thread(target=self.httpd.serve_forever, name='stub-llm-server', daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    # Draw the fate of one request: (delay, outcome), where outcome is 'ok', 'rate_limited' or 'malformed'.
+    def _draw(self):
+        with self.rng_lock:
+            delay = max(0.0, self.rng.gauss(self.latency, self.jitter)) if self.jitter > 0 else self.latency
+            roll = self.rng.random()
+            seed = self.rng.random()
+        if roll < self.rate_limit_rate:
+            return delay, 'rate_limited', seed
+        if roll < self.rate_limit_rate + self.malformed_rate:
+            return delay, 'malformed', seed
+        return delay, 'ok', seed
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+
+            protocol_version = 'HTTP/1.1' # Keep-alive, like the real platforms.
+
+            def log_message(self, *args):
+                pass
+
+            def _reply(self, status: int, body: dict, headers: Optional[dict] = None):
+                payload = json.dumps(body).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(payload)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(payload)
+
+            # Send `chunks` as server-sent events, spread over `duration` seconds.
+            def _stream(self, chunks: list, duration: float):
+                events = [f'data: {json.dumps(chunk)}\n\n'.encode('utf-8') for chunk in chunks]
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/event-stream')
+                self.send_header('Content-Length', str(sum(len(event) for event in events)))
+                self.end_headers()
+                for event in events:
+                    self.wfile.write(event)
+                    self.wfile.flush()
+                    time.sleep(duration / len(events))
+
+            def do_POST(self):
+                server.stats.add(requests=1)
+                try:
+                    body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+                    if self.path == MISTRAL_PATH:
+                        platform = 'mistral'
+                        text = body['messages'][-1]['content']
+                        json_output = body.get('response_format', {}).get('type') == 'json_object'
+                        stream = bool(body.get('stream'))
+                    elif GEMINI_PATH.match(self.path):
+                        platform = 'gemini'
+                        stream = GEMINI_PATH.match(self.path).group('method') == 'streamGenerateContent'
+                        text = body['contents'][0]['parts'][0]['text']
+                        json_output = body.get('generationConfig', {}).get('responseMimeType') == 'application/json'
+                    else:
+                        server.stats.add(bad_requests=1)
+                        return self._reply(404, {'message': f'No route for {self.path}'})
+                except (ValueError, KeyError, IndexError, TypeError) as e:
+                    server.stats.add(bad_requests=1)
+                    return self._reply(400, {'message': f'Bad request: {e!r}'})
+
+                delay, outcome, seed = server._draw()
+                time.sleep(delay * TIME_TO_FIRST_CHUNK if stream else delay)
+                rng = random.Random(seed)
+
+                if outcome == 'rate_limited':
+                    server.stats.add(rate_limited=1)
+                    message = 'Rate limit exceeded (stub)'
+                    if platform == 'gemini':
+                        return self._reply(429, {'error': {'code': 429, 'message': message, 'status': 'RESOURCE_EXHAUSTED',
+                                                           'details': [{'retryDelay': f'{server.retry_after}s'}]}})
+                    return self._reply(429, {'message': message}, headers={'Retry-After': str(server.retry_after)})
+
+                if json_output:
+                    try:
+                        texts = json.loads(text)
+                    except ValueError:
+                        texts = {}
+                    server.stats.add(texts=len(texts))
+                    if outcome == 'malformed':
+                        content = rng.choice(('Sure! Here are your rewordings:', json.dumps({key: break_clozes(value) for key, value in texts.items()})))
+                    else:
+                        content = json.dumps({key: reword(value, rng) for key, value in texts.items()})
+                else:
+                    server.stats.add(texts=1)
+                    content = break_clozes(text) if outcome == 'malformed' else reword(text, rng)
+
+                if outcome == 'malformed':
+                    server.stats.add(malformed=1)
+                    # Either the text breaks validation, or the reply is not shaped as expected at all.
+                    if rng.random() < 0.5:
+                        empty = {'choices': []} if platform == 'mistral' else {'candidates': []}
+                        return self._stream([empty], 0) if stream else self._reply(200, empty)
+                else:
+                    server.stats.add(ok=1)
+                if stream:
+                    words = content.split(' ')
+                    size = max(1, -(-len(words) // STREAM_CHUNKS))
+                    pieces = [' '.join(words[i:i + size]) + (' ' if i + size < len(words) else '') for i in range(0, len(words), size)]
+                    if platform == 'mistral':
+                        chunks = [{'choices': [{'index': 0, 'delta': {'content': piece}}]} for piece in pieces]
+                    else:
+                        chunks = [{'candidates': [{'content': {'role': 'model', 'parts': [{'text': piece}]}}]} for piece in pieces]
+                        chunks.append({'candidates': [{'finishReason': 'STOP'}]})
+                    return self._stream(chunks, delay * (1 - TIME_TO_FIRST_CHUNK))
+                if platform == 'mistral':
+                    return self._reply(200, {'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': content}}]})
+                return self._reply(200, {'candidates': [{'content': {'role': 'model', 'parts': [{'text': content}]}}]})
+
+        return Handler
+
+# Serve on its own, e.g. to point a development copy of the add-on at it.
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Stub Mistral/Gemini server.')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--latency', type=float, default=0.2)
+    parser.add_argument('--jitter', type=float, default=0.05)
+    parser.add_argument('--rate-limit', type=float, default=0.0, help='Fraction of requests answered with 429.')
+    parser.add_argument('--malformed', type=float, default=0.0, help='Fraction of requests answered with malformed output.')
+    args = parser.parse_args()
+    stub = StubLLMServer(latency=args.latency, jitter=args.jitter, rate_limit_rate=args.rate_limit,
+                         malformed_rate=args.malformed, port=args.port).start()
+    print(f'Serving Mistral at {stub.mistral_url} and Gemini at {stub.gemini_url}')
+    try:
+        while True:
+            time.sleep(60)
+    except KeyboardInterrupt:
+        stub.stop()
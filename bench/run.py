@@ -0,0 +1,284 @@
+# Offline end-to-end benchmark of the add-on.
+#
+# Imports a scratch copy of the add-on against stand-ins for aqt and anki (see
+# stubs.py), points it at a local stub LLM server (see llm_server.py), and
+# reviews a synthetic collection (see collection.py). Nothing touches Anki, the
+# network, or the add-on's own dynamic.db and config.
+#
+#   python bench/run.py --notes 20000 --reviews 2000
+#
+# Reports:
+# * Latency of the card_will_show hooks on the UI thread, for first and repeat views.
+# * SQLite statements per review on the UI thread, and in total.
+# * How fast the worker queue drains, and what the stub server saw.
+# * Memory use.
+
+from typing import Callable, List, Optional
+import argparse
+import importlib
+import resource
+import tempfile
+import tracemalloc
+import sqlite3
+import shutil
+import json
+import time
+import sys
+import os
+import threading
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ADDON_DIR = os.path.dirname(BENCH_DIR)
+PACKAGE = 'dynamic_cards_bench'
+
+import collection
+import stubs
+from llm_server import StubLLMServer
+
+def percentile(samples: List[float], fraction: float) -> float:
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+def summarize(samples: List[float]) -> dict:
+    return {'count': len(samples),
+            'mean_ms': 1000 * sum(samples) / len(samples) if samples else 0.0,
+            'p50_ms': 1000 * percentile(samples, 0.50),
+            'p90_ms': 1000 * percentile(samples, 0.90),
+            'p99_ms': 1000 * percentile(samples, 0.99),
+            'max_ms': 1000 * max(samples) if samples else 0.0}
+
+# Counts the SQL statements run by the add-on, split by whether they ran on the UI thread.
+class StatementCounter:
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.main = 0
+        self.workers = 0
+        self.main_thread = threading.main_thread()
+
+    def on_statement(self, statement: str):
+        with self.lock:
+            if threading.current_thread() is self.main_thread:
+                self.main += 1
+            else:
+                self.workers += 1
+
+    def snapshot(self) -> tuple:
+        with self.lock:
+            return self.main, self.workers
+
+    # Trace every connection the cache opens from now on.
+    def attach(self, db):
+        open_connection = db._connection
+        def connection() -> sqlite3.Connection:
+            conn = open_connection()
+            if getattr(db._local, 'traced', None) is not conn:
+                conn.set_trace_callback(self.on_statement)
+                db._local.traced = conn
+            return conn
+        db._connection = connection
+
+# Copy the add-on to `workdir` and import it there, so that its dynamic.db is a scratch file.
+def load_addon(workdir: str, mw: stubs.MainWindow, overrides: dict, server: StubLLMServer):
+    package_dir = os.path.join(workdir, PACKAGE)
+    shutil.copytree(ADDON_DIR, package_dir, ignore=shutil.ignore_patterns(
+        'bench', '.git', '__pycache__', 'dynamic.db*', '*.jsonl', 'meta.json'))
+    with open(os.path.join(package_dir, 'config.json'), encoding='utf-8') as f:
+        config = json.load(f)
+    for key, value in overrides.items():
+        if key == 'platform':
+            config.update(value)
+        else:
+            config[key] = value
+    mw.addonManager.configs[PACKAGE] = config
+    gui_hooks = stubs.install(mw, package_dir)
+    sys.path.insert(0, workdir)
+    addon = importlib.import_module(PACKAGE)
+    # Platforms with a fixed endpoint are pointed at the stub server; the OpenAI-compatible one is configured to use it.
+    addon.providers.get(0).base_url = server.url + '/v1'
+    addon.providers.get(1).base_url = server.url + '/v1beta'
+    return addon, gui_hooks
+
+PLATFORMS = ('mistral', 'gemini', 'openai')
+
+def platform_overrides(args, server: StubLLMServer) -> dict:
+    platform_configs = []
+    for index, model in enumerate(('mistral-small-latest', 'gemini-2.5-flash-lite', 'local-model')):
+        platform_configs.append({'api_key': 'bench', 'extra_api_keys': [f'bench-{key}' for key in range(1, args.keys)],
+                                 'model': model, 'max_renders': args.max_renders,
+                                 'context': 'Reword the text. Keep all cloze deletions such as {{c1::...}} unchanged.',
+                                 'num_retries': args.retries, 'retry_delay_seconds': args.retry_delay,
+                                 'requests_per_minute': args.rpm, 'tokens_per_minute': args.tpm})
+    platform_configs[2]['base_url'] = server.url + '/v1'
+    return {'platform_index': PLATFORMS.index(args.platform), 'platform_configs': platform_configs}
+
+# Show `cards` in order, as the reviewer would: question, then answer, then the card is answered.
+# Returns the UI thread time spent in the card_will_show hooks for each question.
+def review(mw: stubs.MainWindow, gui_hooks, cards: List[int], think_time: float) -> List[float]:
+    latencies = []
+    for position, card_id in enumerate(cards):
+        mw.taskman.drain()
+        mw.col.sched.position = position
+        card = mw.col.get_card(card_id)
+        mw.reviewer.card = card
+        start = time.perf_counter()
+        text = card.question()
+        for hook in gui_hooks.card_will_show:
+            text = hook(text, card, 'reviewQuestion')
+        latencies.append(time.perf_counter() - start)
+        text = card.answer()
+        for hook in gui_hooks.card_will_show:
+            text = hook(text, card, 'reviewAnswer')
+        mw.col.answer(card)
+        if think_time:
+            time.sleep(think_time)
+    mw.taskman.drain()
+    return latencies
+
+# Wait for the worker queue to run dry. Returns the seconds it took, or None on timeout.
+def drain_queue(mw: stubs.MainWindow, addon, timeout: float) -> Optional[float]:
+    start = time.monotonic()
+    while addon.q.depth() > 0:
+        if time.monotonic() - start > timeout:
+            return None
+        mw.taskman.drain()
+        time.sleep(0.01)
+    mw.taskman.drain()
+    return time.monotonic() - start
+
+def count_rewordings(addon) -> int:
+    with sqlite3.connect(addon.config.settings.CACHE) as conn:
+        return conn.execute('SELECT COUNT(*) FROM variants WHERE idx > 0').fetchone()[0]
+
+def timed(label: str, func: Callable):
+    start = time.perf_counter()
+    result = func()
+    print(f'{label} in {time.perf_counter() - start:.2f}s', file=sys.stderr)
+    return result
+
+def run(args) -> dict:
+    if args.tracemalloc:
+        tracemalloc.start()
+    col = timed(f'Built collection of {args.notes} notes',
+                lambda: collection.Collection(args.notes, args.cloze, args.duplicates, args.seed))
+    reviews = col.due[:args.reviews]
+    server = StubLLMServer(latency=args.latency, jitter=args.jitter, rate_limit_rate=args.rate_limit,
+                           malformed_rate=args.malformed, retry_after=args.retry_after, seed=args.seed).start()
+    workdir = tempfile.mkdtemp(prefix='dynamic-cards-bench-')
+    report = {'settings': vars(args), 'collection': {'notes': len(col.notes), 'cards': len(col.due)}}
+    try:
+        mw = stubs.MainWindow(col, {})
+        overrides = {'show_modal': False, 'clear_cache_on_reviewer_end': False,
+                     'num_workers': args.workers, 'batch_size': args.batch_size,
+                     'prefetch_lookahead': args.prefetch, 'first_view_deadline_ms': args.first_view_deadline_ms,
+                     'platform': platform_overrides(args, server)}
+        addon, gui_hooks = timed('Imported add-on', lambda: load_addon(workdir, mw, overrides, server))
+        statements = StatementCounter()
+        statements.attach(addon.db)
+
+        for phase in ('first_views', 'repeat_views'):
+            before = statements.snapshot()
+            latencies = timed(f'Reviewed {len(reviews)} cards ({phase})',
+                              lambda: review(mw, gui_hooks, reviews, args.think_time))
+            after = statements.snapshot()
+            report[phase] = {'hook_latency': summarize(latencies),
+                             'sql_per_review_ui_thread': (after[0] - before[0]) / max(1, len(reviews))}
+
+            rewordings = count_rewordings(addon)
+            drain_seconds = timed('Drained queue', lambda: drain_queue(mw, addon, args.drain_timeout))
+            created = count_rewordings(addon) - rewordings
+            report[phase]['queue'] = {'drain_seconds': drain_seconds,
+                                      'rewordings_created_while_draining': created,
+                                      'rewordings_per_second': created / drain_seconds if drain_seconds else None,
+                                      'dropped_tasks': addon.q.dropped}
+
+        for hook in gui_hooks.reviewer_will_end:
+            hook()
+        mw.taskman.drain()
+        for hook in gui_hooks.profile_will_close:
+            hook()
+
+        main_statements, worker_statements = statements.snapshot()
+        report['sql_statements'] = {'ui_thread': main_statements, 'workers': worker_statements}
+        report['server'] = server.stats.as_dict()
+        report['rewordings_total'] = count_rewordings(addon)
+        report['caches'] = {'notes_in_memory': len(addon.config.data),
+                            'note_cache_hit_rate': addon.config.data.hit_rate(),
+                            'renders_in_memory': len(addon.render_cache),
+                            'render_cache_hit_rate': addon.render_cache.hit_rate()}
+        report['metrics'] = addon.stats.snapshot()
+        report['config_writes'] = mw.addonManager.writes
+        report['tooltips'] = len(mw.tooltips)
+        # ru_maxrss is in kilobytes on Linux and bytes on macOS.
+        maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        report['memory'] = {'max_rss_mb': maxrss / (1024 * 1024 if sys.platform == 'darwin' else 1024)}
+        if args.tracemalloc:
+            current, peak = tracemalloc.get_traced_memory()
+            report['memory'].update({'traced_current_mb': current / 2 ** 20, 'traced_peak_mb': peak / 2 ** 20})
+    finally:
+        server.stop()
+        shutil.rmtree(workdir, ignore_errors=True)
+    return report
+
+def print_report(report: dict):
+    print(f"Collection: {report['collection']['notes']} notes, {report['collection']['cards']} cards")
+    for phase in ('first_views', 'repeat_views'):
+        result = report[phase]
+        latency = result['hook_latency']
+        print(f"\n{phase.replace('_', ' ').capitalize()} ({latency['count']} cards)")
+        print(f"  card_will_show latency: mean {latency['mean_ms']:.3f} ms, p50 {latency['p50_ms']:.3f} ms, "
+              f"p90 {latency['p90_ms']:.3f} ms, p99 {latency['p99_ms']:.3f} ms, max {latency['max_ms']:.3f} ms")
+        print(f"  SQL statements per review (UI thread): {result['sql_per_review_ui_thread']:.2f}")
+        queue = result['queue']
+        if queue['drain_seconds'] is None:
+            print('  Queue did not drain before the timeout')
+        else:
+            rate = queue['rewordings_per_second']
+            print(f"  Queue drained in {queue['drain_seconds']:.2f}s, {queue['rewordings_created_while_draining']} rewordings"
+                  + (f" ({rate:.1f}/s)" if rate is not None else '') + f", {queue['dropped_tasks']} tasks dropped so far")
+    print(f"\nSQL statements: {report['sql_statements']['ui_thread']} on the UI thread, {report['sql_statements']['workers']} on workers")
+    print(f"Stub server: {report['server']}")
+    print(f"Rewordings stored: {report['rewordings_total']}")
+    print(f"Caches: {report['caches']}")
+    print(f"Config writes: {report['config_writes']}, tooltips: {report['tooltips']}")
+    print('Memory: ' + ', '.join(f'{name} {value:.1f}' for name, value in report['memory'].items()))
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description='Offline end-to-end benchmark of Dynamic Cards.')
+    parser.add_argument('--notes', type=int, default=10000, help='Notes in the synthetic collection.')
+    parser.add_argument('--reviews', type=int, default=1000, help='Cards reviewed in each pass.')
+    parser.add_argument('--cloze', type=float, default=0.3, help='Fraction of cloze notes.')
+    parser.add_argument('--duplicates', type=float, default=0.05, help='Fraction of notes repeating an earlier note\'s text.')
+    parser.add_argument('--platform', choices=PLATFORMS, default='mistral')
+    parser.add_argument('--latency', type=float, default=0.2, help='Mean stub server latency (seconds).')
+    parser.add_argument('--jitter', type=float, default=0.05, help='Standard deviation of the stub server latency (seconds).')
+    parser.add_argument('--rate-limit', type=float, default=0.02, help='Fraction of requests answered with 429.')
+    parser.add_argument('--retry-after', type=float, default=1.0, help='Seconds the stub server asks to wait after a 429.')
+    parser.add_argument('--malformed', type=float, default=0.02, help='Fraction of requests answered with malformed output.')
+    parser.add_argument('--keys', type=int, default=1, help='API keys per platform.')
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--batch-size', type=int, default=8)
+    parser.add_argument('--prefetch', type=int, default=100, help='Prefetch lookahead (cards).')
+    parser.add_argument('--first-view-deadline-ms', type=int, default=0, help='First view wait (milliseconds).')
+    parser.add_argument('--max-renders', type=int, default=3)
+    parser.add_argument('--retries', type=int, default=3)
+    parser.add_argument('--retry-delay', type=float, default=0.1)
+    parser.add_argument('--rpm', type=float, default=0, help='Requests per minute limit (0 for none).')
+    parser.add_argument('--tpm', type=float, default=0, help='Tokens per minute limit (0 for none).')
+    parser.add_argument('--think-time', type=float, default=0.0, help='Seconds spent on each card between reviews.')
+    parser.add_argument('--drain-timeout', type=float, default=300.0)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--tracemalloc', action='store_true', help='Trace Python allocations (slows everything down).')
+    parser.add_argument('--json', metavar='PATH', help='Also write the report as JSON to PATH.')
+    args = parser.parse_args(argv)
+
+    report = run(args)
+    print_report(report)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,170 @@
+# Stand-ins for the aqt and anki modules, so that the add-on can be imported and
+# driven without Anki's GUI. Qt classes accept any construction, attribute access
+# or call and do nothing; hooks are plain lists; work sent to the main thread is
+# queued until the harness runs it.
+
+from types import ModuleType
+from typing import Callable, List
+from concurrent.futures import Future
+import collections
+import sys
+import os
+import re
+
+import collection
+
+class _StubMeta(type):
+
+    def __getattr__(cls, name):
+        if name.startswith('__'):
+            raise AttributeError(name)
+        return _Stub()
+
+# Any Qt object: every attribute, call and operator just gives back another stub.
+class _Stub(metaclass=_StubMeta):
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def __getattr__(self, name):
+        if name.startswith('__'):
+            raise AttributeError(name)
+        return _Stub()
+
+    def __call__(self, *args, **kwargs):
+        return _Stub()
+
+    def __iter__(self):
+        return iter(())
+
+    def __int__(self):
+        return 0
+
+    def __add__(self, other):
+        return self
+
+    __radd__ = __sub__ = __rsub__ = __mul__ = __rmul__ = __truediv__ = __or__ = __ror__ = __add__
+
+    def __lt__(self, other):
+        return False
+
+    __le__ = __gt__ = __ge__ = __lt__
+
+# Hooks are lists of callbacks, like aqt's; removing a missing callback is not an error.
+class Hook(list):
+
+    def remove(self, callback: Callable):
+        if callback in self:
+            super().remove(callback)
+
+class GuiHooks:
+
+    def __getattr__(self, name: str) -> Hook:
+        hook = Hook()
+        setattr(self, name, hook)
+        return hook
+
+class AddonManager:
+
+    def __init__(self, configs: dict):
+        self.configs = configs
+        self.writes = 0
+
+    def getConfig(self, module: str) -> dict:
+        return self.configs.get(module)
+
+    def writeConfig(self, module: str, conf: dict):
+        self.configs[module] = conf
+        self.writes += 1
+
+# Functions handed to the main thread wait here until the harness runs them, as they would wait for Qt's event loop.
+class TaskManager:
+
+    def __init__(self):
+        self.tasks = collections.deque()
+
+    def run_on_main(self, func: Callable):
+        self.tasks.append(func)
+
+    # Background work runs right away, on the calling thread; its callback is queued like main thread work.
+    def run_in_background(self, task: Callable, on_done: Callable = None):
+        future = Future()
+        try:
+            future.set_result(task())
+        except Exception as e:
+            future.set_exception(e)
+        if on_done:
+            self.run_on_main(lambda: on_done(future))
+        return future
+
+    def drain(self) -> int:
+        ran = 0
+        while self.tasks:
+            self.tasks.popleft()()
+            ran += 1
+        return ran
+
+class Reviewer(_Stub):
+
+    def __init__(self):
+        self.card = None
+        self.redraws = 0
+
+    def _redraw_current_card(self):
+        self.redraws += 1
+
+class MainWindow(_Stub):
+
+    def __init__(self, col: 'collection.Collection', configs: dict):
+        self.col = col
+        self.addonManager = AddonManager(configs)
+        self.taskman = TaskManager()
+        self.reviewer = Reviewer()
+        self.state = 'review'
+        self.tooltips: List[str] = []
+
+    def installEventFilter(self, event_filter):
+        pass
+
+def _module(name: str, **attrs) -> ModuleType:
+    module = ModuleType(name)
+    module.__dict__.update(attrs)
+    return module
+
+# Every Qt name the add-on refers to, found by scanning its sources.
+def _qt_names(package_dir: str) -> List[str]:
+    names = set()
+    for root, dirs, files in os.walk(package_dir):
+        dirs[:] = [d for d in dirs if d not in ('bench', '__pycache__', '.git')]
+        for file in files:
+            if file.endswith('.py'):
+                with open(os.path.join(root, file), encoding='utf-8') as f:
+                    names.update(re.findall(r'\b(Q[A-Z]\w*|Qt)\b', f.read()))
+    return sorted(names)
+
+# Put the stand-ins in sys.modules, in place of aqt and anki.
+def install(mw: MainWindow, package_dir: str):
+    qt_names = _qt_names(package_dir)
+    qt = _module('aqt.qt', qconnect=lambda signal, slot: None, **{name: type(name, (_Stub,), {}) for name in qt_names})
+    qt.__all__ = qt_names + ['qconnect']
+
+    def tooltip(message, *args, **kwargs):
+        mw.tooltips.append(str(message))
+
+    modules = {
+        'aqt': _module('aqt', mw=mw, gui_hooks=GuiHooks(), **{name: getattr(qt, name) for name in qt.__all__}),
+        'aqt.qt': qt,
+        'aqt.addons': _module('aqt.addons', AddonManager=AddonManager),
+        'aqt.reviewer': _module('aqt.reviewer', Reviewer=Reviewer),
+        'aqt.utils': _module('aqt.utils', tooltip=tooltip, showWarning=tooltip),
+        'aqt.editor': _module('aqt.editor', Editor=_Stub, EditorMode=_Stub),
+        'aqt.browser': _module('aqt.browser', Browser=_Stub),
+        'anki': _module('anki'),
+        'anki.cards': _module('anki.cards', Card=collection.Card),
+        'anki.notes': _module('anki.notes', Note=collection.Note),
+        'anki.template': _module('anki.template', TemplateRenderOutput=collection.TemplateRenderOutput),
+        'anki.consts': _module('anki.consts', MODEL_STD=collection.MODEL_STD, MODEL_CLOZE=collection.MODEL_CLOZE),
+        'anki.collection': _module('anki.collection', Collection=collection.Collection),
+    }
+    sys.modules.update(modules)
+    return modules['aqt'].gui_hooks
@@ -0,0 +1,145 @@
+# Regression tests of the add-on, run with `python -m pytest --rootdir bench bench`.
+#
+# Modules that do not need Anki are imported directly; the rest of the add-on is
+# imported against the same stand-ins for aqt and anki as the benchmark (see stubs.py).
+
+from types import SimpleNamespace
+import tempfile
+import time
+import shutil
+import json
+import sqlite3
+import sys
+import os
+
+import pytest
+import requests
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCH_DIR)
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+import cache
+import markup
+import retry
+import collection
+import stubs
+import run
+from llm_server import StubLLMServer
+
+# The add-on, imported once for the whole module, with its queue stopped and its settings as in the benchmark.
+@pytest.fixture(scope='module')
+def addon():
+    server = StubLLMServer(latency=0.5, jitter=0.0, seed=0).start()
+    workdir = tempfile.mkdtemp(prefix='dynamic-cards-test-')
+    mw = stubs.MainWindow(collection.Collection(200, seed=0), {})
+    platform = SimpleNamespace(platform='mistral', keys=1, max_renders=3, retries=0, retry_delay=0.1, rpm=0, tpm=0)
+    overrides = {'show_modal': False, 'clear_cache_on_reviewer_end': False, 'prefetch_lookahead': 50,
+                 'platform': run.platform_overrides(platform, server)}
+    try:
+        module, gui_hooks = run.load_addon(workdir, mw, overrides, server)
+        yield SimpleNamespace(mw=mw, module=module, gui_hooks=gui_hooks)
+        for hook in gui_hooks.reviewer_will_end:
+            hook()
+        for hook in gui_hooks.profile_will_close:
+            hook()
+    finally:
+        server.stop()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+def show(addon, card_id: int, kind: str) -> str:
+    card = addon.mw.col.get_card(card_id)
+    addon.mw.reviewer.card = card
+    text = card.question()
+    for hook in addon.gui_hooks.card_will_show:
+        text = hook(text, card, kind)
+    return text
+
+def end_review(addon):
+    for hook in addon.gui_hooks.reviewer_will_end:
+        hook()
+    addon.mw.taskman.drain()
+
+# A dynamic.db as written before the cache module existed: one JSON blob per note, no auto_vacuum.
+def make_legacy_db(path: str, notes: int):
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE id_to_strings (id INTEGER PRIMARY KEY, items TEXT, last_renders TEXT)")
+    conn.executemany("INSERT INTO id_to_strings VALUES (?, ?, ?)",
+                     ((note_id, json.dumps([f'note {note_id} ' + 'x' * 500, f'rewording {note_id} ' + 'y' * 500]),
+                       json.dumps({'0': 1})) for note_id in range(notes)))
+    conn.commit()
+    conn.close()
+
+def test_legacy_cache_shrinks_after_maintain(tmp_path):
+    path = str(tmp_path / 'dynamic.db')
+    make_legacy_db(path, 2000)
+    db = cache.DynamicCache(path)
+    db.setup('model', 'context')
+    conn = db._connection()
+    assert conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2
+    conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    before = os.path.getsize(path)
+
+    forgotten = db.maintain(1, lambda note_ids: set(note_ids))
+    assert forgotten['evicted_keys'] == 2000
+    assert os.path.getsize(path) < before / 2
+    db.close()
+
+# A preview in the Browser must not keep the review session that follows from prefetching its cards.
+def test_preview_before_review_still_prefetches(addon):
+    mw, q = addon.mw, addon.module.q
+    mw.state = 'browse'
+    show(addon, mw.col.due[0], 'previewQuestion')
+    assert not q.running
+    mw.state = 'review'
+    show(addon, mw.col.due[0], 'reviewQuestion')
+    assert q.depth() > 10
+    end_review(addon)
+
+    # And again for the next session.
+    show(addon, mw.col.due[0], 'reviewQuestion')
+    assert q.depth() > 10
+    end_review(addon)
+
+# A rewording that arrives after its note was edited is kept for the old text, and not shown for the new one.
+def test_rewording_of_edited_note_is_not_shown(addon):
+    mw, module = addon.mw, addon.module
+    mw.col.sched.position = 100
+    show(addon, mw.col.due[100], 'reviewQuestion')
+    card = mw.col.get_card(mw.col.due[101])
+    assert module.q.has_pending(card.nid)
+    old_key = module.note_content_key(card.note())
+    mid, (front, back), mod = mw.col.notes[card.nid]
+    mw.col.notes[card.nid] = (mid, ('Edited. ' + front, back), mod + 1)
+    assert run.drain_queue(mw, module, 10) is not None
+
+    new_key = module.note_content_key(mw.col.get_note(card.nid))
+    assert module.config.data.peek(card.nid).key == new_key
+    assert len(module.db.get_strings_by_key(old_key)) == 2
+    assert show(addon, card.id, 'reviewQuestion').startswith('Edited. ')
+    end_review(addon)
+
+def rate_limited(headers: dict) -> requests.Response:
+    response = requests.Response()
+    response.status_code = 429
+    response.headers.update(headers)
+    response._content = b'{}'
+    return response
+
+# Some platforms send the reset as the Unix time it happens at, rather than as a duration.
+def test_rate_limit_reset_as_epoch():
+    error = retry.classify_response(rate_limited({'x-ratelimit-reset': str(int(time.time()) + 30)}))
+    assert 25 <= error.retry_after <= 30
+    remaining, reset = retry.get_remaining_quota(rate_limited({'x-ratelimit-remaining': '0',
+                                                               'ratelimit-reset': str(time.time() - 5)}))
+    assert (remaining, reset) == (0, 0.0)
+    assert retry.classify_response(rate_limited({'x-ratelimit-reset': '6m0s'})).retry_after == 360
+    assert retry.classify_response(rate_limited({'x-ratelimit-reset': str(time.time() + 7200)})).retry_after == retry.MAX_RESET_SECONDS
+
+# Anki stores literal angle brackets as &lt; and &gt;, but bare ones in prose are no tags either.
+def test_mask_leaves_comparisons_alone():
+    masked = markup.mask('a < b and c > d')
+    assert (masked.text, masked.originals) == ('a < b and c > d', [])
+    masked = markup.mask('if x<y, <b>then</b> y>x')
+    assert masked.text == 'if x<y, [[1]]then[[2]] y>x'
+    assert masked.restore(masked.text) == 'if x<y, <b>then</b> y>x'
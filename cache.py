@@ -0,0 +1,617 @@
+# Storage layer for the dynamic cache (dynamic.db).
+# Connections are long-lived and kept one per thread, so a cache round-trip on
+# the reviewer hot path does not have to open the file again each time.
+#
+# Each rewording is its own row in `variants` (index 0 is the original text), and
+# each card of a note has its own row in `ord_state`, so adding a rewording or
+# recording which one was shown only ever touches a single row.
+#
+# Rewordings are keyed by the content they were generated from (see content_key),
+# not by note: editing a note or changing the model or context moves it to a new
+# key, and notes with identical text share their rewordings.
+#
+# Rewordings that were asked for but not made yet are kept in `jobs`, one row per
+# note, so that they survive the queue stopping and Anki restarting.
+#
+# When each content key was last used is kept in `access`, and which notes used it
+# in `key_notes`, so that `maintain` can keep the file within a size limit by
+# evicting the coldest keys, and those that only deleted notes used. Uses are
+# remembered in memory and written in bulk (see `touch`), so reviewing does not
+# cost an extra write.
+
+from typing import Callable, Iterator, List, Optional, Tuple
+from contextlib import contextmanager
+import functools
+import itertools
+import unicodedata
+import hashlib
+import sqlite3
+import threading
+import json
+import gzip
+import time
+
+# Key of the rewordings of a text generated with a given model and context.
+# Whitespace and Unicode normalization differences do not change the key.
+def content_key(text: str, model: Optional[str], context: Optional[str]) -> str:
+    normalized = unicodedata.normalize('NFC', ' '.join((text or '').split()))
+    return hashlib.sha1('\x1f'.join((normalized, model or '', context or '')).encode('utf-8')).hexdigest()
+
+# Statements are kept as constants so that sqlite3's per-connection statement
+# cache (see `cached_statements`) always hits and they are only prepared once.
+SQL_CREATE_VARIANTS = """
+CREATE TABLE IF NOT EXISTS variants (
+    key TEXT NOT NULL,
+    idx INTEGER NOT NULL,
+    text TEXT NOT NULL,
+    model TEXT,
+    created_at INTEGER NOT NULL,
+    PRIMARY KEY (key, idx)
+) WITHOUT ROWID
+"""
+SQL_CREATE_ORD_STATE = """
+CREATE TABLE IF NOT EXISTS ord_state (
+    note_id INTEGER NOT NULL,
+    ord INTEGER NOT NULL,
+    last_render INTEGER NOT NULL DEFAULT 0,
+    reps INTEGER,
+    PRIMARY KEY (note_id, ord)
+) WITHOUT ROWID
+"""
+SQL_CREATE_JOBS = """
+CREATE TABLE IF NOT EXISTS jobs (
+    note_id INTEGER PRIMARY KEY,
+    card_id INTEGER NOT NULL,
+    priority INTEGER NOT NULL,
+    state TEXT NOT NULL DEFAULT 'queued',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    eligible_at REAL NOT NULL,
+    created_at INTEGER NOT NULL
+)
+"""
+SQL_CREATE_ACCESS = """
+CREATE TABLE IF NOT EXISTS access (
+    key TEXT PRIMARY KEY,
+    note_id INTEGER,
+    accessed_at INTEGER NOT NULL
+) WITHOUT ROWID
+"""
+SQL_CREATE_KEY_NOTES = """
+CREATE TABLE IF NOT EXISTS key_notes (
+    key TEXT NOT NULL,
+    note_id INTEGER NOT NULL,
+    PRIMARY KEY (key, note_id)
+) WITHOUT ROWID
+"""
+SQL_CREATE_KEY_NOTES_INDEX = "CREATE INDEX IF NOT EXISTS key_notes_by_note ON key_notes (note_id)"
+SQL_SELECT_TEXTS = "SELECT text FROM variants WHERE key = ? ORDER BY idx"
+SQL_SELECT_ORD_STATES = "SELECT ord, last_render, reps FROM ord_state WHERE note_id = ?"
+SQL_COUNT_TEXTS = "SELECT key, COUNT(*) FROM variants WHERE key IN ({}) GROUP BY key"
+SQL_INSERT_VARIANT = "INSERT OR IGNORE INTO variants (key, idx, text, model, created_at) VALUES (?, ?, ?, ?, ?)"
+SQL_APPEND_VARIANT = """
+INSERT INTO variants (key, idx, text, model, created_at)
+SELECT ?, COALESCE(MAX(idx) + 1, 0), ?, ?, ? FROM variants WHERE key = ?
+"""
+SQL_UPSERT_ORD_STATE = """
+INSERT INTO ord_state (note_id, ord, last_render, reps) VALUES (?, ?, ?, ?)
+ON CONFLICT (note_id, ord) DO UPDATE SET last_render = excluded.last_render, reps = excluded.reps
+"""
+SQL_DELETE_VARIANTS = "DELETE FROM variants WHERE key = ?"
+SQL_DELETE_ORD_STATES = "DELETE FROM ord_state WHERE note_id = ?"
+SQL_DELETE_ALL_VARIANTS = "DELETE FROM variants"
+SQL_DELETE_ALL_ORD_STATES = "DELETE FROM ord_state"
+SQL_SELECT_ALL_VARIANTS = "SELECT key, text, model FROM variants ORDER BY key, idx"
+SQL_UPSERT_ACCESS = """
+INSERT INTO access (key, note_id, accessed_at) VALUES (?, ?, ?)
+ON CONFLICT (key) DO UPDATE SET note_id = COALESCE(excluded.note_id, note_id), accessed_at = MAX(accessed_at, excluded.accessed_at)
+"""
+# Keys written before access was tracked (or by an import) count as last used when they were last added to.
+SQL_BACKFILL_ACCESS = "INSERT OR IGNORE INTO access (key, note_id, accessed_at) SELECT key, NULL, MAX(created_at) FROM variants GROUP BY key"
+# Notes recorded in `access` before `key_notes` existed.
+SQL_BACKFILL_KEY_NOTES = "INSERT OR IGNORE INTO key_notes (key, note_id) SELECT key, note_id FROM access WHERE note_id IS NOT NULL"
+SQL_INSERT_KEY_NOTE = "INSERT OR IGNORE INTO key_notes (key, note_id) VALUES (?, ?)"
+SQL_SELECT_KNOWN_NOTES = "SELECT note_id FROM ord_state UNION SELECT note_id FROM key_notes"
+SQL_SELECT_KEYS_OF_NOTE = "SELECT key FROM key_notes WHERE note_id = ?"
+SQL_KEY_HAS_NOTES = "SELECT 1 FROM key_notes WHERE key = ? LIMIT 1"
+SQL_DELETE_KEY_NOTES = "DELETE FROM key_notes WHERE key = ?"
+SQL_DELETE_KEY_NOTES_OF_NOTE = "DELETE FROM key_notes WHERE note_id = ?"
+SQL_DELETE_ALL_KEY_NOTES = "DELETE FROM key_notes"
+SQL_DELETE_ORD_STATES_OF_KEY = "DELETE FROM ord_state WHERE note_id IN (SELECT note_id FROM key_notes WHERE key = ?)"
+# Roughly what a text takes up on disk: its key, text and model, and some overhead per row.
+SQL_TEXT_BYTES = "LENGTH(CAST(key AS BLOB)) + LENGTH(CAST(text AS BLOB)) + COALESCE(LENGTH(CAST(model AS BLOB)), 0) + 16"
+SQL_DATA_BYTES = f"SELECT COALESCE(SUM({SQL_TEXT_BYTES}), 0) FROM variants"
+SQL_SELECT_COLDEST_KEYS = f"""
+SELECT access.key, (SELECT COALESCE(SUM({SQL_TEXT_BYTES}), 0) FROM variants WHERE variants.key = access.key)
+FROM access ORDER BY accessed_at LIMIT ?
+"""
+SQL_DELETE_ACCESS = "DELETE FROM access WHERE key = ?"
+SQL_DELETE_ALL_ACCESS = "DELETE FROM access"
+SQL_DELETE_JOB_OF_NOTE = "DELETE FROM jobs WHERE note_id = ?"
+SQL_UPSERT_JOB = """
+INSERT INTO jobs (note_id, card_id, priority, state, attempts, eligible_at, created_at) VALUES (?, ?, ?, 'queued', ?, ?, ?)
+ON CONFLICT (note_id) DO UPDATE SET card_id = excluded.card_id, priority = MIN(priority, excluded.priority)
+"""
+SQL_UPDATE_JOB = "UPDATE jobs SET state = ?, attempts = COALESCE(?, attempts), eligible_at = COALESCE(?, eligible_at) WHERE note_id = ?"
+SQL_DELETE_JOB = "DELETE FROM jobs WHERE note_id = ?"
+SQL_PRUNE_JOBS = "DELETE FROM jobs WHERE created_at < ?"
+SQL_SELECT_JOBS = "SELECT note_id, card_id, priority, attempts, eligible_at FROM jobs ORDER BY priority, eligible_at LIMIT ?"
+
+# The original schema kept everything about a note in one row of JSON blobs.
+SQL_LEGACY_EXISTS = "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'id_to_strings'"
+SQL_LEGACY_SELECT = "SELECT id, items, last_renders FROM id_to_strings"
+SQL_LEGACY_DROP = "DROP TABLE id_to_strings"
+
+# Rewordings used to be keyed by note id; the key of each note is computed from its original text (index 0).
+SQL_VARIANTS_COLUMNS = "PRAGMA table_info(variants)"
+SQL_VARIANTS_BY_NOTE_RENAME = "ALTER TABLE variants RENAME TO variants_by_note"
+SQL_VARIANTS_BY_NOTE_MIGRATE = """
+INSERT OR IGNORE INTO variants (key, idx, text, model, created_at)
+SELECT original.key, v.idx, v.text, v.model, v.created_at
+FROM variants_by_note v
+JOIN (SELECT note_id, content_key(text) AS key FROM variants_by_note WHERE idx = 0) original
+ON original.note_id = v.note_id
+"""
+SQL_VARIANTS_BY_NOTE_DROP = "DROP TABLE variants_by_note"
+
+# WAL lets the reviewer read while a worker writes. With WAL, synchronous=NORMAL
+# only syncs on checkpoints, which is safe against corruption; at worst the last
+# few rewordings are lost on power failure, and those can simply be regenerated.
+PRAGMAS = (
+    # Lets `maintain` give freed pages back without a full VACUUM. Only takes effect on a new file,
+    # and so must come before anything that writes to it; older files are converted once by `setup`.
+    "PRAGMA auto_vacuum = INCREMENTAL",
+    "PRAGMA journal_mode = WAL",
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA mmap_size = 67108864",
+    "PRAGMA busy_timeout = 5000",
+)
+STATEMENT_CACHE_SIZE = 64
+MAX_SQL_VARIABLES = 500 # Per statement; older SQLite builds allow no more than 999.
+EXPORT_FORMAT = 'dynamic-cards-rewordings'
+EXPORT_VERSION = 1
+IMPORT_BATCH = 500 # Lines merged per transaction.
+EVICT_BATCH = 500  # Keys evicted per transaction.
+VACUUM_PAGES = 1000 # Pages given back to the file system per transaction.
+# Pause between the transactions of `maintain`. SQLite's busy handler backs off while it waits,
+# so a writer would otherwise keep missing the short gaps between them.
+MAINTAIN_PAUSE = 0.05
+
+# Time every call of a cache operation under 'sqlite.<name>', if the cache was given a metrics registry.
+def _measured(method: Callable) -> Callable:
+    name = 'sqlite.' + method.__name__
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        if self.metrics is None:
+            return method(self, *args, **kwargs)
+        with self.metrics.timer(name):
+            return method(self, *args, **kwargs)
+    return wrapper
+
+class DynamicCache:
+
+    def __init__(self, path: str, debug: bool = False, metrics=None):
+        self.path = path
+        self.debug = debug
+        self.metrics = metrics
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._connections: List[Tuple[threading.Thread, sqlite3.Connection]] = [] # With the thread that opened each.
+        self._generation = 0
+        self._touched: dict[Tuple[str, Optional[int]], int] = {} # (key, note id) -> time of uses not written yet.
+        self._pending_setup: Optional[Tuple[Optional[str], Optional[str]]] = None # (model, context) until the tables exist.
+        self._setup_lock = threading.Lock()
+
+    # Return this thread's connection, opening and tuning it on first use.
+    # Connections opened before the last close() are discarded, and those of threads that have
+    # since exited (e.g. of a stopped event loop) are closed.
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None and self._local.generation == self._generation:
+            return conn
+        conn = sqlite3.connect(self.path,
+                               isolation_level=None, # autocommit; transactions are explicit
+                               check_same_thread=False, # allows close() from the main thread
+                               cached_statements=STATEMENT_CACHE_SIZE)
+        for pragma in PRAGMAS:
+            conn.execute(pragma)
+        if self._pending_setup is not None:
+            with self._setup_lock:
+                if self._pending_setup is not None:
+                    try:
+                        self._create_tables(conn, *self._pending_setup)
+                    except BaseException:
+                        conn.close()
+                        raise
+                    self._pending_setup = None
+        with self._lock:
+            self._connections.append((threading.current_thread(), conn))
+            self._local.conn = conn
+            self._local.generation = self._generation
+        self.release_connections()
+        if self.debug: print(f'Opened dynamic cache connection on thread {threading.get_ident()}.')
+        return conn
+
+    # Close the connections of threads that have exited. Each start of the queue runs on new threads,
+    # so without this their connections would pile up until the profile is closed.
+    def release_connections(self):
+        with self._lock:
+            exited = [conn for thread, conn in self._connections if not thread.is_alive()]
+            self._connections = [(thread, conn) for thread, conn in self._connections if thread.is_alive()]
+        self._close_connections(exited)
+
+    def _close_connections(self, connections: List[sqlite3.Connection]):
+        for conn in connections:
+            try:
+                conn.close()
+            except sqlite3.Error as e:
+                if self.debug: print('Error closing dynamic cache connection:', e)
+
+    # Group several statements into a single write transaction.
+    @contextmanager
+    def _transaction(self) -> Iterator[sqlite3.Connection]:
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    # Have the tables created, migrating any older layout, by whichever connection opens first, so that
+    # nothing is read or written until the cache is first used. Existing rewordings are assumed to have
+    # been generated with the given model and context.
+    def setup(self, model: Optional[str] = None, context: Optional[str] = None):
+        self._pending_setup = (model, context)
+
+    def _create_tables(self, conn: sqlite3.Connection, model: Optional[str], context: Optional[str]):
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            keyed_by_note = 'note_id' in [row[1] for row in conn.execute(SQL_VARIANTS_COLUMNS)]
+            if keyed_by_note:
+                conn.execute(SQL_VARIANTS_BY_NOTE_RENAME)
+            conn.execute(SQL_CREATE_VARIANTS)
+            conn.execute(SQL_CREATE_ORD_STATE)
+            conn.execute(SQL_CREATE_JOBS)
+            conn.execute(SQL_CREATE_ACCESS)
+            conn.execute(SQL_CREATE_KEY_NOTES)
+            conn.execute(SQL_CREATE_KEY_NOTES_INDEX)
+            if keyed_by_note:
+                conn.create_function('content_key', 1, lambda text: content_key(text, model, context))
+                conn.execute(SQL_VARIANTS_BY_NOTE_MIGRATE)
+                conn.execute(SQL_VARIANTS_BY_NOTE_DROP)
+                if self.debug: print('Migrated the dynamic cache to content-keyed rewordings.')
+            if conn.execute(SQL_LEGACY_EXISTS).fetchone():
+                self._migrate_legacy(conn, model, context)
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+        self._enable_incremental_vacuum(conn)
+
+    # Files created before incremental auto_vacuum was set (see PRAGMAS) keep every page they ever grew to.
+    # Converting them takes one full VACUUM, which cannot run inside a transaction; if it fails, e.g. because
+    # another process holds the file, it is tried again on the next start.
+    def _enable_incremental_vacuum(self, conn: sqlite3.Connection):
+        if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 0:
+            return
+        try:
+            conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+            conn.execute("VACUUM")
+        except sqlite3.Error as e:
+            if self.debug: print('Could not enable incremental vacuum on the dynamic cache:', e)
+            return
+        if self.debug: print('Enabled incremental vacuum on the dynamic cache.')
+
+    # Parsed entries of the old JSON-blob table. Entries that cannot be parsed are skipped; they will be regenerated.
+    def _legacy_entries(self, conn: sqlite3.Connection) -> Iterator[Tuple[int, List[str], dict[int, int]]]:
+        for note_id, items, last_renders in conn.execute(SQL_LEGACY_SELECT):
+            try:
+                texts = [str(text) for text in json.loads(items)]
+                renders = {int(ord): int(idx) for ord, idx in (json.loads(last_renders) or {}).items()} if last_renders else {}
+            except (TypeError, ValueError, AttributeError):
+                if self.debug: print(f'Skipping malformed legacy cache entry for note {note_id}.')
+                continue
+            if texts:
+                yield note_id, texts, renders
+
+    # Move every entry of the old JSON-blob table into the normalized tables, then drop it.
+    # Rows are streamed, so this runs in constant memory however large the cache is.
+    def _migrate_legacy(self, conn: sqlite3.Connection, model: Optional[str], context: Optional[str]):
+        now = int(time.time())
+        conn.executemany(SQL_INSERT_VARIANT, ((content_key(texts[0], model, context), idx, text, None, now)
+                                              for _, texts, _ in self._legacy_entries(conn)
+                                              for idx, text in enumerate(texts)))
+        conn.executemany(SQL_UPSERT_ORD_STATE, ((note_id, ord, idx, None)
+                                                for note_id, _, renders in self._legacy_entries(conn)
+                                                for ord, idx in renders.items()))
+        conn.execute(SQL_LEGACY_DROP)
+        if self.debug: print('Migrated the dynamic cache to the normalized schema.')
+
+    # Close every connection opened by any thread. Threads transparently reopen
+    # their connection the next time they touch the cache.
+    def close(self):
+        try:
+            self.flush_access()
+        except sqlite3.Error as e:
+            if self.debug: print('Could not record the last uses of the dynamic cache:', e)
+        with self._lock:
+            connections, self._connections = self._connections, []
+            self._generation += 1
+        self._close_connections([conn for _, conn in connections])
+
+    @_measured
+    def clear(self):
+        with self._lock:
+            self._touched = {}
+        with self._transaction() as conn:
+            conn.execute(SQL_DELETE_ALL_VARIANTS)
+            conn.execute(SQL_DELETE_ALL_ORD_STATES)
+            conn.execute(SQL_DELETE_ALL_ACCESS)
+            conn.execute(SQL_DELETE_ALL_KEY_NOTES)
+
+    def _texts(self, key: str) -> List[str]:
+        texts = [row[0] for row in self._connection().execute(SQL_SELECT_TEXTS, (key,))]
+        if self.debug: print(f'SQL strings for {key}:', texts)
+        return texts
+
+    # Look up the texts cached for a content key.
+    @_measured
+    def get_strings_by_key(self, key: str) -> Optional[List[str]]:
+        return self._texts(key) or None
+
+    # Look up all cached info for a note: the texts of its content key, and the last render and reps of each ord.
+    @_measured
+    def get_all(self, note_id: int, key: str) -> Optional[Tuple[List[str], dict[int, int], dict[int, int]]]:
+        texts = self._texts(key)
+        if not texts:
+            return None
+        last_renders, reps = {}, {}
+        for ord, last_render, ord_reps in self._connection().execute(SQL_SELECT_ORD_STATES, (note_id,)):
+            last_renders[ord] = last_render if last_render < len(texts) else 0
+            if ord_reps is not None:
+                reps[ord] = ord_reps
+        if self.debug: print(f'SQL ord states for {note_id}:', last_renders, reps)
+        return texts, last_renders, reps
+
+    # Start the texts of a content key with the original text, unless another note already did.
+    # Any previous state of the note's cards is reset.
+    @_measured
+    def create_entry(self, note_id: int, key: str, original: str, last_renders: dict[int, int]):
+        with self._transaction() as conn:
+            conn.execute(SQL_INSERT_VARIANT, (key, 0, original, None, int(time.time())))
+            conn.execute(SQL_DELETE_ORD_STATES, (note_id,))
+            conn.executemany(SQL_UPSERT_ORD_STATE, [(note_id, ord, idx, None) for ord, idx in last_renders.items()])
+
+    # Add a rewording after the existing ones.
+    @_measured
+    def append_variant(self, key: str, text: str, model: Optional[str] = None):
+        self._connection().execute(SQL_APPEND_VARIANT, (key, text, model, int(time.time()), key))
+
+    # Add many rewordings in one transaction, given as (key, original, text, model). Keys without any
+    # texts yet are started with their original first, as `create_entry` would.
+    @_measured
+    def append_variants(self, rows: List[Tuple[str, str, str, Optional[str]]]):
+        now = int(time.time())
+        with self._transaction() as conn:
+            for key, original, text, model in rows:
+                conn.execute(SQL_INSERT_VARIANT, (key, 0, original, None, now))
+                conn.execute(SQL_APPEND_VARIANT, (key, text, model, now, key))
+
+    # Number of texts (the original included) cached for each of `keys`; keys without any are left out.
+    @_measured
+    def count_texts(self, keys: List[str]) -> dict[str, int]:
+        counts = {}
+        for start in range(0, len(keys), MAX_SQL_VARIABLES):
+            chunk = keys[start:start + MAX_SQL_VARIABLES]
+            counts.update(self._connection().execute(SQL_COUNT_TEXTS.format(', '.join('?' * len(chunk))), chunk))
+        return counts
+
+    # Record the render last shown for a card, along with its reps at the time.
+    @_measured
+    def set_ord_state(self, id_val: int, ord: int, last_render: int, reps: Optional[int] = None):
+        self._connection().execute(SQL_UPSERT_ORD_STATE, (id_val, ord, last_render, reps))
+
+    # Drop the rewordings of a content key (for every note sharing it) and the card state of a note.
+    @_measured
+    def clear_entry(self, note_id: int, key: str):
+        with self._transaction() as conn:
+            conn.execute(SQL_DELETE_VARIANTS, (key,))
+            conn.execute(SQL_DELETE_ORD_STATES, (note_id,))
+            conn.execute(SQL_DELETE_ACCESS, (key,))
+            conn.execute(SQL_DELETE_KEY_NOTES, (key,))
+
+    # Record a rewording job for a note, or raise the priority of the note's existing one.
+    @_measured
+    def put_job(self, note_id: int, card_id: int, priority: int, attempts: int = 0, eligible_at: Optional[float] = None):
+        now = time.time()
+        self._connection().execute(SQL_UPSERT_JOB, (note_id, card_id, priority, attempts,
+                                                    eligible_at if eligible_at is not None else now, int(now)))
+
+    # Move a job to `state` ('queued', 'running' or 'waiting'), updating its attempts and the
+    # Unix time from which it may run if given.
+    @_measured
+    def set_job_state(self, note_id: int, state: str, attempts: Optional[int] = None, eligible_at: Optional[float] = None):
+        self._connection().execute(SQL_UPDATE_JOB, (state, attempts, eligible_at, note_id))
+
+    @_measured
+    def delete_jobs(self, note_ids: List[int]):
+        with self._transaction() as conn:
+            conn.executemany(SQL_DELETE_JOB, [(note_id,) for note_id in note_ids])
+
+    # Drop jobs created more than `max_age` seconds ago, and return up to `limit` of the rest as
+    # (note_id, card_id, priority, attempts, eligible_at), most urgent first. Jobs that were running
+    # when the queue stopped are returned like any other; they never finished.
+    @_measured
+    def load_jobs(self, max_age: float, limit: int) -> List[Tuple[int, int, int, int, float]]:
+        conn = self._connection()
+        pruned = conn.execute(SQL_PRUNE_JOBS, (int(time.time() - max_age),)).rowcount
+        if self.debug and pruned: print(f'Pruned {pruned} stale rewording jobs.')
+        return conn.execute(SQL_SELECT_JOBS, (limit,)).fetchall()
+
+    # Write the cache to `path` as gzipped JSON lines: a header, then one line per content key that has
+    # rewordings, {"key": ..., "texts": [original, rewording, ...], "models": [...]}. Keys are hashes of the
+    # text, model and context (see content_key), so they match the same notes in any collection. Rows are
+    # streamed, so memory use does not grow with the cache. Returns the number of keys written.
+    @_measured
+    def export_variants(self, path: str) -> int:
+        written = 0
+        with gzip.open(path, 'wt', encoding='utf-8') as f:
+            f.write(json.dumps({'format': EXPORT_FORMAT, 'version': EXPORT_VERSION}) + '\n')
+            rows = self._connection().execute(SQL_SELECT_ALL_VARIANTS)
+            for key, group in itertools.groupby(rows, key=lambda row: row[0]):
+                group = list(group)
+                if len(group) < 2:
+                    continue
+                f.write(json.dumps({'key': key, 'texts': [text for _, text, _ in group],
+                                    'models': [model for _, _, model in group]}, ensure_ascii=False) + '\n')
+                written += 1
+        if self.debug: print(f'Exported rewordings of {written} texts to {path}.')
+        return written
+
+    # Merge an export into the cache, `IMPORT_BATCH` lines at a time: unknown keys are added, and known
+    # keys get the rewordings they do not have yet, after their own. Nothing is replaced, so importing
+    # the same file twice changes nothing. Raises ValueError if the file is not an export.
+    # Returns (keys added, rewordings added).
+    @_measured
+    def import_variants(self, path: str) -> Tuple[int, int]:
+        keys_added = texts_added = 0
+        with gzip.open(path, 'rt', encoding='utf-8') as f:
+            try:
+                header = json.loads(f.readline())
+            except (ValueError, OSError):
+                header = None
+            if not isinstance(header, dict) or header.get('format') != EXPORT_FORMAT:
+                raise ValueError('Not an export of Dynamic Cards rewordings.')
+            if header.get('version', 0) > EXPORT_VERSION:
+                raise ValueError('This export was made by a newer version of Dynamic Cards.')
+            batch = []
+            for number, line in enumerate(f, start=2):
+                if not line.strip():
+                    continue
+                try:
+                    entry = json.loads(line)
+                    batch.append((str(entry['key']), [str(text) for text in entry['texts']],
+                                  list(entry.get('models') or [])))
+                except (ValueError, KeyError, TypeError) as e:
+                    raise ValueError(f'Line {number} of the export is malformed ({e!r}).')
+                if len(batch) >= IMPORT_BATCH:
+                    keys, texts = self._merge_variants(batch)
+                    keys_added, texts_added, batch = keys_added + keys, texts_added + texts, []
+            keys, texts = self._merge_variants(batch)
+        keys_added, texts_added = keys_added + keys, texts_added + texts
+        if self.debug: print(f'Imported {texts_added} rewordings ({keys_added} new texts) from {path}.')
+        return keys_added, texts_added
+
+    def _merge_variants(self, entries: List[Tuple[str, List[str], List[Optional[str]]]]) -> Tuple[int, int]:
+        keys_added = texts_added = 0
+        now = int(time.time())
+        with self._transaction() as conn:
+            for key, texts, models in entries:
+                if not texts:
+                    continue
+                models = models + [None] * (len(texts) - len(models))
+                existing = {row[0] for row in conn.execute(SQL_SELECT_TEXTS, (key,))}
+                if not existing:
+                    conn.execute(SQL_INSERT_VARIANT, (key, 0, texts[0], None, now))
+                    existing.add(texts[0])
+                    keys_added += 1
+                for text, model in zip(texts[1:], models[1:]):
+                    if text not in existing:
+                        conn.execute(SQL_APPEND_VARIANT, (key, text, model, now, key))
+                        existing.add(text)
+                        texts_added += 1
+        return keys_added, texts_added
+
+    # Remember that a note used the texts of a content key. Only kept in memory until the next
+    # `flush_access`, so this is cheap enough to call on every review.
+    def touch(self, key: str, note_id: Optional[int] = None):
+        with self._lock:
+            self._touched[(key, note_id)] = int(time.time())
+
+    @_measured
+    def flush_access(self):
+        with self._lock:
+            touched, self._touched = self._touched, {}
+        if touched:
+            with self._transaction() as conn:
+                conn.executemany(SQL_UPSERT_ACCESS, [(key, note_id, at) for (key, note_id), at in touched.items()])
+                conn.executemany(SQL_INSERT_KEY_NOTE, [(key, note_id) for key, note_id in touched if note_id is not None])
+
+    # Roughly how many bytes the texts take up. Unlike the size of the file, this goes down as soon
+    # as texts are deleted, rather than as whole pages happen to be freed.
+    @_measured
+    def data_bytes(self) -> int:
+        return self._connection().execute(SQL_DATA_BYTES).fetchone()[0]
+
+    # Delete the texts of some keys, along with the card state of the notes that used them.
+    def _evict(self, conn: sqlite3.Connection, keys: List[str]):
+        for key in keys:
+            conn.execute(SQL_DELETE_ORD_STATES_OF_KEY, (key,))
+            conn.execute(SQL_DELETE_VARIANTS, (key,))
+            conn.execute(SQL_DELETE_ACCESS, (key,))
+            conn.execute(SQL_DELETE_KEY_NOTES, (key,))
+
+    # Keep the cache bounded. Meant to run in the background now and then:
+    # - Notes that no longer exist are forgotten, and so are the texts that no other note has used
+    #   (notes with the same text share them). `existing` returns which of the note ids it is given
+    #   are still in the collection. Texts that no note is known to have used, e.g. imported ones,
+    #   are left to the size limit.
+    # - If the texts take up more than `max_bytes` (see `data_bytes`; 0 for no limit), the least recently
+    #   used keys are evicted until they fit.
+    # - Freed pages are given back to the file system (see PRAGMAS). There is no full VACUUM,
+    #   which would hold up writes from the reviewer for as long as it runs.
+    # Returns how many notes and keys were forgotten.
+    @_measured
+    def maintain(self, max_bytes: int, existing: Callable[[List[int]], set]) -> dict[str, int]:
+        self.flush_access()
+        conn = self._connection()
+        conn.execute(SQL_BACKFILL_ACCESS)
+        conn.execute(SQL_BACKFILL_KEY_NOTES)
+
+        note_ids = [row[0] for row in conn.execute(SQL_SELECT_KNOWN_NOTES)]
+        deleted = []
+        for start in range(0, len(note_ids), MAX_SQL_VARIABLES):
+            chunk = note_ids[start:start + MAX_SQL_VARIABLES]
+            present = existing(chunk)
+            deleted += [note_id for note_id in chunk if note_id not in present]
+        orphaned = 0
+        for start in range(0, len(deleted), EVICT_BATCH):
+            with self._transaction() as conn:
+                for note_id in deleted[start:start + EVICT_BATCH]:
+                    keys = [row[0] for row in conn.execute(SQL_SELECT_KEYS_OF_NOTE, (note_id,)).fetchall()]
+                    conn.execute(SQL_DELETE_KEY_NOTES_OF_NOTE, (note_id,))
+                    conn.execute(SQL_DELETE_ORD_STATES, (note_id,))
+                    conn.execute(SQL_DELETE_JOB_OF_NOTE, (note_id,))
+                    keys = [key for key in keys if conn.execute(SQL_KEY_HAS_NOTES, (key,)).fetchone() is None]
+                    self._evict(conn, keys)
+                    orphaned += len(keys)
+            time.sleep(MAINTAIN_PAUSE)
+
+        evicted = 0
+        excess = self.data_bytes() - max_bytes if max_bytes > 0 else 0
+        while excess > 0:
+            coldest = []
+            for key, size in conn.execute(SQL_SELECT_COLDEST_KEYS, (EVICT_BATCH,)).fetchall():
+                coldest.append(key)
+                excess -= size
+                if excess <= 0:
+                    break
+            if not coldest:
+                break
+            with self._transaction() as conn:
+                self._evict(conn, coldest)
+            evicted += len(coldest)
+            time.sleep(MAINTAIN_PAUSE)
+
+        if conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2:
+            # A few pages at a time, so the reviewer can write in between.
+            # Frees a page per step; executescript steps to the end.
+            while conn.execute("PRAGMA freelist_count").fetchone()[0] > 0:
+                conn.executescript(f"PRAGMA incremental_vacuum({VACUUM_PAGES})")
+                time.sleep(MAINTAIN_PAUSE)
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        if self.debug: print(f'Dynamic cache maintenance: forgot {len(deleted)} deleted notes and {orphaned} keys only they used, '
+                             f'evicted {evicted} keys; {self.data_bytes() / 2 ** 20:.1f} MB of texts left.')
+        return {'deleted_notes': len(deleted), 'orphaned_keys': orphaned, 'evicted_keys': evicted}
@@ -0,0 +1,49 @@
+# Keep-alive HTTP sessions for the LLM platforms.
+# Each platform gets one pooled `requests.Session` that is reused for the whole
+# review session, so rewordings do not pay for a new TCP+TLS handshake each time.
+
+from typing import Optional
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+
+class PlatformSessions:
+
+    def __init__(self, pool_size: int = 4, debug: bool = False):
+        self.pool_size = pool_size
+        self.debug = debug
+        self.sessions: dict[tuple[int, str], requests.Session] = {}
+        self.lock = threading.Lock()
+
+    def _build(self, headers: dict) -> requests.Session:
+        session = requests.Session()
+        # Retries are handled by the add-on itself, so the adapter never retries on its own.
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max(1, self.pool_size), max_retries=0)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        session.headers.update(headers)
+        return session
+
+    # Return the session for a platform and API key, building a new one if there is none yet.
+    # Each key of a platform gets its own session. `headers` are only used when a new session is built.
+    def get(self, platform_index: int, api_key: str, headers: dict) -> requests.Session:
+        with self.lock:
+            session = self.sessions.get((platform_index, api_key))
+            if session is not None:
+                return session
+            session = self.sessions[(platform_index, api_key)] = self._build(headers)
+            if self.debug: print(f'Built new HTTP session for platform {platform_index}.')
+            return session
+
+    # Drop the sessions of every platform except `keep_index` (or all of them), and those of keys no longer in use.
+    def close(self, keep_index: Optional[int] = None, keep_keys: Optional[set] = None):
+        with self.lock:
+            for platform_index, api_key in list(self.sessions):
+                if platform_index != keep_index or (keep_keys is not None and api_key not in keep_keys):
+                    self.sessions.pop((platform_index, api_key)).close()
+
+    # Resize the connection pools; takes effect as sessions are rebuilt.
+    def resize(self, pool_size: int):
+        if pool_size != self.pool_size:
+            self.pool_size = pool_size
+            self.close()
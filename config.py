@@ -1,36 +1,12 @@
 # This might be a bit shaky.
 from typing import Any, Optional
+from contextlib import contextmanager
 from aqt.addons import AddonManager
 from os.path import abspath, dirname, join
-
-PLATFORMS = ["Mistral AI (Mistral)", "Gemini (Google)"]
-MISTRAL_MODELS = [
-    "mistral-small-latest",
-    "mistral-medium-latest",
-    "mistral-large-latest",
-    "ministral-3b-latest",
-    "ministral-8b-latest",
-    "ministral-14b-latest",
-    "open-mistral-nemo",
-    "open-mixtral-8x7b",
-    "open-mixtral-8x22b",
-]
-
-GEMINI_MODELS = [
-    "gemini-3.5-flash",
-    "gemini-3.5-flash-lite",
-    "gemini-3.1-pro",
-    "gemini-3.1-flash-lite",
-    "gemini-3-pro",
-    "gemini-3-flash",
-    "gemini-2.5-pro",
-    "gemini-2.5-flash",
-    "gemini-2.5-flash-lite",
-    "gemini-2.0-flash",
-    "gemini-2.0-flash-lite",
-]
-
-MODELS = [MISTRAL_MODELS, GEMINI_MODELS]
+import copy
+import json
+from .lru import LRUCache
+from .providers import PROVIDERS
 
 class Config:
 
@@ -39,61 +15,88 @@ class Config:
         self._addon_manager = addon_manager
         self._module_name = module_name
 
+        # Settings variables
+        self.settings = Settings(addon_manager=addon_manager, module_name=module_name, debug=debug)
+
         # Cache variables
-        self.data = {}
+        # Note id -> CachedNoteEntry for recently reviewed notes; evicted entries are reloaded from the dynamic database.
+        self.data = LRUCache(self.settings.memory_cache_size)
         self.pause = False
         self.debug = debug
 
-        # Settings variables
-        self.settings = Settings(addon_manager=addon_manager, module_name=module_name, debug=debug)
-
 class Settings:
 
     CACHE = join(dirname(abspath(__file__)), 'dynamic.db')
+    # Top-level keys of old configs that now live in `platform_configs`; never written back.
+    MIGRATED_KEYS = {"api_key", "model", "context", "max_renders", "num_retries", "retry_delay_seconds"}
     
     def __init__(self, addon_manager: AddonManager, module_name: str, debug: bool = False):
         self.setattr_nowrite('_addon_manager', addon_manager)
         self.setattr_nowrite('_module_name', module_name)
+        self.setattr_nowrite('_depth', 0)     # Transactions open.
+        self.setattr_nowrite('_written', {})  # The configuration as last read or written, to tell what changed.
         self._read_settings()
         if debug:
             print(f'Settings: Establishing CACHE at {self.CACHE}')
 
-    # Any time a setting is changed, write it to the configuration file.
+    # Any time a setting is changed outside a transaction, write it to the configuration file.
     def __setattr__(self, name: str, value: Any) -> None:
         super().__setattr__(name, value)
-        self._write_settings()
+        if self._depth == 0:
+            self.save()
 
     def setattr_nowrite(self, name: str, value: Any) -> None:
         self.__dict__[name] = value
 
+    # Group changes into a single write, made when the outermost transaction ends and only if a setting
+    # changed (in place changes to `platform_configs` included). If the block raises, or the result fails
+    # validation, every setting goes back to what it was when the transaction began.
+    @contextmanager
+    def transaction(self):
+        outermost = self._depth == 0
+        before = copy.deepcopy(self._values()) if outermost else None
+        self.setattr_nowrite('_depth', self._depth + 1)
+        try:
+            yield self
+        except BaseException:
+            if outermost:
+                self._restore(before)
+            raise
+        finally:
+            self.setattr_nowrite('_depth', self._depth - 1)
+        if outermost:
+            try:
+                self.save()
+            except ValueError:
+                self._restore(before)
+                raise
+
+    # Write the configuration file if anything differs from what was last read or written.
+    # Returns whether it was written; raises ValueError if the settings fail validation.
+    def save(self) -> bool:
+        config_new = self._values()
+        if config_new == self._written:
+            return False
+        self._validate(config_new)
+        self._addon_manager.writeConfig(self._module_name, config_new)
+        self.setattr_nowrite('_written', copy.deepcopy(config_new))
+        return True
+
     def fetch_config(self) -> Optional[dict]:
         return self._addon_manager.getConfig(self._module_name)
 
     # Don't call setattr unnecessarily.
     def _read_settings(self):
         config = self.fetch_config()
+        self.setattr_nowrite('_written', copy.deepcopy({k: v for k, v in config.items() if k not in self.MIGRATED_KEYS}))
 
         # One-time migration for users updating the addon
         if "platform_configs" not in config:
             # Create default structures for the new per-platform settings
-            default_configs = [
-                {
-                    "api_key": config.get("api_key", ""),
-                    "model": config.get("model", "mistral-medium-latest"),
-                    "context": config.get("context", "You are a helpful flashcard assistant. Rewrite the following text to be slightly different, while preserving the core meaning and any special formatting like cloze deletions (e.g., {{c1::text}}). Do not add any conversational text or markdown formatting."),
-                    "max_renders": config.get("max_renders", 3),
-                    "num_retries": config.get("num_retries", 3),
-                    "retry_delay_seconds": config.get("retry_delay_seconds", 1.0),
-                },
-                {
-                    "api_key": "",
-                    "model": "gemini-flash-latest",
-                    "context": "You are a helpful flashcard assistant. Rewrite the following text to be slightly different, while preserving the core meaning and any special formatting like cloze deletions (e.g., {{c1::text}}). Do not add any conversational text or markdown formatting.",
-                    "max_renders": 3,
-                    "num_retries": 3,
-                    "retry_delay_seconds": 1.0,
-                }
-            ]
+            default_configs = [provider.default_config() for provider in PROVIDERS]
+            for key in ("context", "max_renders", "num_retries", "retry_delay_seconds"):
+                if key in config:
+                    default_configs[0][key] = config[key]
             # Preserve the user's current settings for their selected platform
             current_platform_index = config.get("platform_index", 0)
             # Overwrite the default for the user's previously active platform
@@ -105,9 +108,34 @@ class Settings:
         for key, value in config.items():
             self.setattr_nowrite(key, value)
 
-    def _write_settings(self):
-        config_keys = self.fetch_config().keys()
-        # Filter out old, now-unused top-level keys
-        migrated_keys = {"api_key", "model", "context", "max_renders", "num_retries", "retry_delay_seconds"}
-        config_new = {k: getattr(self, k) for k in self.__dict__.keys() if not k.startswith('_') and k not in migrated_keys}
-        self._addon_manager.writeConfig(self._module_name, config_new)
\ No newline at end of file
+        # Platforms added since the config was written start from their defaults.
+        for provider in PROVIDERS[len(self.platform_configs):]:
+            self.platform_configs.append(provider.default_config())
+
+    # The settings as written to the configuration file.
+    def _values(self) -> dict:
+        return {k: v for k, v in self.__dict__.items() if not k.startswith('_') and k not in self.MIGRATED_KEYS}
+
+    def _restore(self, values: dict):
+        for key in [k for k in self._values() if k not in values]:
+            del self.__dict__[key]
+        for key, value in values.items():
+            self.setattr_nowrite(key, value)
+
+    # Refuse settings that would not load again: every setting keeps the kind of value it had
+    # (whole and decimal numbers are interchangeable), and the active platform exists.
+    def _validate(self, config: dict):
+        def kind(value):
+            return float if isinstance(value, (int, float)) and not isinstance(value, bool) else type(value)
+        for key, value in config.items():
+            if key in self._written and kind(value) != kind(self._written[key]):
+                raise ValueError(f'setting {key} cannot be {value!r}')
+        platform_configs = config.get("platform_configs")
+        if not isinstance(platform_configs, list) or not all(isinstance(c, dict) for c in platform_configs):
+            raise ValueError('platform_configs must be a list of platform settings')
+        if not isinstance(config.get("platform_index"), int) or not 0 <= config["platform_index"] < len(platform_configs):
+            raise ValueError(f'platform_index {config.get("platform_index")!r} is out of range')
+        try:
+            json.dumps(config)
+        except (TypeError, ValueError) as e:
+            raise ValueError(f'settings cannot be written: {e}')
@@ -0,0 +1,141 @@
+# A pool of credentials (API keys) across platforms, and a router that picks the healthiest one.
+# Every key has its own rate limiter, so throughput adds up across keys. Keys of the active platform
+# are used first; keys of platforms marked as fallbacks are used only when no active key can take
+# a request. A key that is rate limited or rejected cools down while the others carry on.
+#
+# Platforms may hold several keys: `api_key` is the first and `extra_api_keys` the rest.
+
+from typing import Callable, List, Optional, Tuple
+from collections import deque
+import threading
+import time
+from .ratelimit import PlatformRateLimiter
+from . import retry
+from .retry import RewordingError
+
+RECENT_OUTCOMES = 20          # Requests remembered per key for its error rate.
+AUTH_COOLDOWN_SECONDS = 600.0 # Rejected keys are tried again after this long, in case they were fixed.
+MIN_COOLDOWN_SECONDS = 1.0    # Even when the platform says to retry right away.
+MAX_COOLDOWN_SECONDS = 60.0   # Cap on the backoff for rate limits that do not say how long to wait.
+MAX_FAILOVERS_PER_TASK = 10   # Rate limits a task may pass on to other keys before they count as failed attempts.
+
+# All keys of a platform, in order.
+def api_keys(platform_settings: dict) -> List[str]:
+    keys = [platform_settings.get("api_key", "")] + list(platform_settings.get("extra_api_keys", []))
+    return [key for key in keys if key] or [""]
+
+# Keys typed into the settings, separated by commas, spaces or new lines.
+def parse_api_keys(text: str) -> List[str]:
+    return [key for key in text.replace(',', ' ').split() if key]
+
+def format_api_keys(platform_settings: dict) -> str:
+    return ', '.join(key for key in api_keys(platform_settings) if key)
+
+class Credential:
+
+    def __init__(self, platform_index: int, api_key: str, position: int):
+        self.platform_index = platform_index
+        self.api_key = api_key
+        self.position = position # Among the keys of its platform, for display without revealing the key.
+        self.limiter = PlatformRateLimiter()
+        self.outcomes = deque(maxlen=RECENT_OUTCOMES) # True for every request that went through.
+        self.rate_limits_in_a_row = 0
+        self.remaining: Optional[int] = None # Requests or tokens left, if the platform says.
+        self.last_used = 0.0
+
+    @property
+    def name(self) -> str:
+        return f'{self.platform_index}.{self.position}'
+
+    @property
+    def cooldown_until(self) -> float:
+        return self.limiter.blocked_until
+
+    def error_rate(self) -> float:
+        return self.outcomes.count(False) / len(self.outcomes) if self.outcomes else 0.0
+
+    def cooling_down(self, now: float) -> bool:
+        return self.limiter.blocked_until > now
+
+    # Platform settings as seen with this key.
+    def settings(self, platform_settings: dict) -> dict:
+        return {**platform_settings, "api_key": self.api_key}
+
+class CredentialPool:
+
+    def __init__(self, debug: bool = False):
+        self.debug = debug
+        self.credentials: dict[Tuple[int, str], Credential] = {}
+        self.lock = threading.Lock()
+
+    # Credentials to route between, in order of preference: the active platform's keys, then those
+    # of fallback platforms. Limiters are kept in sync with the settings, as they may change at any time.
+    def _candidates(self, settings) -> List[Tuple[int, Credential]]:
+        candidates = []
+        for platform_index, platform_settings in enumerate(settings.platform_configs):
+            if platform_index == settings.platform_index:
+                tier = 0
+            elif platform_settings.get("use_as_fallback", False):
+                tier = 1
+            else:
+                continue
+            for position, key in enumerate(api_keys(platform_settings)):
+                credential = self.credentials.get((platform_index, key))
+                if credential is None:
+                    credential = self.credentials[(platform_index, key)] = Credential(platform_index, key, position)
+                credential.position = position
+                credential.limiter.configure(platform_settings.get("requests_per_minute", 0),
+                                             platform_settings.get("tokens_per_minute", 0))
+                candidates.append((tier, credential))
+        return candidates
+
+    # Reserve room for one request on the healthiest credential that has any. `estimate` gives the
+    # tokens the request costs with a platform's settings. Returns (credential, 0), or (None, seconds
+    # to wait) if every credential is cooling down or out of quota.
+    def acquire(self, settings, estimate: Callable[[dict], int]) -> Tuple[Optional[Credential], float]:
+        with self.lock:
+            now = time.monotonic()
+            candidates = self._candidates(settings)
+            # Healthy keys first; among equally healthy ones, the least recently used, to spread the load.
+            candidates.sort(key=lambda candidate: (candidate[0], candidate[1].cooling_down(now),
+                                                   round(candidate[1].error_rate(), 1), candidate[1].last_used))
+            wait = None
+            for _, credential in candidates:
+                delay = credential.limiter.try_acquire(estimate(settings.platform_configs[credential.platform_index]))
+                if delay <= 0:
+                    credential.last_used = now
+                    return credential, 0.0
+                wait = delay if wait is None else min(wait, delay)
+            return None, wait if wait is not None else 1.0
+
+    # How many credentials are not cooling down, and could take a request as far as their quota allows.
+    def available(self, settings) -> int:
+        with self.lock:
+            now = time.monotonic()
+            return sum(1 for _, credential in self._candidates(settings) if not credential.cooling_down(now))
+
+    # The platform said how much quota is left (see `retry.get_remaining_quota`).
+    def report_success(self, credential: Credential, remaining: Optional[int] = None, reset: Optional[float] = None):
+        with self.lock:
+            credential.outcomes.append(True)
+            credential.rate_limits_in_a_row = 0
+            credential.remaining = remaining
+        if remaining is not None and remaining <= 0:
+            credential.limiter.block_for(reset if reset is not None else 1.0)
+
+    # Only failures that say something about the credential or its platform count against it.
+    def report_failure(self, credential: Credential, error: RewordingError):
+        if error.kind == retry.INVALID_OUTPUT:
+            return
+        with self.lock:
+            credential.outcomes.append(False)
+            if error.kind == retry.RATE_LIMIT:
+                credential.rate_limits_in_a_row += 1
+                cooldown = max(MIN_COOLDOWN_SECONDS, error.retry_after if error.retry_after is not None else
+                               min(MAX_COOLDOWN_SECONDS, 2.0 ** (credential.rate_limits_in_a_row - 1)))
+            elif error.kind == retry.AUTH:
+                cooldown = AUTH_COOLDOWN_SECONDS
+            else:
+                return
+        credential.limiter.block_for(cooldown)
+        if self.debug: print(f'Credential {credential.name} cooling down for {cooldown:.1f}s ({error.kind}).')
@@ -1,11 +1,26 @@
 # Storing Dialog files.
 
 from typing import Optional
-from aqt.qt import QDialog, QWidget, Qt
+from aqt.qt import QDialog, QWidget, Qt, QTimer, QFileDialog, qconnect
+from aqt.utils import showWarning
+import json
 from .ui.welcome import Ui_Dialog as WelcomeUI
 from .ui.settings import Ui_Dialog as SettingsUI
+from .ui.progress import Ui_Dialog as ProgressUI
 from .config import Settings
-from .config import MODELS
+from .metrics import Metrics, format_snapshot
+
+STATS_REFRESH_MS = 1000
+PROGRESS_REFRESH_MS = 500
+
+# A rough duration for display, e.g. '2 h 5 min', '12 min' or '40 s'.
+def format_duration(seconds: float) -> str:
+    seconds = int(seconds)
+    if seconds >= 3600:
+        return f'{seconds // 3600} h {seconds % 3600 // 60} min'
+    if seconds >= 60:
+        return f'{seconds // 60} min'
+    return f'{seconds} s'
 
 class WelcomeDialog(QDialog):
 
@@ -19,17 +34,53 @@ class WelcomeDialog(QDialog):
         
 class SettingsDialog(QDialog):
 
-    def __init__(self, settings: Settings):
+    def __init__(self, settings: Settings, metrics: Optional[Metrics] = None):
         super().__init__()
         self.form = SettingsUI()
         self.form.setupUi(self)
         self.settings = settings
+        self.metrics = metrics
+
+        # The Stats tab refreshes itself while it is showing.
+        self.stats_timer = QTimer(self)
+        self.stats_timer.setInterval(STATS_REFRESH_MS)
+        qconnect(self.stats_timer.timeout, self.refresh_stats)
+        qconnect(self.form.tabWidget.currentChanged, lambda index: self.refresh_stats())
+        qconnect(self.form.resetStatsButton.clicked, self.reset_stats)
+        qconnect(self.form.exportStatsButton.clicked, self.export_stats)
+        qconnect(self.finished, lambda result: self.stats_timer.stop())
 
     def open(self):
         """Load settings and show the dialog."""
         self.load_from_config()
+        self.refresh_stats()
+        self.stats_timer.start()
         super().open()
 
+    def refresh_stats(self):
+        if self.metrics is None or self.form.tabWidget.currentWidget() is not self.form.statsTab:
+            return
+        scroll = self.form.statsTextEdit.verticalScrollBar().value()
+        self.form.statsTextEdit.setPlainText(format_snapshot(self.metrics.snapshot()))
+        self.form.statsTextEdit.verticalScrollBar().setValue(scroll)
+
+    def reset_stats(self):
+        if self.metrics is not None:
+            self.metrics.reset()
+            self.refresh_stats()
+
+    def export_stats(self):
+        if self.metrics is None:
+            return
+        path, _ = QFileDialog.getSaveFileName(self, 'Export stats', 'dynamic-cards-stats.json', 'JSON (*.json)')
+        if not path:
+            return
+        try:
+            with open(path, 'w', encoding='utf-8') as f:
+                json.dump(self.metrics.snapshot(), f, indent=2)
+        except OSError as e:
+            showWarning(f'Could not export stats: {e}', parent=self)
+
     def load_from_config(self):
 
         # Load non-platform-specific settings
@@ -38,6 +89,10 @@ class SettingsDialog(QDialog):
         self.form.keySequenceEdit_3.setKeySequence(str(self.settings.shortcut_include_exclude))
         self.form.keySequenceEdit_4.setKeySequence(str(self.settings.shortcut_pause))
         self.form.checkBox.setChecked(bool(self.settings.clear_cache_on_reviewer_end))
+        self.form.prefetchLookaheadLineEdit.setText(str(self.settings.prefetch_lookahead))
+        self.form.numWorkersLineEdit.setText(str(self.settings.num_workers))
+        self.form.firstViewDeadlineLineEdit.setText(str(self.settings.first_view_deadline_ms))
+        self.form.cacheSizeLimitLineEdit.setText(str(self.settings.cache_size_limit_mb))
 
         # Set the excluded types.
         self.form.listWidget.clear()
@@ -51,16 +106,62 @@ class SettingsDialog(QDialog):
         # Now, explicitly load all platform-specific settings.
         # This ensures the dialog is fully populated on open, even though
         # setCurrentIndex also triggers an update.
-        platform_settings = self.settings.platform_configs[platform_index]
-
-        # Populate the model dropdown with the correct list of models first.
-        self.form.modelComboBox.clear()
-        self.form.modelComboBox.addItems(MODELS[platform_index])
-
-        # Now, set the values for all platform-specific fields.
-        self.form.APIKeyLineEdit.setText(platform_settings.get("api_key", ""))
-        self.form.modelComboBox.setCurrentText(platform_settings.get("model", ""))
-        self.form.textEdit.setText(platform_settings.get("context", ""))
-        self.form.maxRendersLineEdit.setText(str(platform_settings.get("max_renders", 3)))
-        self.form.retryCountLineEdit.setText(str(platform_settings.get("num_retries", 3)))
-        self.form.retryDelayLineEdit.setText(str(platform_settings.get("retry_delay_seconds", 1.0)))
+        self.form.load_platform(platform_index, self.settings.platform_configs[platform_index])
+
+# Progress of a bulk generation (see BulkGeneration), which carries on in the background whether
+# or not this is showing. Cancelling keeps the rewordings made so far.
+class BulkProgressDialog(QDialog):
+
+    def __init__(self, job, parent: Optional[QWidget] = None):
+        super().__init__(parent)
+        self.form = ProgressUI()
+        self.form.setupUi(self)
+        self.setWindowModality(Qt.WindowModality.NonModal)
+        self.job = job
+
+        self.timer = QTimer(self)
+        self.timer.setInterval(PROGRESS_REFRESH_MS)
+        qconnect(self.timer.timeout, self.refresh)
+        qconnect(self.form.cancelButton.clicked, self.cancel_or_close)
+        qconnect(self.finished, lambda result: self.timer.stop())
+
+    def show(self):
+        self.refresh()
+        self.timer.start()
+        super().show()
+        self.raise_()
+        self.activateWindow()
+
+    def cancel_or_close(self):
+        if self.job.running:
+            self.job.cancel()
+            self.refresh()
+        else:
+            self.close()
+
+    def refresh(self):
+        job = self.job
+        finished = job.done + job.failed
+        self.form.progressBar.setMaximum(0 if job.preparing else max(1, job.total))
+        self.form.progressBar.setValue(min(finished, job.total))
+        elapsed = job.elapsed()
+        rate = job.done / elapsed if elapsed > 0 else 0.0
+        if job.preparing:
+            status = f'Looking up notes... {job.total} rewordings to make so far.'
+        elif job.running:
+            status = f'Made {job.done} of {job.total} rewordings ({rate * 60:.0f} per minute)'
+            status += f', about {format_duration((job.total - finished) / rate)} left.' if rate > 0 else '.'
+        elif job.error is not None:
+            status = f'Stopped after {job.done} of {job.total} rewordings: {job.error}'
+        elif job.cancelled:
+            status = f'Cancelled after {job.done} of {job.total} rewordings; those are kept.'
+        else:
+            status = f'Done: made {job.done} rewordings in {format_duration(elapsed)}.'
+        details = [f'{job.skipped} notes skipped (excluded, or already have enough rewordings).'] if job.skipped else []
+        if job.failed:
+            details.append(f'{job.failed} rewordings failed; generate again to retry them.')
+        self.form.statusLabel.setText(status)
+        self.form.detailsLabel.setText(' '.join(details))
+        self.form.cancelButton.setText('Cancel' if job.running else 'Close')
+        if not job.running:
+            self.timer.stop()
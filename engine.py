@@ -0,0 +1,75 @@
+# One background thread running an asyncio event loop.
+# Work is submitted from any thread (e.g. Qt hooks) and runs as tasks on the loop,
+# so scheduling, delays and cancellation need no locks or extra threads. Anki does
+# not ship an async HTTP client, so blocking calls (requests) are handed to a
+# small executor; the loop only waits on them.
+
+from typing import Any, Callable, Coroutine, Optional
+from concurrent.futures import Future, ThreadPoolExecutor
+import functools
+import asyncio
+import threading
+
+SHUTDOWN_TIMEOUT_SECONDS = 2.0
+
+class AsyncEngine:
+
+    def __init__(self, name: str = 'engine', debug: bool = False):
+        self.name = name
+        self.debug = debug
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.thread: Optional[threading.Thread] = None
+        self.executor: Optional[ThreadPoolExecutor] = None
+
+    @property
+    def running(self) -> bool:
+        return self.loop is not None and self.loop.is_running()
+
+    # Start the loop thread, with up to `max_blocking` blocking calls at a time.
+    def start(self, max_blocking: int):
+        if self.running:
+            return
+        self.loop = asyncio.new_event_loop()
+        self.executor = ThreadPoolExecutor(max_workers=max(1, max_blocking), thread_name_prefix=f'{self.name}-io')
+        started = threading.Event()
+        self.loop.call_soon(started.set)
+        self.thread = threading.Thread(target=self.loop.run_forever, name=f'{self.name}-loop', daemon=True)
+        self.thread.start()
+        started.wait()
+        if self.debug: print(f'Started event loop {self.name}.')
+
+    # Thread-safe: run `callback(*args)` on the loop.
+    def call_soon(self, callback: Callable, *args):
+        self.loop.call_soon_threadsafe(callback, *args)
+
+    # Thread-safe: run a coroutine on the loop. The returned future can be waited on from any thread.
+    def run(self, coro: Coroutine) -> Future:
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    # From the loop: run a blocking function on the executor without blocking the loop.
+    async def run_blocking(self, func: Callable, *args, **kwargs) -> Any:
+        return await self.loop.run_in_executor(self.executor, functools.partial(func, *args, **kwargs))
+
+    async def _shutdown(self):
+        tasks = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    # Cancel everything on the loop and stop it. Blocking calls already running on the
+    # executor cannot be interrupted; they finish on their own and their results are dropped.
+    def stop(self):
+        if not self.running:
+            return
+        loop, executor = self.loop, self.executor
+        try:
+            self.run(self._shutdown()).result(timeout=SHUTDOWN_TIMEOUT_SECONDS)
+        except Exception as e:
+            if self.debug: print(f'Event loop {self.name} did not shut down cleanly:', e)
+        loop.call_soon_threadsafe(loop.stop)
+        self.thread.join(timeout=SHUTDOWN_TIMEOUT_SECONDS)
+        if not self.thread.is_alive():
+            loop.close()
+        executor.shutdown(wait=False)
+        self.loop = self.executor = self.thread = None
+        if self.debug: print(f'Stopped event loop {self.name}.')
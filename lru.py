@@ -0,0 +1,66 @@
+# A small thread-safe LRU cache with hit/miss counters.
+
+from typing import Any, Callable, Hashable, Optional
+from collections import OrderedDict
+import threading
+
+class LRUCache:
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self.items: OrderedDict = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    # Return the cached value (marking it as recently used), or None if absent.
+    def get(self, key: Hashable) -> Optional[Any]:
+        with self.lock:
+            value = self.items.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self.items.move_to_end(key)
+            self.hits += 1
+            return value
+
+    # Return the cached value without counting a hit or miss or marking it as recently used.
+    def peek(self, key: Hashable) -> Optional[Any]:
+        return self.items.get(key)
+
+    def put(self, key: Hashable, value: Any):
+        with self.lock:
+            self.items[key] = value
+            self.items.move_to_end(key)
+            while len(self.items) > max(0, self.max_size):
+                self.items.popitem(last=False)
+
+    def remove(self, key: Hashable):
+        with self.lock:
+            self.items.pop(key, None)
+
+    # Drop every entry whose key matches `predicate`.
+    def remove_if(self, predicate: Callable[[Hashable], bool]):
+        with self.lock:
+            for key in [key for key in self.items if predicate(key)]:
+                del self.items[key]
+
+    def clear(self):
+        with self.lock:
+            self.items.clear()
+
+    def resize(self, max_size: int):
+        with self.lock:
+            self.max_size = max_size
+            while len(self.items) > max(0, self.max_size):
+                self.items.popitem(last=False)
+
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def __len__(self) -> int:
+        return len(self.items)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self.items
@@ -0,0 +1,116 @@
+# Masking of the markup in a field before it is sent to a model, and its restoration afterwards.
+# Cloze deletions (hints included), HTML tags and entities, media references and MathJax/LaTeX are
+# replaced by short placeholders such as [[1]], so the model only sees (and is paid for) the prose
+# and has no way of damaging the markup. After generation every placeholder must come back exactly
+# once, and the markup is put back in place of it.
+#
+# Runs of markup with only whitespace between them share one placeholder.
+
+from typing import List, Tuple
+from collections import Counter
+import re
+
+# Appended to the context for texts that carry placeholders.
+MASK_INSTRUCTIONS = ('The text contains placeholders such as [[1]] that stand for formatting. Keep every placeholder '
+                     'exactly as written, each one once, and do not add any new ones.')
+
+PLACEHOLDER = re.compile(r'\[\[(\d+)\]\]')
+CLOZE_TOKEN = re.compile(r'{{c(\d+)::|}}', flags=re.IGNORECASE)
+MARKUP = re.compile(
+    r'\[\[\d+\]\]'                                                      # Text that already looks like a placeholder
+    r'|\[sound:[^\]]*\]'                                                # Audio and video
+    r'|\\\(.*?\\\)|\\\[.*?\\\]'                                         # MathJax
+    r'|\[\$\$\].*?\[/\$\$\]|\[\$\].*?\[/\$\]|\[latex\].*?\[/latex\]'    # LaTeX
+    r'|<!--.*?-->'                                                      # HTML comments
+    r'|<img\b[^<>]*>'                                                   # Images
+    r'|(?P<tag></?[a-z][^<>]*>)'                                        # Other HTML tags; a bare < or > is prose
+    r'|&(?:#\d+|#x[0-9a-f]+|[a-z][a-z0-9]*);',                          # HTML entities
+    flags=re.IGNORECASE | re.DOTALL)
+
+# Start and end of every outermost cloze deletion, in one pass. Clozes may be nested,
+# and unbalanced markup is left alone.
+def cloze_spans(text: str) -> List[Tuple[int, int]]:
+    spans = []
+    depth = start = 0
+    for match in CLOZE_TOKEN.finditer(text):
+        if match.group() != '}}':
+            if depth == 0:
+                start = match.start()
+            depth += 1
+        elif depth > 0:
+            depth -= 1
+            if depth == 0:
+                spans.append((start, match.end()))
+    return spans
+
+# Every cloze deletion in `text`, nested ones included, as (ordinal, markup), in one pass.
+def cloze_deletions(text: str) -> List[Tuple[int, str]]:
+    deletions = []
+    opened = [] # (start, ordinal) of the deletions not closed yet
+    for match in CLOZE_TOKEN.finditer(text):
+        if match.group() != '}}':
+            opened.append((match.start(), int(match.group(1))))
+        elif opened:
+            start, ordinal = opened.pop()
+            deletions.append((ordinal, text[start:match.end()]))
+    return deletions
+
+# Whether a rewording kept the cloze deletions of the original, checked for every card of the note
+# at once: each deletion (hint included) is still there, as often as before, and no card was added.
+# Case insensitive.
+def clozes_kept(original: str, reworded: str) -> bool:
+    before = cloze_deletions(original)
+    if not before:
+        return True
+    after = cloze_deletions(reworded)
+    missing = Counter(deletion.lower() for _, deletion in before)
+    missing.subtract(deletion.lower() for _, deletion in after)
+    return (all(count <= 0 for count in missing.values())
+            and {ordinal for ordinal, _ in after} <= {ordinal for ordinal, _ in before})
+
+class MaskedText:
+
+    def __init__(self, text: str, originals: List[str], ordered: List[int]):
+        self.text = text              # What the model gets to see.
+        self.originals = originals    # The markup behind placeholder n, at n - 1.
+        self.ordered = ordered        # Placeholders standing for HTML tags, which must stay in this order.
+
+    # Put the markup back into a reworded text. Raises ValueError if the placeholders did not survive.
+    def restore(self, text: str) -> str:
+        found = [int(match.group(1)) for match in PLACEHOLDER.finditer(text)]
+        if sorted(found) != list(range(1, len(self.originals) + 1)):
+            raise ValueError('placeholders were dropped, repeated or made up')
+        ordered = set(self.ordered)
+        if [n for n in found if n in ordered] != self.ordered:
+            raise ValueError('placeholders for HTML tags were reordered')
+        return PLACEHOLDER.sub(lambda match: self.originals[int(match.group(1)) - 1], text)
+
+# Replace the markup in `text` with placeholders.
+def mask(text: str) -> MaskedText:
+    spans = [] # (start, end, is an HTML tag)
+    position = 0
+    for start, end in cloze_spans(text) + [(len(text), len(text))]:
+        for match in MARKUP.finditer(text, position, start):
+            spans.append((match.start(), match.end(), match.group('tag') is not None))
+        if start < end:
+            spans.append((start, end, False))
+        position = end
+
+    merged = []
+    for start, end, tag in spans:
+        if merged and not text[merged[-1][1]:start].strip():
+            merged[-1] = (merged[-1][0], end, merged[-1][2] or tag)
+        else:
+            merged.append((start, end, tag))
+
+    parts, originals, ordered = [], [], []
+    position = 0
+    for start, end, tag in merged:
+        originals.append(text[start:end])
+        if tag:
+            ordered.append(len(originals))
+        parts.append(text[position:start])
+        parts.append(f'[[{len(originals)}]]')
+        position = end
+    parts.append(text[position:])
+    return MaskedText(''.join(parts), originals, ordered)
@@ -0,0 +1,121 @@
+# Always-on counters and timings, cheap enough to record on the reviewer hot path.
+# Shown on the Stats tab of the settings dialog and exportable as JSON.
+#
+# Names are dotted paths, e.g. 'sqlite.get_all' or 'http.mistral.mistral-small-latest'.
+# Timings keep a count, total and maximum, plus the most recent samples for percentiles.
+
+from typing import Any, Callable, Iterator, Union
+from collections import deque
+from contextlib import contextmanager
+import functools
+import threading
+import time
+
+RECENT_SAMPLES = 512
+
+def _percentile(ordered: list, fraction: float) -> float:
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))] if ordered else 0.0
+
+class Timing:
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.recent = deque(maxlen=RECENT_SAMPLES)
+
+    def add(self, seconds: float):
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+        self.recent.append(seconds)
+
+    # Milliseconds, percentiles over the recent samples only.
+    def summary(self) -> dict:
+        ordered = sorted(self.recent)
+        return {'count': self.count,
+                'mean_ms': 1000 * self.total / self.count if self.count else 0.0,
+                'p50_ms': 1000 * _percentile(ordered, 0.50),
+                'p95_ms': 1000 * _percentile(ordered, 0.95),
+                'p99_ms': 1000 * _percentile(ordered, 0.99),
+                'max_ms': 1000 * self.max}
+
+class Metrics:
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.timings: dict[str, Timing] = {}
+        self.counters: dict[str, int] = {}
+        self.gauges: dict[str, Callable[[], Any]] = {}
+
+    def observe(self, name: str, seconds: float):
+        with self.lock:
+            timing = self.timings.get(name)
+            if timing is None:
+                timing = self.timings[name] = Timing()
+            timing.add(seconds)
+
+    def incr(self, name: str, amount: int = 1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    # Values read at snapshot time, e.g. the queue depth.
+    def gauge(self, name: str, read: Callable[[], Any]):
+        self.gauges[name] = read
+
+    @contextmanager
+    def timer(self, name: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start)
+
+    # Decorator timing every call of a function. `name` may be a function of the call's
+    # arguments, to split the timings by them.
+    def timed(self, name: Union[str, Callable[..., str]]):
+        def decorate(func: Callable) -> Callable:
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return func(*args, **kwargs)
+                finally:
+                    self.observe(name if isinstance(name, str) else name(*args, **kwargs), time.perf_counter() - start)
+            return wrapper
+        return decorate
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            timings = {name: timing.summary() for name, timing in sorted(self.timings.items())}
+            counters = dict(sorted(self.counters.items()))
+        gauges = {}
+        for name, read in sorted(self.gauges.items()):
+            try:
+                gauges[name] = read()
+            except Exception as e:
+                gauges[name] = f'unavailable ({e})'
+        return {'uptime_seconds': time.time() - self.started, 'timings': timings, 'counters': counters, 'gauges': gauges}
+
+    def reset(self):
+        with self.lock:
+            self.started = time.time()
+            self.timings.clear()
+            self.counters.clear()
+
+# Plain-text rendering of a snapshot for the Stats tab.
+def format_snapshot(snapshot: dict) -> str:
+    lines = [f"Recording for {snapshot['uptime_seconds']:.0f}s", '']
+    width = max([len(name) for section in ('timings', 'counters', 'gauges') for name in snapshot[section]] + [20])
+    lines.append('Timings (ms)'.ljust(width) + '   count     mean      p50      p95      p99      max')
+    for name, timing in snapshot['timings'].items():
+        lines.append(f"  {name.ljust(width)} {timing['count']:>7} {timing['mean_ms']:>8.2f} {timing['p50_ms']:>8.2f} "
+                     f"{timing['p95_ms']:>8.2f} {timing['p99_ms']:>8.2f} {timing['max_ms']:>8.2f}")
+    lines += ['', 'Counters']
+    for name, value in snapshot['counters'].items():
+        lines.append(f'  {name.ljust(width)} {value:>7}')
+    lines += ['', 'Gauges']
+    for name, value in snapshot['gauges'].items():
+        lines.append(f'  {name.ljust(width)} {value:>7.3f}' if isinstance(value, float) else f'  {name.ljust(width)} {value!s:>7}')
+    return '\n'.join(lines)
@@ -0,0 +1,196 @@
+# Platforms that can reword text, behind one interface.
+# A provider knows how to build a request for its platform, parse the reply (whole or streamed),
+# classify failed responses, and which rate limits to start from. Everything else (sessions,
+# timeouts, retries, rate limiting) is shared and lives in the add-on itself.
+#
+# `platform_index` in the config is a position in PROVIDERS, so new providers are only ever appended.
+
+from typing import List, Optional
+import requests
+from . import retry
+from .retry import RewordingError
+
+DEFAULT_CONTEXT = ("You are a helpful flashcard assistant. Rewrite the following text to be slightly different, while "
+                   "preserving the core meaning and any special formatting like cloze deletions (e.g., {{c1::text}}). "
+                   "Do not add any conversational text or markdown formatting.")
+
+class Provider:
+
+    name = ''                  # Shown in the platform dropdown.
+    slug = ''                  # Used in metric names.
+    models: List[str] = []     # Offered in the model dropdown; if empty, any model name can be typed in.
+    default_model = ''
+    base_url = ''
+    configurable_url = False   # Whether the base URL is a setting.
+    requests_per_minute = 0.0  # Starting rate limits; 0 for none.
+    tokens_per_minute = 0.0
+
+    # Settings for this platform, as stored in `platform_configs`.
+    def default_config(self) -> dict:
+        config = {"api_key": "",
+                  "extra_api_keys": [],
+                  "use_as_fallback": False,
+                  "model": self.default_model,
+                  "context": DEFAULT_CONTEXT,
+                  "max_renders": 3,
+                  "num_retries": 3,
+                  "retry_delay_seconds": 1.0,
+                  "requests_per_minute": self.requests_per_minute,
+                  "tokens_per_minute": self.tokens_per_minute}
+        if self.configurable_url:
+            config["base_url"] = self.base_url
+        return config
+
+    def get_base_url(self, settings: dict) -> str:
+        return ((settings.get("base_url") if self.configurable_url else None) or self.base_url).rstrip('/')
+
+    # Identifies the session to reuse for requests with these settings.
+    def session_key(self, settings: dict) -> str:
+        return f'{self.get_base_url(settings)} {settings.get("api_key", "")}'
+
+    def headers(self, settings: dict) -> dict:
+        raise NotImplementedError
+
+    def url(self, settings: dict, stream: bool = False) -> str:
+        raise NotImplementedError
+
+    def build_request(self, text: str, context: str, model: str, json_output: bool = False, stream: bool = False) -> dict:
+        raise NotImplementedError
+
+    # The text of a complete reply. May raise ValueError, KeyError, IndexError or TypeError on malformed replies.
+    def parse_response(self, body: dict) -> str:
+        raise NotImplementedError
+
+    # The text carried by one server-sent event of a streamed reply.
+    def parse_chunk(self, chunk: dict) -> str:
+        raise NotImplementedError
+
+    def classify_response(self, response: requests.Response) -> RewordingError:
+        return retry.classify_response(response)
+
+# The chat completions API, as spoken by OpenAI and by most servers that host models locally.
+class OpenAICompatibleProvider(Provider):
+
+    name = 'OpenAI-compatible (local)'
+    slug = 'openai'
+    base_url = 'http://localhost:8080/v1'
+    configurable_url = True
+
+    def headers(self, settings: dict) -> dict:
+        headers = {'Content-Type': 'application/json', 'Accept': 'application/json'}
+        # Local servers usually need no key at all.
+        if settings.get("api_key"):
+            headers['Authorization'] = 'Bearer ' + settings["api_key"]
+        return headers
+
+    def url(self, settings: dict, stream: bool = False) -> str:
+        return self.get_base_url(settings) + '/chat/completions'
+
+    def build_request(self, text: str, context: str, model: str, json_output: bool = False, stream: bool = False) -> dict:
+        return {'model': model,
+                'messages': [
+                    {'role': 'system', 'content': context},
+                    {'role': 'user', 'content': text}
+                ],
+                **({'response_format': {'type': 'json_object'}} if json_output else {}),
+                **({'stream': True} if stream else {})}
+
+    def parse_response(self, body: dict) -> str:
+        return body['choices'][0]['message']['content']
+
+    def parse_chunk(self, chunk: dict) -> str:
+        return (chunk['choices'][0]['delta'].get('content') or '') if chunk['choices'] else ''
+
+class MistralProvider(OpenAICompatibleProvider):
+
+    name = 'Mistral AI (Mistral)'
+    slug = 'mistral'
+    models = [
+        "mistral-small-latest",
+        "mistral-medium-latest",
+        "mistral-large-latest",
+        "ministral-3b-latest",
+        "ministral-8b-latest",
+        "ministral-14b-latest",
+        "open-mistral-nemo",
+        "open-mixtral-8x7b",
+        "open-mixtral-8x22b",
+    ]
+    default_model = 'mistral-medium-latest'
+    base_url = 'https://api.mistral.ai/v1'
+    configurable_url = False
+    requests_per_minute = 60
+    tokens_per_minute = 500000
+
+    def headers(self, settings: dict) -> dict:
+        return {'Content-Type': 'application/json',
+                'Accept': 'application/json',
+                'Authorization': 'Bearer ' + settings.get("api_key", "")}
+
+    # Mistral's streams have no empty `choices`, so a missing one is a malformed reply.
+    def parse_chunk(self, chunk: dict) -> str:
+        return chunk['choices'][0]['delta'].get('content') or ''
+
+class GeminiProvider(Provider):
+
+    name = 'Gemini (Google)'
+    slug = 'gemini'
+    models = [
+        "gemini-3.5-flash",
+        "gemini-3.5-flash-lite",
+        "gemini-3.1-pro",
+        "gemini-3.1-flash-lite",
+        "gemini-3-pro",
+        "gemini-3-flash",
+        "gemini-2.5-pro",
+        "gemini-2.5-flash",
+        "gemini-2.5-flash-lite",
+        "gemini-2.0-flash",
+        "gemini-2.0-flash-lite",
+    ]
+    default_model = 'gemini-3.5-flash'
+    base_url = 'https://generativelanguage.googleapis.com/v1beta'
+    requests_per_minute = 10
+    tokens_per_minute = 250000
+
+    def headers(self, settings: dict) -> dict:
+        return {'Content-Type': 'application/json', 'X-goog-api-key': settings.get("api_key", "")}
+
+    def url(self, settings: dict, stream: bool = False) -> str:
+        method = 'streamGenerateContent?alt=sse' if stream else 'generateContent'
+        return f'{self.get_base_url(settings)}/models/{settings.get("model")}:{method}'
+
+    def build_request(self, text: str, context: str, model: str, json_output: bool = False, stream: bool = False) -> dict:
+        return {'contents': [{
+                    'parts': [{'text': text}]
+                }],
+                'system_instruction': {
+                    'parts': [{'text': context}]
+                },
+                'generationConfig': {
+                    'thinkingConfig': {
+                        'thinkingBudget': 0 # prefer fast models, this will error with CoT/reasoning models
+                    },
+                    **({'responseMimeType': 'application/json'} if json_output else {})
+                }}
+
+    def parse_response(self, body: dict) -> str:
+        return body['candidates'][0]['content']['parts'][0]['text']
+
+    # The last chunk may carry only the finish reason, without any text.
+    def parse_chunk(self, chunk: dict) -> str:
+        return ''.join(part.get('text', '') for part in chunk['candidates'][0].get('content', {}).get('parts', []))
+
+PROVIDERS: List[Provider] = []
+
+# Make a provider available; returns its platform index.
+def register(provider: Provider) -> int:
+    PROVIDERS.append(provider)
+    return len(PROVIDERS) - 1
+
+def get(platform_index: int) -> Optional[Provider]:
+    return PROVIDERS[platform_index] if 0 <= platform_index < len(PROVIDERS) else None
+
+register(MistralProvider())
+register(GeminiProvider())
+register(OpenAICompatibleProvider())
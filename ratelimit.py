@@ -0,0 +1,82 @@
+# Token-bucket rate limiting for the LLM platforms.
+# Nothing here sleeps: callers ask how long they would have to wait and
+# schedule their work for later instead of blocking a worker.
+
+from typing import Optional
+import threading
+import time
+
+# Rough token estimate for a piece of text (about four characters per token).
+def estimate_tokens(text: Optional[str]) -> int:
+    return len(text) // 4 + 1 if text else 1
+
+class TokenBucket:
+
+    # `rate_per_minute` tokens are added back to the bucket each minute, up to
+    # a full minute's worth. A rate of zero or less means unlimited.
+    def __init__(self, rate_per_minute: float):
+        self.rate_per_minute = rate_per_minute
+        self.level = float(rate_per_minute)
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        if self.rate_per_minute > 0:
+            self.level = min(float(self.rate_per_minute),
+                             self.level + (now - self.updated) * self.rate_per_minute / 60.0)
+        self.updated = now
+
+    def set_rate(self, rate_per_minute: float, now: float):
+        if rate_per_minute != self.rate_per_minute:
+            self._refill(now)
+            self.rate_per_minute = rate_per_minute
+            self.level = min(self.level, float(rate_per_minute))
+
+    # Seconds until `amount` can be taken from the bucket (zero if it can be taken now).
+    # Requests larger than the bucket only have to wait for a full bucket.
+    def wait_time(self, amount: float, now: float) -> float:
+        if self.rate_per_minute <= 0:
+            return 0.0
+        self._refill(now)
+        amount = min(amount, self.rate_per_minute)
+        if self.level >= amount:
+            return 0.0
+        return (amount - self.level) * 60.0 / self.rate_per_minute
+
+    # Take `amount` from the bucket. The level may go negative, in which case
+    # later requests wait for the debt to be paid back.
+    def consume(self, amount: float, now: float):
+        if self.rate_per_minute > 0:
+            self._refill(now)
+            self.level -= amount
+
+class PlatformRateLimiter:
+
+    # Requests and tokens are limited separately; a request may only go
+    # out once both buckets can cover it.
+    def __init__(self, requests_per_minute: float = 0, tokens_per_minute: float = 0):
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+        self.blocked_until = 0.0
+        self.lock = threading.Lock()
+
+    def configure(self, requests_per_minute: float, tokens_per_minute: float):
+        with self.lock:
+            now = time.monotonic()
+            self.requests.set_rate(requests_per_minute, now)
+            self.tokens.set_rate(tokens_per_minute, now)
+
+    # Try to reserve one request costing `tokens`. Returns zero if the
+    # reservation was made, or else the number of seconds to wait before trying again.
+    def try_acquire(self, tokens: int) -> float:
+        with self.lock:
+            now = time.monotonic()
+            delay = max(self.requests.wait_time(1, now), self.tokens.wait_time(tokens, now), self.blocked_until - now)
+            if delay <= 0:
+                self.requests.consume(1, now)
+                self.tokens.consume(tokens, now)
+            return delay
+
+    # Hand out no reservations for `seconds`, e.g. when the platform says its quota is used up.
+    def block_for(self, seconds: float):
+        with self.lock:
+            self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
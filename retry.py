@@ -0,0 +1,154 @@
+# Failure classification and retry timing for rewording requests.
+# Retries are never slept on; callers get a delay and schedule the retry themselves.
+
+from typing import Optional, Tuple
+from email.utils import parsedate_to_datetime
+import random
+import time
+import re
+import requests
+
+# Kinds of failures. Only some are worth retrying.
+AUTH = 'auth'                     # Bad or missing API key; retrying will not help.
+RATE_LIMIT = 'rate_limit'         # 429; wait for the platform's quota to come back.
+SERVER = 'server'                 # 5xx; usually transient.
+TIMEOUT = 'timeout'               # Connect or read timeout.
+NETWORK = 'network'               # Connection dropped, DNS failure, etc.
+INVALID_OUTPUT = 'invalid_output' # The model replied, but the reply was malformed or failed validation.
+CLIENT = 'client'                 # Any other 4xx (bad model name, bad request); retrying will not help.
+
+RETRYABLE = {RATE_LIMIT, SERVER, TIMEOUT, NETWORK, INVALID_OUTPUT}
+
+MAX_BACKOFF_SECONDS = 60.0
+MAX_RESET_SECONDS = 3600.0     # Longest wait taken from a rate limit reset header.
+EPOCH_RESET_SECONDS = 86400.0  # Reset values beyond this are Unix timestamps rather than durations.
+RESET_HEADERS = ('x-ratelimit-reset-requests', 'x-ratelimit-reset-tokens', 'x-ratelimit-reset', 'ratelimit-reset')
+
+class RewordingError(RuntimeError):
+
+    def __init__(self, message: str, kind: str, status: Optional[int] = None, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.kind = kind
+        self.status = status
+        self.retry_after = retry_after
+
+    @property
+    def retryable(self) -> bool:
+        return self.kind in RETRYABLE
+
+# Parse a duration such as '37s', '1.5s', '250ms' or '6m0s' into seconds.
+def _parse_duration(value: str) -> Optional[float]:
+    value = value.strip()
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    parts = re.findall(r'([\d.]+)\s*(ms|h|m|s)', value)
+    if not parts:
+        return None
+    scale = {'ms': 0.001, 's': 1.0, 'm': 60.0, 'h': 3600.0}
+    return sum(float(number) * scale[unit] for number, unit in parts)
+
+# Seconds until a `Retry-After` value (either seconds or an HTTP date).
+def _parse_retry_after(value: str) -> Optional[float]:
+    seconds = _parse_duration(value)
+    if seconds is not None:
+        return seconds
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+# Seconds until a rate limit reset value: a duration, or (from some platforms) the Unix time of the reset.
+def _parse_reset(value: str) -> Optional[float]:
+    seconds = _parse_duration(value)
+    if seconds is None:
+        return None
+    if seconds > EPOCH_RESET_SECONDS:
+        seconds = max(0.0, seconds - time.time())
+    return min(seconds, MAX_RESET_SECONDS)
+
+# Find out how long the platform wants us to wait, from the headers or the error body.
+def get_retry_after(response: requests.Response) -> Optional[float]:
+    headers = response.headers
+    if 'retry-after' in headers:
+        seconds = _parse_retry_after(headers['retry-after'])
+        if seconds is not None:
+            return seconds
+    for header in RESET_HEADERS:
+        if header in headers:
+            seconds = _parse_reset(headers[header])
+            if seconds is not None:
+                return seconds
+    # Gemini puts a RetryInfo entry with a `retryDelay` such as '37s' in the error details.
+    try:
+        for detail in response.json()['error'].get('details', []):
+            if 'retryDelay' in detail:
+                return _parse_duration(detail['retryDelay'])
+    except (ValueError, KeyError, TypeError, AttributeError):
+        pass
+    return None
+
+# How much quota a key has left, and the seconds until it is topped up, from the headers of any response.
+# The body is never read, so this is safe on streamed responses. Remaining is None if the platform does not say.
+def get_remaining_quota(response: requests.Response) -> Tuple[Optional[int], Optional[float]]:
+    headers = response.headers
+    remaining = None
+    for header in ('x-ratelimit-remaining-requests', 'x-ratelimit-remaining-tokens', 'x-ratelimit-remaining'):
+        if header in headers:
+            try:
+                value = int(float(headers[header]))
+            except ValueError:
+                continue
+            remaining = value if remaining is None else min(remaining, value)
+    reset = None
+    for header in RESET_HEADERS:
+        if header in headers:
+            reset = _parse_reset(headers[header])
+            if reset is not None:
+                break
+    return remaining, reset
+
+# Human-readable message from an error response of either platform.
+def get_error_message(response: requests.Response) -> str:
+    try:
+        body = response.json()
+        if isinstance(body.get('error'), dict):
+            return str(body['error'].get('message'))
+        for key in ('message', 'detail', 'error'):
+            if body.get(key):
+                return str(body[key])
+    except (ValueError, AttributeError):
+        pass
+    return f'Unspecified error ({response.status_code})'
+
+def classify_response(response: requests.Response) -> RewordingError:
+    status = response.status_code
+    message = get_error_message(response)
+    if status in (401, 403):
+        return RewordingError(f'Unauthorized ({status}): {message}. Please check your API key.', AUTH, status)
+    if status == 429:
+        return RewordingError(f'Rate limited: {message}', RATE_LIMIT, status, get_retry_after(response))
+    if status >= 500:
+        return RewordingError(f'Server error ({status}): {message}', SERVER, status, get_retry_after(response))
+    if status == 408:
+        return RewordingError(f'Request timed out: {message}', TIMEOUT, status)
+    return RewordingError(message, CLIENT, status)
+
+def classify_exception(e: requests.exceptions.RequestException) -> RewordingError:
+    if isinstance(e, requests.exceptions.Timeout):
+        return RewordingError(f'Request timed out: {e}', TIMEOUT)
+    if isinstance(e, requests.exceptions.ConnectionError):
+        return RewordingError(f'Connection failed: {e}', NETWORK)
+    return RewordingError(str(e), CLIENT)
+
+# Seconds to wait before retry number `attempt` (starting at 1). Rate limits and server errors back
+# off exponentially from `base_delay` with jitter, unless the platform said how long to wait.
+# Invalid output is retried right away, since the platform itself is fine.
+def get_retry_delay(error: RewordingError, attempt: int, base_delay: float) -> float:
+    if error.retry_after is not None:
+        return error.retry_after + random.uniform(0, max(base_delay, 0.1))
+    if error.kind == INVALID_OUTPUT:
+        return 0.0
+    backoff = min(MAX_BACKOFF_SECONDS, max(base_delay, 0.1) * 2 ** (attempt - 1))
+    return random.uniform(backoff / 2, backoff)
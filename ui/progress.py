@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+
+################################################################################
+## Form generated from reading UI file 'progressXbTnRq.ui'
+##
+## Created by: Qt User Interface Compiler version 6.4.3
+##
+## WARNING! All changes made in this file will be lost when recompiling UI file!
+################################################################################
+
+from aqt.qt import *
+
+class Ui_Dialog(object):
+    def setupUi(self, Dialog: QDialog):
+        if not Dialog.objectName():
+            Dialog.setObjectName(u"Dialog")
+        Dialog.resize(460, 150)
+        Dialog.setMinimumSize(360, 130)
+        self.verticalLayout = QVBoxLayout(Dialog)
+        self.verticalLayout.setSpacing(10)
+        self.verticalLayout.setObjectName(u"verticalLayout")
+        self.verticalLayout.setContentsMargins(10, 10, 10, 10)
+        self.statusLabel = QLabel(Dialog)
+        self.statusLabel.setObjectName(u"statusLabel")
+        self.statusLabel.setWordWrap(True)
+
+        self.verticalLayout.addWidget(self.statusLabel)
+
+        self.progressBar = QProgressBar(Dialog)
+        self.progressBar.setObjectName(u"progressBar")
+        self.progressBar.setMinimum(0)
+        self.progressBar.setMaximum(0)
+
+        self.verticalLayout.addWidget(self.progressBar)
+
+        self.detailsLabel = QLabel(Dialog)
+        self.detailsLabel.setObjectName(u"detailsLabel")
+        self.detailsLabel.setWordWrap(True)
+
+        self.verticalLayout.addWidget(self.detailsLabel)
+
+        self.buttonLayout = QHBoxLayout()
+        self.buttonLayout.setObjectName(u"buttonLayout")
+        self.buttonLayout.addStretch(1)
+        self.cancelButton = QPushButton(Dialog)
+        self.cancelButton.setObjectName(u"cancelButton")
+
+        self.buttonLayout.addWidget(self.cancelButton)
+
+        self.verticalLayout.addLayout(self.buttonLayout)
+
+
+        self.retranslateUi(Dialog)
+
+        QMetaObject.connectSlotsByName(Dialog)
+    # setupUi
+
+    def retranslateUi(self, Dialog):
+        Dialog.setWindowTitle(QCoreApplication.translate("Dialog", u"Generating dynamic rewordings", None))
+        self.statusLabel.setText(QCoreApplication.translate("Dialog", u"Looking up notes...", None))
+        self.detailsLabel.setText("")
+        self.cancelButton.setText(QCoreApplication.translate("Dialog", u"Cancel", None))
+    # retranslateUi
@@ -9,7 +9,8 @@
 ################################################################################
 
 from aqt.qt import *
-from ..config import PLATFORMS, MODELS
+from ..providers import PROVIDERS
+from ..credentials import parse_api_keys, format_api_keys
 
 class Ui_Dialog(object):
     def setupUi(self, Dialog: QDialog):
@@ -117,7 +118,8 @@ class Ui_Dialog(object):
         self.platformSelectLabel = QLabel(self.verticalLayoutWidget)
         self.platformSelect = QComboBox(self.verticalLayoutWidget)
         self.platformSelect.setObjectName(u"platformSelect")
-        self.platformSelect.addItems(PLATFORMS)
+        self.platformSelect.addItems([provider.name for provider in PROVIDERS])
+        self.current_platform_index = None # Platform whose settings are in the fields below.
         self.formLayout.setWidget(0, QFormLayout.ItemRole.LabelRole, self.platformSelectLabel)
         self.formLayout.setWidget(0, QFormLayout.ItemRole.FieldRole, self.platformSelect)
 
@@ -180,6 +182,46 @@ class Ui_Dialog(object):
 
         self.formLayout.setWidget(6, QFormLayout.ItemRole.FieldRole, self.retryDelayLineEdit)
 
+        self.requestsPerMinuteLabel = QLabel(self.verticalLayoutWidget)
+        self.requestsPerMinuteLabel.setObjectName(u"requestsPerMinuteLabel")
+
+        self.formLayout.setWidget(7, QFormLayout.ItemRole.LabelRole, self.requestsPerMinuteLabel)
+
+        self.requestsPerMinuteLineEdit = QLineEdit(self.verticalLayoutWidget)
+        self.requestsPerMinuteLineEdit.setObjectName(u"requestsPerMinuteLineEdit")
+
+        self.formLayout.setWidget(7, QFormLayout.ItemRole.FieldRole, self.requestsPerMinuteLineEdit)
+
+        self.tokensPerMinuteLabel = QLabel(self.verticalLayoutWidget)
+        self.tokensPerMinuteLabel.setObjectName(u"tokensPerMinuteLabel")
+
+        self.formLayout.setWidget(8, QFormLayout.ItemRole.LabelRole, self.tokensPerMinuteLabel)
+
+        self.tokensPerMinuteLineEdit = QLineEdit(self.verticalLayoutWidget)
+        self.tokensPerMinuteLineEdit.setObjectName(u"tokensPerMinuteLineEdit")
+
+        self.formLayout.setWidget(8, QFormLayout.ItemRole.FieldRole, self.tokensPerMinuteLineEdit)
+
+        self.baseUrlLabel = QLabel(self.verticalLayoutWidget)
+        self.baseUrlLabel.setObjectName(u"baseUrlLabel")
+
+        self.formLayout.setWidget(9, QFormLayout.ItemRole.LabelRole, self.baseUrlLabel)
+
+        self.baseUrlLineEdit = QLineEdit(self.verticalLayoutWidget)
+        self.baseUrlLineEdit.setObjectName(u"baseUrlLineEdit")
+
+        self.formLayout.setWidget(9, QFormLayout.ItemRole.FieldRole, self.baseUrlLineEdit)
+
+        self.fallbackLabel = QLabel(self.verticalLayoutWidget)
+        self.fallbackLabel.setObjectName(u"fallbackLabel")
+
+        self.formLayout.setWidget(10, QFormLayout.ItemRole.LabelRole, self.fallbackLabel)
+
+        self.fallbackCheckBox = QCheckBox(self.verticalLayoutWidget)
+        self.fallbackCheckBox.setObjectName(u"fallbackCheckBox")
+
+        self.formLayout.setWidget(10, QFormLayout.ItemRole.FieldRole, self.fallbackCheckBox)
+
         self.pauseDynamicCardGeneration = QLabel(self.verticalLayoutWidget)
         self.pauseDynamicCardGeneration.setObjectName(u"excludeUnexcludeCurrentCardTypeLabel_2")
 
@@ -209,10 +251,85 @@ class Ui_Dialog(object):
 
         self.verticalLayout.addWidget(self.checkBox)
 
+        self.formLayout_2 = QFormLayout()
+        self.formLayout_2.setObjectName(u"formLayout_2")
+        self.prefetchLookaheadLabel = QLabel(self.verticalLayoutWidget)
+        self.prefetchLookaheadLabel.setObjectName(u"prefetchLookaheadLabel")
+
+        self.formLayout_2.setWidget(0, QFormLayout.ItemRole.LabelRole, self.prefetchLookaheadLabel)
+
+        self.prefetchLookaheadLineEdit = QLineEdit(self.verticalLayoutWidget)
+        self.prefetchLookaheadLineEdit.setObjectName(u"prefetchLookaheadLineEdit")
+
+        self.formLayout_2.setWidget(0, QFormLayout.ItemRole.FieldRole, self.prefetchLookaheadLineEdit)
+
+        self.numWorkersLabel = QLabel(self.verticalLayoutWidget)
+        self.numWorkersLabel.setObjectName(u"numWorkersLabel")
+
+        self.formLayout_2.setWidget(1, QFormLayout.ItemRole.LabelRole, self.numWorkersLabel)
+
+        self.numWorkersLineEdit = QLineEdit(self.verticalLayoutWidget)
+        self.numWorkersLineEdit.setObjectName(u"numWorkersLineEdit")
+
+        self.formLayout_2.setWidget(1, QFormLayout.ItemRole.FieldRole, self.numWorkersLineEdit)
+
+        self.firstViewDeadlineLabel = QLabel(self.verticalLayoutWidget)
+        self.firstViewDeadlineLabel.setObjectName(u"firstViewDeadlineLabel")
+
+        self.formLayout_2.setWidget(2, QFormLayout.ItemRole.LabelRole, self.firstViewDeadlineLabel)
+
+        self.firstViewDeadlineLineEdit = QLineEdit(self.verticalLayoutWidget)
+        self.firstViewDeadlineLineEdit.setObjectName(u"firstViewDeadlineLineEdit")
+
+        self.formLayout_2.setWidget(2, QFormLayout.ItemRole.FieldRole, self.firstViewDeadlineLineEdit)
+
+        self.cacheSizeLimitLabel = QLabel(self.verticalLayoutWidget)
+        self.cacheSizeLimitLabel.setObjectName(u"cacheSizeLimitLabel")
+
+        self.formLayout_2.setWidget(3, QFormLayout.ItemRole.LabelRole, self.cacheSizeLimitLabel)
+
+        self.cacheSizeLimitLineEdit = QLineEdit(self.verticalLayoutWidget)
+        self.cacheSizeLimitLineEdit.setObjectName(u"cacheSizeLimitLineEdit")
+
+        self.formLayout_2.setWidget(3, QFormLayout.ItemRole.FieldRole, self.cacheSizeLimitLineEdit)
+
+
+        self.verticalLayout.addLayout(self.formLayout_2)
+
         self.verticalSpacer_4 = QSpacerItem(20, 5, QSizePolicy.Policy.Minimum, QSizePolicy.Policy.Fixed)
 
         self.verticalLayout.addItem(self.verticalSpacer_4)
 
+        self.cacheLabel = QLabel(self.verticalLayoutWidget)
+        self.cacheLabel.setObjectName(u"cacheLabel")
+        sizePolicy1.setHeightForWidth(self.cacheLabel.sizePolicy().hasHeightForWidth())
+        self.cacheLabel.setSizePolicy(sizePolicy1)
+
+        self.verticalLayout.addWidget(self.cacheLabel)
+
+        self.cacheButtonLayout = QHBoxLayout()
+        self.cacheButtonLayout.setObjectName(u"cacheButtonLayout")
+        self.exportCacheButton = QPushButton(self.verticalLayoutWidget)
+        self.exportCacheButton.setObjectName(u"exportCacheButton")
+
+        self.cacheButtonLayout.addWidget(self.exportCacheButton)
+
+        self.importCacheButton = QPushButton(self.verticalLayoutWidget)
+        self.importCacheButton.setObjectName(u"importCacheButton")
+
+        self.cacheButtonLayout.addWidget(self.importCacheButton)
+
+        self.cacheButtonSpacer = QSpacerItem(40, 20, QSizePolicy.Policy.Expanding, QSizePolicy.Policy.Minimum)
+
+        self.cacheButtonLayout.addItem(self.cacheButtonSpacer)
+
+
+        self.verticalLayout.addLayout(self.cacheButtonLayout)
+
+        self.verticalSpacer_7 = QSpacerItem(20, 5, QSizePolicy.Policy.Minimum, QSizePolicy.Policy.Fixed)
+
+        self.verticalLayout.addItem(self.verticalSpacer_7)
+
         self.label_4 = QLabel(self.verticalLayoutWidget)
         self.label_4.setObjectName(u"label_4")
         sizePolicy1.setHeightForWidth(self.label_4.sizePolicy().hasHeightForWidth())
@@ -244,7 +361,44 @@ class Ui_Dialog(object):
         self.buttonBox.setStandardButtons(QDialogButtonBox.StandardButton.Cancel|QDialogButtonBox.StandardButton.Ok)
 
         self.scrollArea.setWidget(self.verticalLayoutWidget)
-        self.mainLayout.addWidget(self.scrollArea)
+
+        self.statsTab = QWidget()
+        self.statsTab.setObjectName(u"statsTab")
+        self.statsLayout = QVBoxLayout(self.statsTab)
+        self.statsLayout.setObjectName(u"statsLayout")
+        self.statsTextEdit = QPlainTextEdit(self.statsTab)
+        self.statsTextEdit.setObjectName(u"statsTextEdit")
+        self.statsTextEdit.setReadOnly(True)
+        self.statsTextEdit.setLineWrapMode(QPlainTextEdit.LineWrapMode.NoWrap)
+        self.statsTextEdit.setFont(QFontDatabase.systemFont(QFontDatabase.SystemFont.FixedFont))
+
+        self.statsLayout.addWidget(self.statsTextEdit)
+
+        self.statsButtonLayout = QHBoxLayout()
+        self.statsButtonLayout.setObjectName(u"statsButtonLayout")
+        self.resetStatsButton = QPushButton(self.statsTab)
+        self.resetStatsButton.setObjectName(u"resetStatsButton")
+
+        self.statsButtonLayout.addWidget(self.resetStatsButton)
+
+        self.statsButtonSpacer = QSpacerItem(40, 20, QSizePolicy.Policy.Expanding, QSizePolicy.Policy.Minimum)
+
+        self.statsButtonLayout.addItem(self.statsButtonSpacer)
+
+        self.exportStatsButton = QPushButton(self.statsTab)
+        self.exportStatsButton.setObjectName(u"exportStatsButton")
+
+        self.statsButtonLayout.addWidget(self.exportStatsButton)
+
+
+        self.statsLayout.addLayout(self.statsButtonLayout)
+
+        self.tabWidget = QTabWidget(Dialog)
+        self.tabWidget.setObjectName(u"tabWidget")
+        self.tabWidget.addTab(self.scrollArea, "")
+        self.tabWidget.addTab(self.statsTab, "")
+
+        self.mainLayout.addWidget(self.tabWidget)
         self.mainLayout.addWidget(self.buttonBox)
 
 
@@ -270,35 +424,53 @@ class Ui_Dialog(object):
         # This function is now responsible for all platform-specific settings
         
         # 1. Save settings for the *previous* platform before switching
-        # The check for `self.modelComboBox.count() > 0` prevents saving empty
-        # data when the dialog is first loading.
-        if self.modelComboBox.count() > 0:
-            previous_index = 1 - new_index
-            prev_platform_settings = self.dialog.settings.platform_configs[previous_index]
-
-            prev_platform_settings["api_key"] = self.APIKeyLineEdit.text()
+        # There is none yet when the dialog is first loading.
+        if self.current_platform_index is not None and self.current_platform_index != new_index:
+            prev_platform_settings = self.dialog.settings.platform_configs[self.current_platform_index]
+
+            keys = parse_api_keys(self.APIKeyLineEdit.text())
+            prev_platform_settings["api_key"] = keys[0] if keys else ""
+            prev_platform_settings["extra_api_keys"] = keys[1:]
+            prev_platform_settings["use_as_fallback"] = self.fallbackCheckBox.isChecked()
+            if PROVIDERS[self.current_platform_index].configurable_url:
+                prev_platform_settings["base_url"] = self.baseUrlLineEdit.text().strip()
             prev_platform_settings["model"] = self.modelComboBox.currentText()
             prev_platform_settings["context"] = self.textEdit.toPlainText()
             try:
                 prev_platform_settings["max_renders"] = int(self.maxRendersLineEdit.text())
                 prev_platform_settings["num_retries"] = int(self.retryCountLineEdit.text())
                 prev_platform_settings["retry_delay_seconds"] = float(self.retryDelayLineEdit.text())
+                prev_platform_settings["requests_per_minute"] = float(self.requestsPerMinuteLineEdit.text())
+                prev_platform_settings["tokens_per_minute"] = float(self.tokensPerMinuteLineEdit.text())
             except ValueError:
                 # Silently ignore invalid values on switch; they'll be handled on 'OK'
                 pass
 
         # 2. Load settings for the *new* platform
-        new_platform_settings = self.dialog.settings.platform_configs[new_index]
+        self.load_platform(new_index, self.dialog.settings.platform_configs[new_index])
+
+    # Fill the platform-specific fields with the settings of the platform at `index`.
+    def load_platform(self, index: int, new_platform_settings: dict):
+        provider = PROVIDERS[index]
+        self.current_platform_index = index
 
+        # Platforms without a known list of models (e.g. local servers) take any model name.
         self.modelComboBox.clear()
-        self.modelComboBox.addItems(MODELS[new_index])
-        
-        self.APIKeyLineEdit.setText(new_platform_settings.get("api_key", ""))
+        self.modelComboBox.setEditable(not provider.models)
+        self.modelComboBox.addItems(provider.models)
+        self.baseUrlLineEdit.setEnabled(provider.configurable_url)
+        self.baseUrlLineEdit.setText(new_platform_settings.get("base_url", provider.base_url)
+                                     if provider.configurable_url else provider.base_url)
+
+        self.APIKeyLineEdit.setText(format_api_keys(new_platform_settings))
+        self.fallbackCheckBox.setChecked(bool(new_platform_settings.get("use_as_fallback", False)))
         self.modelComboBox.setCurrentText(new_platform_settings.get("model", ""))
         self.textEdit.setText(new_platform_settings.get("context", ""))
         self.maxRendersLineEdit.setText(str(new_platform_settings.get("max_renders", 3)))
         self.retryCountLineEdit.setText(str(new_platform_settings.get("num_retries", 3)))
         self.retryDelayLineEdit.setText(str(new_platform_settings.get("retry_delay_seconds", 1.0)))
+        self.requestsPerMinuteLineEdit.setText(str(new_platform_settings.get("requests_per_minute", 0)))
+        self.tokensPerMinuteLineEdit.setText(str(new_platform_settings.get("tokens_per_minute", 0)))
 
     def _fitToScreen(self, Dialog: QDialog):
         max_width = 980
@@ -326,15 +498,33 @@ class Ui_Dialog(object):
         self.pauseDynamicCardGeneration.setText(QCoreApplication.translate("Dialog", u"Pause dynamic card generation", None))
         self.label_2.setText(QCoreApplication.translate("Dialog", u"<b>LLM Functionality</b>", None))
         self.maxRendersLabel.setText(QCoreApplication.translate("Dialog", u"Max renders", None))
-        self.mistralAPIKeyLabel.setText(QCoreApplication.translate("Dialog", u"API key", None))
+        self.mistralAPIKeyLabel.setText(QCoreApplication.translate("Dialog", u"API keys", None))
+        self.APIKeyLineEdit.setPlaceholderText(QCoreApplication.translate("Dialog", u"One or more keys, separated by commas", None))
         self.mistralModelLabel.setText(QCoreApplication.translate("Dialog", u"Model", None))
         self.contextLabel.setText(QCoreApplication.translate("Dialog", u"Context", None))
         self.label_6.setText(QCoreApplication.translate("Dialog", u"<b>Review Behavior</b>", None))
         self.checkBox.setText(QCoreApplication.translate("Dialog", u"Clear cache on review end", None))
+        self.prefetchLookaheadLabel.setText(QCoreApplication.translate("Dialog", u"Prefetch lookahead (cards)", None))
+        self.cacheLabel.setText(QCoreApplication.translate("Dialog", u"<b>Rewordings</b> (to share between computers or profiles)", None))
+        self.exportCacheButton.setText(QCoreApplication.translate("Dialog", u"Export...", None))
+        self.importCacheButton.setText(QCoreApplication.translate("Dialog", u"Import...", None))
         self.label_4.setText(QCoreApplication.translate("Dialog", u"<b>Excluded Note Types</b> (double-click entry to remove)", None))
         self.label_5.setText(QCoreApplication.translate("Dialog", u"<a href='https://github.com/Petronian/dynamic-cards'>Need usage instructions? Click here!</a>", None))
         self.retryCountLabel.setText(QCoreApplication.translate("Dialog", u"Retry count", None))
         self.retryDelayLabel.setText(QCoreApplication.translate("Dialog", u"Retry delay (sec)", None))
+        self.requestsPerMinuteLabel.setText(QCoreApplication.translate("Dialog", u"Requests per minute", None))
+        self.tokensPerMinuteLabel.setText(QCoreApplication.translate("Dialog", u"Tokens per minute", None))
+        self.baseUrlLabel.setText(QCoreApplication.translate("Dialog", u"Base URL", None))
+        self.fallbackLabel.setText(QCoreApplication.translate("Dialog", u"Use as fallback", None))
+        self.fallbackCheckBox.setToolTip(QCoreApplication.translate("Dialog", u"Send rewordings here when every key of the selected platform is rate limited", None))
+        self.numWorkersLabel.setText(QCoreApplication.translate("Dialog", u"Concurrent requests", None))
+        self.firstViewDeadlineLabel.setText(QCoreApplication.translate("Dialog", u"First view wait (ms)", None))
+        self.cacheSizeLimitLabel.setText(QCoreApplication.translate("Dialog", u"Cache size limit (MB)", None))
+        self.cacheSizeLimitLineEdit.setToolTip(QCoreApplication.translate("Dialog", u"Least recently used rewordings are removed beyond this size; 0 for no limit", None))
+        self.resetStatsButton.setText(QCoreApplication.translate("Dialog", u"Reset", None))
+        self.exportStatsButton.setText(QCoreApplication.translate("Dialog", u"Export JSON...", None))
+        self.tabWidget.setTabText(self.tabWidget.indexOf(self.scrollArea), QCoreApplication.translate("Dialog", u"Settings", None))
+        self.tabWidget.setTabText(self.tabWidget.indexOf(self.statsTab), QCoreApplication.translate("Dialog", u"Stats", None))
 
         __sortingEnabled = self.listWidget.isSortingEnabled()
         self.listWidget.setSortingEnabled(False)